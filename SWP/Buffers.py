@@ -0,0 +1,221 @@
+import numpy as np
+
+
+"""
+This file contains containers used for data that is produced at every scan (error signals, scanning frequency,
+measured power, etc.). They replace Python's deques, which had to be converted to lists (and then to NumPy arrays)
+every time the data was averaged or plotted.
+"""
+
+
+"""
+Fixed-size FIFO time series kept in a preallocated NumPy array. Every value is written twice, at positions "i" and
+"i+capacity", so the last "capacity" values are always available as one contiguous slice of the array. This way
+"view" returns data without copying it, and appending is done in place. Reductions (mean, min, max) are cached
+until the next append. Indexing works like for a deque, i.e. [0] is the oldest and [-1] the newest value.
+"""
+class RingBuffer:
+
+	def __init__(self,capacity,dtype=np.float64):
+
+		self.capacity=max(int(capacity),1)
+		self._data=np.zeros(2*self.capacity,dtype=dtype)
+		self._pos=0
+		self._count=0
+
+		#X axis used for plotting (0,1,2,...). Created once, sliced to the current length.
+		self._x=np.arange(self.capacity,dtype=np.float64)
+
+		self._cache={}
+
+
+	def __len__(self):
+		return self._count
+
+
+	def __getitem__(self,ind):
+		return self.view()[ind]
+
+
+	def __iter__(self):
+		return iter(self.view())
+
+
+	#Adds a value. If the buffer is full, the oldest value is overwritten.
+	def append(self,value):
+		self._data[self._pos]=value
+		self._data[self._pos+self.capacity]=value
+		self._pos+=1
+		if self._pos==self.capacity:
+			self._pos=0
+		if self._count<self.capacity:
+			self._count+=1
+		self._cache.clear()
+
+
+	def clear(self):
+		self._pos=0
+		self._count=0
+		self._cache.clear()
+
+
+	#Contiguous (zero-copy) view of values from the oldest to the newest. It should not be modified.
+	def view(self):
+		start=self._pos-self._count
+		if start<0:
+			start+=self.capacity
+		return self._data[start:start+self._count]
+
+
+	def last(self):
+		return self._data[self._pos-1+self.capacity]
+
+
+	#X axis matching the current length of the buffer.
+	def x_axis(self):
+		return self._x[:self._count]
+
+
+	def _reduce(self,name,func):
+		try:
+			return self._cache[name]
+		except KeyError:
+			if self._count==0:
+				val=0
+			else:
+				val=func(self.view())
+			self._cache[name]=val
+			return val
+
+
+	def mean(self):
+		return self._reduce('mean',np.mean)
+
+
+	def min(self):
+		return self._reduce('min',np.min)
+
+
+	def max(self):
+		return self._reduce('max',np.max)
+
+
+"""
+Bounded buffer of rows (e.g. of a log file) passed from one producer thread (the scan) to one consumer thread (the
+log writer), without locks. Rows are kept column-wise in a preallocated (fields x capacity) array used as a ring.
+Only the producer changes "_written" and only the consumer changes "_read"; both are plain integers that only grow,
+and the producer increments "_written" after the row is stored, so the consumer never sees a partially written
+row. The consumer takes all rows written so far as at most two contiguous slices per field and releases them after
+they are stored, so nothing has to be swapped and no rows are lost. If the buffer is full, "push" doesn't wait for
+the consumer: the row is dropped and counted.
+"""
+class RowRingBuffer:
+
+	def __init__(self,n_fields,capacity):
+
+		self.capacity=max(int(capacity),1)
+		self._data=np.zeros((n_fields,self.capacity))
+		self._written=0
+		self._read=0
+
+		#Back-pressure statistics: rows dropped because the buffer was full and the highest number of waiting rows.
+		self.dropped=0
+		self.high_water=0
+
+
+	def __len__(self):
+		return self._written-self._read
+
+
+	#Adding a row (called by the producer only). Returns False, if the row was dropped.
+	def push(self,values):
+		n=self._written-self._read
+		if n>=self.capacity:
+			self.dropped+=1
+			return False
+		self._data[:,self._written%self.capacity]=values
+		self._written+=1
+		if n+1>self.high_water:
+			self.high_water=n+1
+		return True
+
+
+	"""
+	Rows waiting in the buffer (called by the consumer only), as a list of (fields x rows) views (one, or two if
+	the rows wrap around the end of the array) and the number of rows. They stay valid until "release" is called.
+	"""
+	def peek(self):
+		start=self._read
+		stop=self._written
+		a=start%self.capacity
+		b=a+stop-start
+		if b<=self.capacity:
+			return [self._data[:,a:b]],stop-start
+		return [self._data[:,a:],self._data[:,:b-self.capacity]],stop-start
+
+
+	#Freeing "n" rows returned by "peek" (called by the consumer only).
+	def release(self,n):
+		self._read+=n
+
+
+	#Fraction of the buffer that is currently used.
+	def fill(self):
+		return (self._written-self._read)/self.capacity
+
+
+"""
+Bounded single-producer/single-consumer buffer of scans (traces and a vector describing the state of the locks),
+working the same way as RowRingBuffer. Slots are preallocated as (capacity x channels x samples), so a scan is
+copied once, into its slot. If only a part of the scan was acquired (adaptive zoom), it's placed from sample "start"
+and the rest of the slot is zeroed.
+"""
+class TraceRingBuffer:
+
+	def __init__(self,capacity,n_channels,n_samples,n_state,dtype=np.float64):
+
+		self.capacity=max(int(capacity),1)
+		self.traces=np.zeros((self.capacity,n_channels,n_samples),dtype=dtype)
+		self.states=np.zeros((self.capacity,n_state))
+		self._written=0
+		self._read=0
+
+		self.dropped=0
+		self.high_water=0
+
+
+	def __len__(self):
+		return self._written-self._read
+
+
+	def push(self,traces,state,start=0):
+		n=self._written-self._read
+		if n>=self.capacity:
+			self.dropped+=1
+			return False
+		ind=self._written%self.capacity
+		slot=self.traces[ind]
+		tr=np.asarray(traces)
+		if tr.shape!=slot.shape:
+			slot[:]=0
+		slot[:tr.shape[0],start:start+tr.shape[1]]=tr
+		self.states[ind]=state
+		self._written+=1
+		if n+1>self.high_water:
+			self.high_water=n+1
+		return True
+
+
+	#Scans waiting in the buffer as a list of (traces, states) views (at most two) and their number.
+	def peek(self):
+		start=self._read
+		stop=self._written
+		a=start%self.capacity
+		b=a+stop-start
+		if b<=self.capacity:
+			return [(self.traces[a:b],self.states[a:b])],stop-start
+		return [(self.traces[a:],self.states[a:]),(self.traces[:b-self.capacity],self.states[:b-self.capacity])],stop-start
+
+
+	def release(self,n):
+		self._read+=n
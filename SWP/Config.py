@@ -9,7 +9,8 @@ def load_conf(filename):
 	config.read(filename)
 	return config
 
-def save_conf(filename,daq_dict,wvm_dict,cav_dict,las1_dict,las2_dict=None):
+#"extra" is an optional dictionary of additional sections (e.g. parameters of the simulated DAQ backend).
+def save_conf(filename,daq_dict,wvm_dict,cav_dict,las1_dict,las2_dict=None,extra=None):
 	config=configparser.ConfigParser()
 	config.optionxform = str
 	config['DAQ']=daq_dict
@@ -18,9 +19,20 @@ def save_conf(filename,daq_dict,wvm_dict,cav_dict,las1_dict,las2_dict=None):
 	config['LASER1']=las1_dict
 	if las2_dict is not None:
 		config['LASER2']=las2_dict
+	if extra is not None:
+		for section,values in extra.items():
+			config[section]=values
 
 	if filename[-4:]!=".ini":
 		filename+='.ini'
 	with open(filename,'w') as configfile:
 		config.write(configfile)
 
+
+
+#Reading an option that might be missing in config files saved by older versions of the program.
+def get_option(config,section,key,fallback):
+	try:
+		return config[section][key]
+	except KeyError:
+		return fallback
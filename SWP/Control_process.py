@@ -0,0 +1,354 @@
+import numpy as np
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import configparser
+import logging
+import queue
+
+from .Data_acq import *
+
+
+"""
+This file contains classes that allow to run acquisition, signal processing and locking in a separate process. In
+the default mode the scan thread shares the GIL with the GUI (Tk, matplotlib), the threads polling NKT lasers and
+the wavemeter thread, so under load lock iterations can be delayed. In the separate process mode:
+	- the control process creates its own Lock, DAQ_tasks and TransferLock objects (using current settings from
+	the GUI) and runs only the "control_step" of the TransferLock in a loop
+	- after every scan, the state of the locks and raw traces are written to a ring buffer in shared memory
+	("SharedTraceRing"), so no data is pickled or copied through pipes
+	- the GUI process reads new records from the ring periodically (using Tk's "after"), updates its own objects
+	that mirror the state of the locks, plots the data and logs it
+	- changes made by the user (engaging locks, moving lockpoints, gains, offset etc.) are sent to the control
+	process as small commands through a queue
+"""
+
+log=logging.getLogger(__name__)
+
+
+"""
+Names of the values describing the state of the locks after a scan. Together with raw traces they make one record
+in the ring buffer. Values for slave lasers are given for both lasers (they are 0 if there's only one).
+"""
+STATE_FIELDS=['time','scan_frequency','offset','interval','master_err','master_err_mhz','master_err_rms','master_ctrl','two_peaks','master_locked','scan_index','scan_dt','skipped_scans','overrun']
+SLAVE_FIELDS=['slave_err','slave_err_rms','slave_err_R','slave_ctrl','voltage','R','slave_locked','power']
+for _i in range(2):
+	STATE_FIELDS+=[name+str(_i) for name in SLAVE_FIELDS]
+
+F={name:ind for ind,name in enumerate(STATE_FIELDS)}
+
+
+#Writing the state of the TransferLock object to a vector.
+def pack_state(tl,t,out):
+
+	out[F['time']]=t
+	out[F['scan_frequency']]=tl._scan_frequency.last()
+	out[F['offset']]=tl.daq_tasks.ao_scan.offset
+	out[F['interval']]=tl.lock.interval
+	out[F['master_err']]=tl.lock.master_err
+	out[F['master_err_mhz']]=tl.master_err_history.last()
+	out[F['master_err_rms']]=tl.master_err_rms
+	out[F['master_ctrl']]=tl.lock.master_ctrl
+	out[F['two_peaks']]=tl.two_peaks
+	out[F['master_locked']]=tl.master_locked_flag
+	out[F['scan_index']]=tl.daq_tasks.scan_index
+	out[F['scan_dt']]=tl.daq_tasks.scan_dt
+	out[F['skipped_scans']]=tl.daq_tasks.skipped_scans
+	out[F['overrun']]=tl.daq_tasks.overrun
+
+	for i in range(len(tl.slave_locks_engaged)):
+		s=str(i)
+		out[F['slave_err'+s]]=tl.slave_err_history[i].last()
+		out[F['slave_err_rms'+s]]=tl.slave_err_rms[i]
+		out[F['slave_err_R'+s]]=tl.lock.slave_errs[i]
+		out[F['slave_ctrl'+s]]=tl.lock.slave_ctrls[i]
+		out[F['voltage'+s]]=tl.daq_tasks.ao_laser.voltages[i]
+		out[F['R'+s]]=tl.lock.slave_Rs[i]
+		out[F['slave_locked'+s]]=tl.slave_locked_flags[i].is_set()
+		out[F['power'+s]]=tl.daq_tasks.power_PDs.power[i].last()
+
+
+"""
+Updating TransferLock object in the GUI process (which mirrors the one in the control process) with a record read
+from the ring buffer. Histories are extended the same way as they are in the control process, so plots and logs
+look exactly as if the scan was run in the GUI process. Returns the time of the scan.
+"""
+def apply_state(tl,vec,traces):
+
+	tl._scan_frequency.append(vec[F['scan_frequency']])
+	if tl.daq_tasks.PD_data.shape==traces.shape:
+		tl.daq_tasks.PD_data[:]=traces
+	else:
+		tl.daq_tasks.PD_data=traces.copy()
+	tl.daq_tasks.ao_scan.offset=vec[F['offset']]
+	tl.lock.interval=vec[F['interval']]
+	tl.lock.master_err=vec[F['master_err']]
+	tl.lock.master_ctrl=vec[F['master_ctrl']]
+	tl.two_peaks=bool(vec[F['two_peaks']])
+	tl.master_locked_flag=bool(vec[F['master_locked']])
+
+	#Scan counters are accumulated the same way as in DAQ_tasks._stamp.
+	tasks=tl.daq_tasks
+	tasks.scan_index=int(vec[F['scan_index']])
+	tasks.scan_dt=vec[F['scan_dt']]
+	tasks.skipped_scans=int(vec[F['skipped_scans']])
+	tasks.overrun=bool(vec[F['overrun']])
+	tasks.total_skipped+=tasks.skipped_scans
+	tasks.overruns+=tasks.overrun
+	tl.lock.dt=tasks.scan_dt
+
+	if tl.master_lock_engaged and tl.two_peaks:
+		tl.master_err_history.append(vec[F['master_err_mhz']])
+		tl.master_err_rms=vec[F['master_err_rms']]
+
+	for i in range(len(tl.slave_locks_engaged)):
+		s=str(i)
+		tl.daq_tasks.ao_laser.voltages[i]=vec[F['voltage'+s]]
+		tl.daq_tasks.power_PDs.power[i].append(vec[F['power'+s]])
+		if tl.master_lock_engaged and tl.master_locked_flag and tl.slave_locks_engaged[i]:
+			tl.slave_err_history[i].append(vec[F['slave_err'+s]])
+			tl.slave_err_rms[i]=vec[F['slave_err_rms'+s]]
+			tl.lock.slave_Rs[i]=vec[F['R'+s]]
+			tl.lock.slave_errs[i]=vec[F['slave_err_R'+s]]
+			tl.lock.slave_ctrls[i]=vec[F['slave_ctrl'+s]]
+			if vec[F['slave_locked'+s]]:
+				tl.slave_locked_flags[i].set()
+			else:
+				tl.slave_locked_flags[i].clear()
+
+	return vec[F['time']]
+
+
+#################################################################################################################
+
+
+"""
+Ring buffer of scan records in shared memory. The first value in the memory block is the sequence number of the
+last written record. Then, there are "n_slots" slots; each one starts with the sequence number of the record it
+contains, followed by the state vector and traces (n_channels x n_samples). The writer marks a slot as invalid (-1)
+before writing it, so a reader can detect a record that was overwritten while it was being copied. All values are
+kept as float64 (sequence numbers are exact up to 2^53).
+"""
+class SharedTraceRing:
+
+	def __init__(self,n_slots,n_channels,n_samples,name=None):
+
+		self.n_slots=n_slots
+		self.n_channels=n_channels
+		self.n_samples=n_samples
+
+		self._state_len=len(STATE_FIELDS)
+		self._slot_len=1+self._state_len+n_channels*n_samples
+		size=8*(1+n_slots*self._slot_len)
+
+		#The process that creates the memory block is responsible for removing it.
+		if name is None:
+			self.shm=shared_memory.SharedMemory(create=True,size=size)
+			self._owner=True
+		else:
+			self.shm=shared_memory.SharedMemory(name=name)
+			self._owner=False
+
+		self.name=self.shm.name
+
+		buf=np.ndarray((1+n_slots*self._slot_len,),dtype=np.float64,buffer=self.shm.buf)
+		self._head=buf[:1]
+		self._slots=buf[1:].reshape(n_slots,self._slot_len)
+		if self._owner:
+			buf[:]=0
+
+
+	def head(self):
+		return int(self._head[0])
+
+
+	#If only a part of the scan was acquired (adaptive zoom), it's written from sample "start" and the rest is zeroed.
+	def write(self,state,traces,start=0):
+		seq=int(self._head[0])+1
+		slot=self._slots[seq%self.n_slots]
+		slot[0]=-1
+		slot[1:1+self._state_len]=state
+		tr=np.asarray(traces)
+		block=slot[1+self._state_len:].reshape(self.n_channels,self.n_samples)
+		if tr.shape[1]!=self.n_samples:
+			block[:]=0
+		block[:tr.shape[0],start:start+tr.shape[1]]=tr
+		slot[0]=seq
+		self._head[0]=seq
+
+
+	#Copying record "seq" to given arrays. Returns False, if the record is no longer (or not yet) in the buffer.
+	def read(self,seq,state_out,traces_out):
+		slot=self._slots[seq%self.n_slots]
+		if slot[0]!=seq:
+			return False
+		state_out[:]=slot[1:1+self._state_len]
+		traces_out[:]=slot[1+self._state_len:].reshape(self.n_channels,self.n_samples)
+		return slot[0]==seq
+
+
+	def close(self):
+		self._head=None
+		self._slots=None
+		self.shm.close()
+		if self._owner:
+			self.shm.unlink()
+
+
+#################################################################################################################
+
+
+"""
+Class used in the GUI process to start and stop the control process, send commands to it and read its results.
+Commands are tuples (kind, target, name, arguments), where target is one of the objects in the control process
+(see "_resolve_target") and kind is:
+	- "call": method "name" of the target is called with given arguments
+	- "set": attribute "name" of the target is set to the given value
+	- "item": element of a list attribute "name" is set (arguments are the index and the value)
+"""
+class ControlProcess:
+
+	def __init__(self,n_slots=256):
+		self.n_slots=n_slots
+		self.process=None
+		self.ring=None
+		self.commands=None
+		self._stop=None
+		self.last_seq=0
+		self.lost_records=0
+
+
+	"""
+	Starting the process. "settings" is a dictionary of config sections (as produced when saving the config),
+	"wavelengths" are used to initialize the Lock object and "n" is the number of slave lasers. The "spawn" start
+	method is used on all systems, so the new process doesn't inherit Tk or DAQ handles from the GUI process.
+	"""
+	def start(self,settings,wavelengths,n,simulate,n_samples):
+
+		self.ring=SharedTraceRing(self.n_slots,n+1,n_samples)
+
+		ctx=mp.get_context('spawn')
+		self.commands=ctx.Queue()
+		self._stop=ctx.Event()
+		self.process=ctx.Process(target=_control_main,args=(settings,wavelengths,n,simulate,self.ring.name,self.n_slots,n_samples,self.commands,self._stop),daemon=True)
+		self.process.start()
+
+		self.last_seq=self.ring.head()
+		self.lost_records=0
+
+		self._state=np.zeros(len(STATE_FIELDS))
+		self._traces=np.zeros((n+1,n_samples))
+
+
+	def stop(self):
+		if self.process is None:
+			return
+		self._stop.set()
+		self.process.join(5)
+		if self.process.is_alive():
+			self.process.terminate()
+		self.process=None
+		self.ring.close()
+		self.ring=None
+
+
+	def is_alive(self):
+		return self.process is not None and self.process.is_alive()
+
+
+	def send(self,target,name,*args):
+		self.commands.put(('call',target,name,args))
+
+
+	def set(self,target,name,value):
+		self.commands.put(('set',target,name,(value,)))
+
+
+	def set_item(self,target,name,ind,value):
+		self.commands.put(('item',target,name,(ind,value)))
+
+
+	"""
+	Generator returning all records written since the last call, as (state, traces). Returned arrays are reused,
+	so they have to be processed before the next record is requested. Records that were overwritten before they
+	could be read are counted as lost.
+	"""
+	def poll(self):
+		head=self.ring.head()
+		for seq in range(self.last_seq+1,head+1):
+			if head-seq>=self.n_slots-1 or not self.ring.read(seq,self._state,self._traces):
+				self.lost_records+=1
+				continue
+			yield self._state,self._traces
+		self.last_seq=head
+
+
+#Finding an object in the control process that a command refers to.
+def _resolve_target(tl,target):
+	if target=='transfer_lock':
+		return tl
+	if target=='lock':
+		return tl.lock
+	if target=='daq_tasks':
+		return tl.daq_tasks
+	if target=='ao_scan':
+		return tl.daq_tasks.ao_scan
+	if target=='ao_laser':
+		return tl.daq_tasks.ao_laser
+	raise ValueError('Unknown command target: '+str(target))
+
+
+def _apply_commands(commands,tl):
+	while True:
+		try:
+			kind,target,name,args=commands.get_nowait()
+		except queue.Empty:
+			return
+		obj=_resolve_target(tl,target)
+		if kind=='call':
+			getattr(obj,name)(*args)
+		elif kind=='set':
+			setattr(obj,name,args[0])
+		elif kind=='item':
+			getattr(obj,name)[args[0]]=args[1]
+
+
+"""
+Main function of the control process. It creates the objects used for locking from the settings and runs the
+control loop until asked to stop. The loop keeps the target period (if set) the same way the scan thread does.
+"""
+def _control_main(settings,wavelengths,n,simulate,shm_name,n_slots,n_samples,commands,stop):
+
+	cfg=configparser.ConfigParser()
+	cfg.read_dict(settings)
+
+	tl=TransferLock(Lock(wavelengths,cfg),setup_tasks(cfg,n,simulate),cfg)
+	ring=SharedTraceRing(n_slots,n+1,n_samples,name=shm_name)
+	state=np.zeros(len(STATE_FIELDS))
+
+	next_start=None
+
+	try:
+		if tl.daq_tasks.continuous:
+			tl.daq_tasks.start_continuous()
+
+		while not stop.is_set():
+			_apply_commands(commands,tl)
+
+			t_start=tl.control_step()
+
+			pack_state(tl,tl.daq_tasks.scan_wall_time(),state)
+			ring.write(state,tl.daq_tasks.PD_data,tl.daq_tasks.ao_scan.zoom_start)
+
+			if tl.target_period>0:
+				if next_start is None:
+					next_start=t_start/1e9
+				next_start=tl._wait_until(next_start+tl.target_period)
+
+	except Exception as e:
+		log.exception(e)
+
+	finally:
+		if tl.daq_tasks.running_continuous:
+			tl.daq_tasks.stop_continuous()
+		tl.daq_tasks._clear_tasks()
+		ring.close()
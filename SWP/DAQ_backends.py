@@ -0,0 +1,489 @@
+import numpy as np
+import threading
+from time import perf_counter, sleep
+
+from .Config import get_option
+
+
+"""
+This file contains backends used by the classes in DAQ_tasks.py to create and run DAQ tasks. Every backend provides:
+	- "devices()" - list of available devices (objects with "name" and lists of physical channels)
+	- "Task(name)" - a task with the part of nidaqmx Task interface used in this program (adding channels, timing,
+	writing, starting, stopping etc.)
+	- "reader(task)" - a reader filling NumPy arrays with data from an input task
+	- "connect(daq_tasks)" - called every time the channels are changed, so the backend knows what is connected to
+	which channel (only needed by the simulation)
+	- constants used to configure the continuous mode
+Two backends are available: "NI", which uses nidaqmx and real (or NI-simulated) devices, and "Sim", a self-contained
+simulation of the cavity, which doesn't need nidaqmx at all.
+"""
+
+
+def get_backend(cfg):
+	name=get_option(cfg,'DAQ','Backend','NI')
+	if name=='NI':
+		return NIBackend()
+	if name=='Sim':
+		return SimBackend(cfg)
+	raise ValueError('Unknown DAQ backend: '+str(name))
+
+
+#################################################################################################################
+
+
+"""
+Backend using National Instruments DAQs through nidaqmx. The library is imported only when this backend is created,
+so the rest of the program can be used without it.
+"""
+class NIBackend:
+
+	name='NI'
+	simulated=False
+
+	def __init__(self):
+
+		import nidaqmx
+		from nidaqmx.constants import AcquisitionType, RegenerationMode
+		from nidaqmx.stream_readers import AnalogMultiChannelReader, AnalogUnscaledReader
+
+		self._dq=nidaqmx
+		self._reader_class=AnalogMultiChannelReader
+		self._raw_reader_class=AnalogUnscaledReader
+
+		self.FINITE=AcquisitionType.FINITE
+		self.CONTINUOUS=AcquisitionType.CONTINUOUS
+		self.ALLOW_REGENERATION=RegenerationMode.ALLOW_REGENERATION
+
+
+	def devices(self):
+		return list(self._dq.system.System.local().devices)
+
+
+	def Task(self,name):
+		return self._dq.Task(new_task_name=name)
+
+
+	def reader(self,task):
+		return self._reader_class(task.in_stream)
+
+
+	#Reader of raw (int16) ADC counts and coefficients of polynomials converting them to volts (one list per channel).
+	def raw_reader(self,task):
+		return self._raw_reader_class(task.in_stream)
+
+
+	def scaling_coeffs(self,task):
+		return [list(ch.ai_dev_scaling_coeff) for ch in task.ai_channels]
+
+
+	#Number of samples per channel acquired by a running input task since it was started.
+	def samples_acquired(self,task):
+		return task.in_stream.total_samp_per_chan_acquired
+
+
+	def connect(self,daq_tasks):
+		pass
+
+
+	#Settings saved in the config file (none for this backend).
+	def settings(self):
+		return None
+
+
+#################################################################################################################
+
+
+"""
+Model of the transfer cavity used by the simulated backend. Position of the cavity (in units of the FSR for the
+master laser) depends on the voltage applied to the piezo:
+	x(V) = gain*(V + nonlinearity*V^2) + drift
+where the drift is a sum of a linear drift and a random walk. Transmission of each laser is given by the Airy
+function of its phase; for slave lasers the phase is scaled by the ratio of wavelengths and shifted proportionally
+to the voltage applied to the laser (which tunes its frequency). Gaussian noise is added to all signals.
+"""
+class SimulatedCavity:
+
+	def __init__(self,gain=1.0,nonlinearity=0.02,finesse=100,drift=0.0,drift_noise=0.002,noise=0.002,seed=None):
+
+		self.gain=gain
+		self.nonlinearity=nonlinearity
+		self.drift_rate=drift
+		self.drift_noise=drift_noise
+		self.noise=noise
+		self.set_finesse(finesse)
+
+		#Master laser
+		self.master_amplitude=1.0
+		self.master_phase=0.6
+
+		#Slave lasers (ratio of wavelengths, phase at 0 V, tuning in FSR/V, amplitude of the transmission peak)
+		self.slave_ratios=[852/1086,852/1087]
+		self.slave_phases=[0.8,0.6]
+		self.slave_tuning=[0.2,0.2]
+		self.slave_amplitudes=[0.8,0.8]
+
+		#Power measured by photodetectors of doubled lasers (in V)
+		self.power_levels=[0.25,0.25]
+
+		self._rng=np.random.default_rng(seed)
+		self._drift=0.0
+		self._t_last=None
+
+
+	def set_finesse(self,finesse):
+		self.finesse=finesse
+		self._airy_coeff=(2*finesse/np.pi)**2
+
+
+	#Updating the drift of the cavity. Called once per scan.
+	def update_drift(self,t):
+		if self._t_last is not None:
+			dt=max(t-self._t_last,0)
+			self._drift+=self.drift_rate*dt+self.drift_noise*np.sqrt(dt)*self._rng.standard_normal()
+		self._t_last=t
+
+
+	def position(self,voltages):
+		v=np.asarray(voltages,dtype=np.float64)
+		return self.gain*(v+self.nonlinearity*v*v)+self._drift
+
+
+	def _airy(self,phase,amplitude):
+		s=np.sin(np.pi*phase)
+		return amplitude/(1+self._airy_coeff*s*s)
+
+
+	#Transmission of the master laser (ind=None) or of a slave laser for given piezo voltages.
+	def transmission(self,voltages,laser_voltages,ind=None):
+		x=self.position(voltages)
+		if ind is None:
+			res=self._airy(x-self.master_phase,self.master_amplitude)
+		else:
+			ph=self.slave_phases[ind]+self.slave_tuning[ind]*laser_voltages[ind]
+			res=self._airy(x*self.slave_ratios[ind]-ph,self.slave_amplitudes[ind])
+		return res+self.noise*self._rng.standard_normal(res.shape)
+
+
+	def power(self,ind,n):
+		return self.power_levels[ind]+self.noise*self._rng.standard_normal(n)
+
+
+	def noise_only(self,n):
+		return self.noise*self._rng.standard_normal(n)
+
+
+"""
+Simple containers imitating parts of nidaqmx interface used by the program.
+"""
+class _SimChannels:
+
+	def __init__(self,task):
+		self._task=task
+		self.channel_names=[]
+
+	def add_ao_voltage_chan(self,name):
+		self.channel_names.append(name)
+
+	def add_ai_voltage_chan(self,name):
+		self.channel_names.append(name)
+
+
+class _SimTiming:
+
+	def __init__(self):
+		self.rate=0
+		self.source=''
+		self.sample_mode=None
+		self.samps_per_chan=0
+
+	def cfg_samp_clk_timing(self,rate,source='',sample_mode=None,samps_per_chan=1000):
+		self.rate=rate
+		self.source=source
+		self.sample_mode=sample_mode
+		self.samps_per_chan=samps_per_chan
+
+
+class _SimStartTrigger:
+
+	def __init__(self):
+		self.source=None
+
+	def cfg_dig_edge_start_trig(self,source):
+		self.source=source
+
+	def disable_start_trig(self):
+		self.source=None
+
+
+class _SimTriggers:
+
+	def __init__(self):
+		self.start_trigger=_SimStartTrigger()
+
+
+class _SimOutStream:
+
+	def __init__(self):
+		self.output_buf_size=0
+		self.regen_mode=None
+
+
+class _SimDevice:
+
+	def __init__(self,name,n_ao=4,n_ai=8):
+		self.name=name
+		self.ao_physical_chans=_SimChannels(None)
+		self.ao_physical_chans.channel_names=[name+'/ao'+str(i) for i in range(n_ao)]
+		self.ai_physical_chans=_SimChannels(None)
+		self.ai_physical_chans.channel_names=[name+'/ai'+str(i) for i in range(n_ai)]
+
+
+"""
+Simulated task. Output tasks store written values in the backend (so they can be used by the cavity model), input
+tasks generate data using the model. If "realtime" is set in the backend, tasks take as much time as they would on
+a real device (scan time for finite tasks, and ramps are delivered at the scan rate in the continuous mode).
+"""
+class SimTask:
+
+	def __init__(self,backend,name):
+		self.backend=backend
+		self.name=name
+		self.ao_channels=_SimChannels(self)
+		self.ai_channels=_SimChannels(self)
+		self.timing=_SimTiming()
+		self.out_stream=_SimOutStream()
+		self.triggers=_SimTriggers()
+		self.in_stream=self
+
+		self._t_start=None
+		self.acquired=0
+		self._callback=None
+		self._callback_n=0
+		self._thread=None
+		self._running=False
+
+
+	@property
+	def channel_names(self):
+		return self.ao_channels.channel_names+self.ai_channels.channel_names
+
+
+	@property
+	def number_of_channels(self):
+		return len(self.channel_names)
+
+
+	def _duration(self):
+		if self.timing.rate<=0:
+			return 0
+		return self.timing.samps_per_chan/self.timing.rate
+
+
+	def start(self):
+		self._t_start=perf_counter()
+		self.acquired=0
+		self._running=True
+		if self._callback is not None and self.timing.sample_mode==self.backend.CONTINUOUS:
+			self._thread=threading.Thread(target=self._continuous_loop,daemon=True)
+			self._thread.start()
+
+
+	def stop(self):
+		self._running=False
+		if self._thread is not None and self._thread is not threading.current_thread():
+			self._thread.join()
+		self._thread=None
+		self._t_start=None
+
+
+	def close(self):
+		self.stop()
+
+
+	#Finite tasks are done after all the samples were generated (at the configured rate).
+	def wait_until_done(self,timeout=10):
+		if self.backend.realtime and self._t_start is not None and self.timing.sample_mode!=self.backend.CONTINUOUS:
+			remaining=self._t_start+self._duration()-perf_counter()
+			if remaining>0:
+				sleep(remaining)
+
+
+	def write(self,data,auto_start=False):
+		data=np.asarray(data,dtype=np.float64)
+		names=self.ao_channels.channel_names
+		if data.ndim==2:
+			for i in range(len(names)):
+				self.backend.ao_values[names[i]]=data[i].copy()
+		elif len(names)==1:
+			self.backend.ao_values[names[0]]=data.copy()
+		else:
+			for i in range(len(names)):
+				self.backend.ao_values[names[i]]=float(np.ravel(data[i])[-1])
+		if auto_start and not self._running:
+			self.start()
+
+
+	def register_every_n_samples_acquired_into_buffer_event(self,n,callback):
+		self._callback=callback
+		self._callback_n=n
+
+
+	def _continuous_loop(self):
+		period=self._callback_n/self.timing.rate if self.timing.rate>0 else 0
+		next_t=perf_counter()+period
+		while self._running:
+			if self.backend.realtime:
+				delay=next_t-perf_counter()
+				if delay>0:
+					sleep(delay)
+				next_t+=period
+			if not self._running:
+				break
+			self.acquired+=self._callback_n
+			self._callback(None,0,self._callback_n,None)
+
+
+	#Filling "out" (channels x samples) with simulated data.
+	def read_into(self,out,n):
+		self.wait_until_done()
+		self.backend.generate(self.ai_channels.channel_names,out,n)
+
+
+class _SimReader:
+
+	def __init__(self,task):
+		self._task=task
+		self._volts=np.zeros((0,0))
+
+	def read_many_sample(self,data,number_of_samples_per_channel=None,timeout=10):
+		if number_of_samples_per_channel is None:
+			number_of_samples_per_channel=data.shape[1]
+		self._task.read_into(data,number_of_samples_per_channel)
+		return number_of_samples_per_channel
+
+	#Simulated 16-bit ADC with +-10 V range (see SimBackend.scaling_coeffs).
+	def read_int16(self,data,number_of_samples_per_channel=None,timeout=10):
+		if number_of_samples_per_channel is None:
+			number_of_samples_per_channel=data.shape[1]
+		if self._volts.shape!=data.shape:
+			self._volts=np.zeros(data.shape)
+		self._task.read_into(self._volts,number_of_samples_per_channel)
+		np.rint(self._volts/SimBackend.ADC_LSB,out=self._volts)
+		np.clip(self._volts,-32768,32767,out=self._volts)
+		data[:]=self._volts
+		return number_of_samples_per_channel
+
+
+"""
+Simulated backend. It has one device ("SimDev1") and the cavity model described above. Parameters of the model can be
+set in an optional "SIMULATION" section of the config file:
+	- Gain [FSR/V], Nonlinearity [1/V], Finesse
+	- Drift [FSR/s] (linear drift), DriftNoise [FSR/sqrt(s)] (random walk), Noise [V]
+	- RealTime (1 or 0) - if 0, tasks don't wait, so the closed loop runs as fast as possible (for benchmarks)
+"""
+class SimBackend:
+
+	name='Sim'
+	simulated=True
+
+	FINITE='finite'
+	CONTINUOUS='continuous'
+	ALLOW_REGENERATION='allow_regeneration'
+
+	ADC_LSB=20/2**16
+
+	def __init__(self,cfg=None):
+
+		if cfg is None:
+			cfg={}
+
+		self.cavity=SimulatedCavity(
+			gain=float(get_option(cfg,'SIMULATION','Gain','1.0')),
+			nonlinearity=float(get_option(cfg,'SIMULATION','Nonlinearity','0.02')),
+			finesse=float(get_option(cfg,'SIMULATION','Finesse','100')),
+			drift=float(get_option(cfg,'SIMULATION','Drift','0')),
+			drift_noise=float(get_option(cfg,'SIMULATION','DriftNoise','0.002')),
+			noise=float(get_option(cfg,'SIMULATION','Noise','0.002')))
+
+		self.realtime=int(get_option(cfg,'SIMULATION','RealTime','1'))>0
+
+		self._device=_SimDevice('SimDev1')
+
+		#Last values written to analog outputs (arrays for waveforms, floats for single values)
+		self.ao_values={}
+
+		#Roles of the channels, set by "connect"
+		self.piezo_channel=None
+		self.laser_channels=[]
+		self.pd_channels=[]
+		self.power_channels=[]
+
+
+	def devices(self):
+		return [self._device]
+
+
+	def Task(self,name):
+		return SimTask(self,name)
+
+
+	def reader(self,task):
+		return _SimReader(task)
+
+
+	def raw_reader(self,task):
+		return _SimReader(task)
+
+
+	def scaling_coeffs(self,task):
+		return [[0.0,self.ADC_LSB] for ch in task.ai_channels.channel_names]
+
+
+	def samples_acquired(self,task):
+		return task.acquired
+
+
+	#Reading which channels are used for what from the DAQ_tasks object.
+	def connect(self,daq_tasks):
+		self.piezo_channel=daq_tasks.ao_scan.dq_task.channel_names[0]
+		self.laser_channels=list(daq_tasks.ao_laser.dq_task.channel_names)
+		self.pd_channels=list(daq_tasks.ai_PDs.dq_task.channel_names[:daq_tasks.ai_PDs._channel_no])
+		self.power_channels=list(daq_tasks.power_PDs.dq_task.channel_names)
+
+
+	#Voltages applied to the piezo during the last "n" samples (the ramp is resampled if lengths don't match).
+	def _piezo_voltages(self,n):
+		v=self.ao_values.get(self.piezo_channel,np.zeros(1))
+		v=np.atleast_1d(v)
+		if len(v)==n:
+			return v
+		return np.interp(np.linspace(0,len(v)-1,n),np.arange(len(v)),v)
+
+
+	def generate(self,channels,out,n):
+
+		cav=self.cavity
+		cav.update_drift(perf_counter())
+
+		piezo=self._piezo_voltages(n)
+		lasers=[float(np.ravel(self.ao_values.get(ch,0.0))[-1]) for ch in self.laser_channels]
+
+		for i in range(len(channels)):
+			ch=channels[i]
+			if ch in self.pd_channels:
+				k=self.pd_channels.index(ch)
+				if k==0:
+					out[i,:n]=cav.transmission(piezo,lasers)
+				elif k-1<len(lasers):
+					out[i,:n]=cav.transmission(piezo,lasers,k-1)
+				else:
+					out[i,:n]=cav.noise_only(n)
+			elif ch in self.power_channels:
+				out[i,:n]=cav.power(self.power_channels.index(ch)%len(cav.power_levels),n)
+			else:
+				out[i,:n]=cav.noise_only(n)
+
+
+	def settings(self):
+		cav=self.cavity
+		return {"Gain":cav.gain,"Nonlinearity":cav.nonlinearity,"Finesse":cav.finesse,"Drift":cav.drift_rate,"DriftNoise":cav.drift_noise,"Noise":cav.noise,"RealTime":int(self.realtime)}
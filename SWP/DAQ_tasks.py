@@ -1,9 +1,17 @@
-import nidaqmx as dq
 import matplotlib.pyplot as plt
 import numpy as np
 import math
-from collections import deque
-import random
+import queue
+import logging
+from time import perf_counter_ns, time
+
+from .Buffers import RingBuffer
+from .Profiling import LatencyProfiler
+from .Config import get_option
+from .DAQ_backends import get_backend, NIBackend
+
+
+log=logging.getLogger(__name__)
 
 
 """
@@ -13,33 +21,139 @@ itself references to objects of three other classes defined here: Scan class, co
 which controls voltages applied to science lasers (so controls their frequencies), and PD_task class, which is 
 designed to read data from photodetectors for both the master and slave lasers.The whole process of scanning (so 
 writing data) and reading is managed from the level of DAQ_tasks. It also contains some more general helpful methods.
+Tasks are created through a backend (see DAQ_backends.py), so the same classes work with NI devices and with the
+simulated cavity.
 """
 class DAQ_tasks:
 
 	"""
 	The class can be initialized with device name, if read from a config file. Then, it searches through all DAQs
 	that are connected to this computer (might include a smiulated DAQ) and chooses one that matches the name.
-	Otherwise, it chooses the first one from the list.
+	Otherwise, it chooses the first one from the list. If no backend is given, nidaqmx is used.
 	"""
-	def __init__(self,simulate,dev_name=None):
-		
-		syst=dq.system.System.local()
+	def __init__(self,simulate,dev_name=None,backend=None):
+
+		if backend is None:
+			backend=NIBackend()
+		self.backend=backend
+
+		devices=backend.devices()
 		if dev_name is not None:
-			for dev in syst.devices:
+			for dev in devices:
 				if dev.name==dev_name:
 					self.device=dev
 					break
 			else:
 				raise NameError('Could not locate DAQ device of given name.')
 		else:
-			self.device=syst.devices[0]
+			self.device=devices[0]
+		self._ao_names=None
+		self._ai_names=None
 		self.ao_scan=0
 		self.ao_laser=0
 		self.ai_PDs=0
 		self.power_PDs=0
 		self.time_samples=[]
-		self.PD_data=[]
-		self.simulation=simulate
+		self.PD_data=np.zeros((0,0))
+
+		#Traces are replaced by "simulate_scan" only for NI devices; the simulated backend generates its own data.
+		self.simulation=simulate and not backend.simulated
+
+		"""
+		Parameters of the simulated traces (used with NI devices in the simulation mode). Linewidths are given in
+		samples. Every slave peak has "sim_sidebands" pairs of sidebands, "sim_sideband_spacing" master intervals
+		apart, each order "sim_sideband_amplitude" times smaller than the previous one.
+		"""
+		self.sim_master_width=2
+		self.sim_slave_width=1
+		self.sim_sidebands=1
+		self.sim_sideband_spacing=1000/784.5
+		self.sim_sideband_amplitude=1.0
+
+		#Buffers reused by the simulation (traces, peak parameters, time axis and work arrays).
+		self._sim_data=np.zeros((0,0))
+		self._sim_shape=None
+		self._sim_rng=np.random.default_rng()
+
+		#Latency histograms of the stages of scanning and acquisition (also used by the TransferLock class).
+		self.profiler=LatencyProfiler()
+
+		"""
+		Continuous (regenerative) scan mode. If it's chosen, tasks are not started and stopped for every scan:
+		the ramp is written once and regenerated by the DAQ, and the photodetectors are read continuously. 
+		"cont_buffers" is the size of the input buffer in scans, "skipped_ramps" counts ramps that were acquired, 
+		but not processed, because the processing was slower than scanning. "missing_ramps" counts waits for a ramp
+		that timed out (the input task stalled); after "cont_retries" of them in a row the scan is stopped.
+		"""
+		self.continuous=False
+		self.running_continuous=False
+		self.cont_buffers=8
+		self.cont_retries=3
+		self.skipped_ramps=0
+		self.missing_ramps=0
+		self._ramps=queue.Queue()
+
+		#Preallocated buffers the ramps are read into in the continuous mode, indices of the ones that are free and
+		#the index of the one that is being processed.
+		self._ramp_pool=np.zeros((0,0,0))
+		self._free_slots=queue.Queue()
+		self._current_slot=None
+
+		"""
+		If "combined_power" is set, photodetectors measuring power are read in the same (clocked) task as the cavity
+		photodetectors, instead of starting and stopping a separate task after every scan. Power is then calculated
+		from samples taken during the scan (also in the continuous mode).
+		"""
+		self.combined_power=False
+
+		"""
+		If "staged_laser_update" is set, voltages of the lasers are written together with the scan (channels of the
+		lasers are added to the scan task), so new voltages are applied exactly at the start of the scan, on the same
+		clock. Otherwise they are written by the laser task before the scan, but only if they changed.
+		"""
+		self.staged_laser_update=False
+
+		"""
+		Adaptive zoom. If it's enabled, once the master laser is locked only the part of the ramp around the peaks
+		is scanned (see "set_zoom" and TransferLock.update_zoom). "zoom_margin" is the margin left around the peaks
+		as a fraction of the interval between master peaks.
+		"""
+		self.adaptive_zoom=False
+		self.zoom_margin=0.15
+
+		#Time axis of the full scan ("time_samples" is its part that is currently scanned).
+		self._full_time=np.zeros(0)
+
+		"""
+		Record of the last acquired scan:
+			- "scan_index" - number of the scan (in the continuous mode it's the number of the ramp counted by the
+			DAQ from the start, so ramps that weren't processed are visible as gaps)
+			- "scan_timestamp" - time of the start of the scan (perf_counter_ns clock). For single scans it's taken
+			just before the scan task is triggered, in the continuous mode it's calculated from the number of 
+			samples acquired by the DAQ, so it's exact
+			- "scan_dt" - time since the previous processed scan (s)
+			- "skipped_scans" - scans that were missed before this one (gaps in indices or, if "nominal_period" is
+			set, periods without a scan)
+			- "overrun" - set if data of the scan might be corrupted (the acquisition buffer overflowed or the scan
+			took much longer than it should)
+		"""
+		self.scan_index=-1
+		self.scan_timestamp=0
+		self.scan_dt=0
+		self.skipped_scans=0
+		self.total_skipped=0
+		self.overrun=False
+		self.overruns=0
+		self.nominal_period=0
+
+		#Offset between the perf_counter_ns clock and the wall clock (used to give timestamps in logs).
+		self._epoch_offset=time()-perf_counter_ns()/1e9
+
+		#Channel layout of the tasks while they're released (see "release_tasks").
+		self._released_layout=None
+		self._ramp_count=0
+		self._cont_start=0
+		self._cont_overrun=False
 
 
 	#To avoid error when the program is being closed, the tasks are closed first.
@@ -47,74 +161,137 @@ class DAQ_tasks:
 		self._clear_tasks()
 
 
-	#Function that clears the task and removes references them from their classes.
+	#Function that clears the task and removes references them from their classes (tasks already cleared are skipped).
 	def _clear_tasks(self):
-		self.ao_scan.dq_task.close()
-		self.ao_scan.dq_task=0
-		self.ao_laser.dq_task.close()
-		self.ao_laser.dq_task=0
-		self.ai_PDs.dq_task.close()
-		self.ai_PDs.dq_task=0
-		self.power_PDs.dq_task.close()
-		self.power_PDs.dq_task=0
+		for obj in [self.ao_scan,self.ao_laser,self.ai_PDs,self.power_PDs]:
+			if obj.dq_task!=0:
+				obj.dq_task.close()
+				obj.dq_task=0
+
 
-	
 	"""
-	If user changes channels for a task, and then wants to go back to default configuration, this function is invoked.
-	It clears tasks and creates fresh ones using the config file.
+	Closing the tasks while another process uses the same channels (the control process, see Control_process.py).
+	The channel layout is kept, and "restore_tasks" creates the tasks again with the same channels and timing. 
+	Parameters of the scan and voltages of the lasers are kept as well; nothing can be written in the meantime.
 	"""
-	def reset_tasks(self,cfg,n):
+	def release_tasks(self):
+		self._released_layout=self.get_layout()
 		self._clear_tasks()
 
-		self.ao_scan.dq_task=dq.Task(new_task_name="Scan")
-		self.ao_scan.dq_task.ao_channels.add_ao_voltage_chan(self.device.name+"/ao"+cfg['CAVITY']['OutputChannel'])
 
-		self.ao_laser.dq_task=dq.Task(new_task_name="Lasers")
-		self.ao_laser._channel_no=0
+	def restore_tasks(self):
+		if self._released_layout is None:
+			return
+		layout=self._released_layout
+		self._released_layout=None
+		self.apply_layout(*layout,force=True)
 
-		self.power_PDs.dq_task=dq.Task(new_task_name="Power")
-		self.power_PDs._channel_no=0
+	
+	"""
+	If user changes channels for a task, and then wants to go back to default configuration, this function is invoked.
+	It restores the channels given in the config file (only tasks whose channels differ are recreated).
+	"""
+	def reset_tasks(self,cfg,n):
 
-		self.ai_PDs.dq_task=dq.Task(new_task_name="PDs")
-		self.ai_PDs.dq_task.ai_channels.add_ai_voltage_chan(self.device.name+"/ai"+cfg['CAVITY']['InputChannel'])
-		self.ai_PDs._channel_no=1
+		dev=self.device.name
+		lasers=[cfg['LASER'+str(i+1)] for i in range(n)]
 
-		self.add_laser(int(cfg['LASER1']['InputChannel']),int(cfg['LASER1']['OutputChannel']),int(cfg['LASER1']['PowerChannel']))
-		if n>1:
-			self.add_laser(int(cfg['LASER2']['InputChannel']),int(cfg['LASER2']['OutputChannel']),int(cfg['LASER2']['PowerChannel']))
+		self.apply_layout(dev+"/ao"+cfg['CAVITY']['OutputChannel'],
+						  [dev+"/ao"+las['OutputChannel'] for las in lasers],
+						  [dev+"/ai"+cfg['CAVITY']['InputChannel']]+[dev+"/ai"+las['InputChannel'] for las in lasers],
+						  [dev+"/ai"+las['PowerChannel'] for las in lasers])
 
-		#Timing (synchronisation) has to be set every time we recreate a task.
-		self.set_input_timing()
-	
 
 	#Function similar to the previous one. This one is invoked when user changes at least one channel.
 	def update_tasks(self,ao_channels,ai_channels,power_channels):
-		self._clear_tasks()
+		self.apply_layout(ao_channels[0],ao_channels[1:],ai_channels,power_channels)
 
-		self.ao_scan.dq_task=dq.Task(new_task_name="Scan")
-		self.ao_scan.dq_task.ao_channels.add_ao_voltage_chan(ao_channels[0])
 
-		self.ao_laser.dq_task=dq.Task(new_task_name="Lasers")
-		for ch in ao_channels[1:]:
-			self.ao_laser.dq_task.ao_channels.add_ao_voltage_chan(ch)
+	#Current channel layout: (scan channel, laser channels, photodetector channels, power channels).
+	def get_layout(self):
+		return (self.ao_scan.dq_task.channel_names[0],
+				list(self.ao_laser.dq_task.channel_names),
+				list(self.ai_PDs.dq_task.channel_names[:self.ai_PDs._channel_no]),
+				list(self.power_PDs.dq_task.channel_names))
 
-		self.ai_PDs.dq_task=dq.Task(new_task_name="PDs")
-		for ch in ai_channels:
-			self.ai_PDs.dq_task.ai_channels.add_ai_voltage_chan(ch)
 
-		self.power_PDs.dq_task=dq.Task(new_task_name="Power")
-		for ch in power_channels:
-			self.power_PDs.dq_task.ai_channels.add_ai_voltage_chan(ch)
+	"""
+	Changing channels used by the tasks. The requested layout is compared with the current one and only tasks
+	whose channels changed are closed and recreated, so e.g. changing a power channel doesn't stop the scan task.
+	Some tasks depend on each other:
+		- if channels of the lasers are written with the scan (staged mode), the scan task is recreated together 
+		with the laser task
+		- if power is read in the main acquisition task, the photodetector task is recreated together with the 
+		power task
+	Timing of the scan task and synchronisation of the input clock are set up again only if needed. With "force", all
+	tasks are recreated (e.g. after they were released).
+	"""
+	def apply_layout(self,scan_channel,laser_channels,pd_channels,power_channels,force=False):
 
-		self.set_input_timing()
+		t=perf_counter_ns()
+
+		if force:
+			lasers=power=scan=pds=True
+		else:
+			old_scan,old_lasers,old_pds,old_power=self.get_layout()
+
+			lasers=list(laser_channels)!=old_lasers
+			power=list(power_channels)!=old_power
+			scan=scan_channel!=old_scan or (lasers and self.staged_laser_update)
+			pds=list(pd_channels)!=old_pds or (power and self.combined_power)
+
+		if lasers:
+			self._recreate_task(self.ao_laser,"Lasers",laser_channels,True)
+			self.ao_laser._channel_no=len(laser_channels)
+
+		if power:
+			self._recreate_task(self.power_PDs,"Power",power_channels,False)
+			self.power_PDs._channel_no=len(power_channels)
+			self.power_PDs._reader_task=None
+			while len(self.power_PDs.power)<len(power_channels):
+				self.power_PDs.power.append(RingBuffer(40))
+				self.power_PDs.power[-1].append(0)
+
+		if scan:
+			self._recreate_task(self.ao_scan,"Scan",[scan_channel],True)
+			self.ao_scan.configure_scan_sampling(self.ao_scan.scan_time)
+			self.ao_scan._changed=True
+
+		if pds:
+			self._recreate_task(self.ai_PDs,"PDs",pd_channels,False)
+			self.ai_PDs._channel_no=len(pd_channels)
+			self.ai_PDs._reader_task=None
+
+		#Timing (synchronisation) has to be set every time we recreate the scan or the acquisition task.
+		if scan or pds:
+			self.set_input_timing()
+		elif lasers or power:
+			self.backend.connect(self)
+
+		self.profiler.record('daq.reconfigure',t)
+
+
+	def _recreate_task(self,obj,name,channels,output):
+		if obj.dq_task!=0:
+			obj.dq_task.close()
+		obj.dq_task=self.backend.Task(name)
+		for ch in channels:
+			if output:
+				obj.dq_task.ao_channels.add_ao_voltage_chan(ch)
+			else:
+				obj.dq_task.ai_channels.add_ai_voltage_chan(ch)
 
 
-	#A couple of self-explanatory methods.
+	#A couple of self-explanatory methods. Names of physical channels of the device are read once and cached.
 	def get_ao_channel_names(self):
-		return self.device.ao_physical_chans.channel_names
+		if self._ao_names is None:
+			self._ao_names=list(self.device.ao_physical_chans.channel_names)
+		return self._ao_names
 
 	def get_ai_channel_names(self):
-		return self.device.ai_physical_chans.channel_names
+		if self._ai_names is None:
+			self._ai_names=list(self.device.ai_physical_chans.channel_names)
+		return self._ai_names
 
 	def get_scan_ao_channel(self):
 		return self.ao_scan.dq_task.channel_names[0]
@@ -132,7 +309,7 @@ class DAQ_tasks:
 		return self.power_PDs.dq_task.channel_names[ind]
 
 	def get_all_used_ai_channels(self):
-		return self.ai_PDs.dq_task.channel_names
+		return self.ai_PDs.dq_task.channel_names[:self.ai_PDs._channel_no]
 
 	def get_all_used_ao_channels(self):
 		return self.ao_scan.dq_task.channel_names+self.ao_laser.dq_task.channel_names
@@ -140,7 +317,7 @@ class DAQ_tasks:
 
 	#Creating an object of Scan class and adding reference to an attribute of this class.
 	def set_scan_task(self,name,channel=0):
-		self.ao_scan=Scan(self.device,name,channel)
+		self.ao_scan=Scan(self.backend,self.device,name,channel)
 
 
 	"""
@@ -162,7 +339,8 @@ class DAQ_tasks:
 		self.ao_scan.configure_scan_sampling(scan_t)
 
 		#Finally, because we are plotting acquired data as a function of time, we create the X-axis for the plot.
-		self.time_samples=np.linspace(0,scan_t,num=n_samp)
+		self._full_time=np.linspace(0,scan_t,num=n_samp)
+		self.time_samples=self._full_time
 
 
 	"""
@@ -172,13 +350,14 @@ class DAQ_tasks:
 	def modify_scanning(self,offset,amp,n_samp,scan_t):
 		self.ao_scan.configure_scan_voltages(offset,amp,n_samp)
 		self.ao_scan.configure_scan_sampling(scan_t)
-		self.time_samples=np.linspace(0,scan_t,num=n_samp)
+		self._full_time=np.linspace(0,scan_t,num=n_samp)
+		self.time_samples=self._full_time
 		self.set_input_timing()
 
 
 	#Creates an instance of L_task class
 	def set_laser_task(self,name):
-		self.ao_laser=L_task(self.device,name)
+		self.ao_laser=L_task(self.backend,self.device,name)
 
 
 	#Method setting voltages of the lasers (so it sets their frequencies)
@@ -193,12 +372,12 @@ class DAQ_tasks:
 
 	#Creating an object of PD_task class. It automatically sets up a task for master laser photodetection.
 	def set_PD_task(self,name,scan_channel=0):
-		self.ai_PDs=PD_task(self.device,name,scan_channel)
+		self.ai_PDs=PD_task(self.backend,self.device,name,scan_channel)
 
 
 	#Creating an object of power_PD_task class.
 	def set_power_task(self,name):
-		self.power_PDs=Power_PD_task(self.device,name)
+		self.power_PDs=Power_PD_task(self.backend,self.device,name)
 
 
 	#Method adding a laser. It adds channels to L_task tasks and to PD_task tasks. 
@@ -213,43 +392,299 @@ class DAQ_tasks:
 	same points when scan is performed.
 	"""
 	def set_input_timing(self):
-		self.ai_PDs.configure_clock(self.ao_scan.sample_rate,self.ao_scan.n_samples)
+		if self.staged_laser_update:
+			self.ao_scan.attach_laser_channels(self.ao_laser.dq_task.channel_names)
+		if self.combined_power:
+			self.ai_PDs.attach_power_channels(self.power_PDs.dq_task.channel_names)
+		self.ai_PDs.configure_clock(self.ao_scan.sample_rate,self.ao_scan.active_samples)
+		self.backend.connect(self)
+
+
+	"""
+	Scanning only samples from "start" to "stop" (indices of the full ramp). The sampling rate doesn't change, so
+	the density of samples (and the voltage step) is the same as for the full scan, but the scan is shorter. Times
+	of the samples are kept as in the full scan, so positions of the peaks and the lockpoints don't change. Clocks 
+	of the tasks are reconfigured only if the range changed.
+	"""
+	def set_zoom(self,start,stop):
+
+		start=max(0,int(start))
+		stop=min(self.ao_scan.n_samples,int(stop))
+		if start==self.ao_scan.zoom_start and stop==self.ao_scan.zoom_stop:
+			return
+
+		t=perf_counter_ns()
+
+		self.ao_scan.set_zoom(start,stop)
+		self.time_samples=self._full_time[start:stop]
+		self.set_input_timing()
+
+		self.profiler.record('daq.zoom',t)
+
+
+	#Traces of the photodetectors in volts (converted from raw counts, if they are acquired as counts).
+	def get_PD_volts(self):
+		if self.simulation:
+			return self.PD_data
+		return self.ai_PDs.to_volts(self.PD_data)
+
+
+	def reset_zoom(self):
+		self.set_zoom(0,self.ao_scan.n_samples)
+
+
+	def zoomed(self):
+		return self.ao_scan.active_samples<self.ao_scan.n_samples
 
 
 	#Method that manages scanning and acquiring data from the DAQ.
 	def scan_and_acquire(self,evnt):
 
+		if self.running_continuous:
+			self._acquire_continuous(evnt)
+			return
+
+		prof=self.profiler
+		t=perf_counter_ns()
+
 		#The task for collecting data is started, but the data is not collected yet.
 		self.ai_PDs.start()
 
-		#Voltages for the lasers are set and the scan is performed. Both tasks start and are performed automatically.
-		self.ao_laser.set_voltages(True)
+		t=prof.record('daq.start',t)
+
+		#Voltages for the lasers are set (or staged) and the scan is performed. Tasks start automatically.
+		self.update_laser_voltages()
+		t_trig=perf_counter_ns()
 		self.ao_scan.perform_scan(True)
 
+		t=prof.record('daq.write',t)
+
 		#Data from photodetectros is acquired (it was stored in buffers when scan was being performed, now it's fetched)
 		self.ai_PDs.acquire_data()
 
+		t=prof.record('daq.read',t)
+
 		#We set options for the program to wait for scan and readout to bo completed before the task is stopped.
 		self.ao_scan.dq_task.wait_until_done()
 		self.ai_PDs.dq_task.wait_until_done()
 
 		
-		#We add reference to the DAQ_task object
-		self.PD_data=self.ai_PDs.acq_data
+		#We add reference to the DAQ_task object (only rows of the cavity photodetectors)
+		self.PD_data=self.ai_PDs.pd_data
 
 		#We stop the tasks. 
 		self.ao_scan.dq_task.stop()
 		self.ai_PDs.dq_task.stop()
 
-		self.get_power()
+		#The scan is considered overrun if it took much longer than the scan time (e.g. the driver stalled).
+		self._stamp(self.scan_index+1,t_trig,perf_counter_ns()-t_trig>1.5e9*self.ao_scan.active_samples/self.ao_scan.sample_rate+5e6)
+
+		t=prof.record('daq.stop',t)
+
+		if self.combined_power:
+			self.power_PDs.process_data(self.ai_PDs.to_volts(self.ai_PDs.power_data,self.ai_PDs._channel_no),self.simulation)
+		else:
+			self.get_power()
+
+		t=prof.record('daq.power',t)
 
 		if self.simulation:
 			self.PD_data=self.simulate_scan()
+			prof.record('daq.simulate',t)
 
 		#Flag is set
 		evnt.set()
 
 
+	"""
+	Starting the continuous scan. The ramp is written to the output buffer once and regenerated, and the input task
+	runs on the clock of the output task, so every "n_samples" acquired samples correspond exactly to one ramp. The 
+	input task has to be started first, as it waits for the clock of the output task.
+	"""
+	def start_continuous(self):
+
+		#The zoom is not used in the continuous mode (the buffers would have to be reconfigured).
+		self.reset_zoom()
+
+		self._ramps=queue.Queue(maxsize=self.cont_buffers)
+		self.skipped_ramps=0
+		self.missing_ramps=0
+		self._ramp_count=0
+		self._cont_start=0
+		self._cont_overrun=False
+
+		self.ao_scan.configure_continuous()
+		self.ai_PDs.configure_continuous(self.ao_scan.sample_rate,self.ao_scan.n_samples,self.cont_buffers,self._ramp_acquired)
+
+		#Buffers of queued ramps and of the ramp that is being processed are not free, so a ramp is never read into
+		#them. Less than "cont_buffers" ramps are queued when the callback takes a buffer and the processing holds
+		#at most 3 buffers (while newer ramps are taken from the queue), so one more buffer is always free.
+		self._ramp_pool=np.zeros((self.cont_buffers+3,)+self.ai_PDs.acq_data.shape,dtype=self.ai_PDs.acq_data.dtype)
+		self._free_slots=queue.Queue()
+		for slot in range(len(self._ramp_pool)):
+			self._free_slots.put(slot)
+		self._current_slot=None
+
+		self.ai_PDs.start()
+		self.ao_scan.start()
+
+		self.running_continuous=True
+
+
+	#Stopping the continuous scan and bringing back the timing used for single scans.
+	def stop_continuous(self):
+
+		self.running_continuous=False
+
+		self.ao_scan.dq_task.stop()
+		self.ai_PDs.dq_task.stop()
+		self.ai_PDs.release_continuous()
+
+		self.ao_scan.configure_scan_sampling(self.ao_scan.scan_time)
+		self.set_input_timing()
+
+
+	"""
+	Callback called by the DAQ driver (in its own thread) every time samples of one ramp were acquired. Ramps are
+	read in order, so the index of the ramp is the number of ramps read before, and its start time follows from the
+	index and the scan period (both are set by the sample clock). Only the time of the start of the first ramp is
+	taken from the clock of the computer, using the number of samples already acquired by the DAQ. If the callback
+	fell behind by almost the whole buffer, or reading fails (the buffer overflowed), the ramp is marked as overrun.
+	If "cont_buffers" ramps are already queued (processing stalled), the oldest one is dropped (counted as skipped)
+	and its overrun flag is passed to the new ramp.
+	"""
+	def _ramp_acquired(self,task_handle,event_type,n_samples,callback_data):
+		now=perf_counter_ns()
+		period=1e9*self.ao_scan.n_samples/self.ao_scan.sample_rate
+		n_raw=self.ai_PDs.n_samples*self.ai_PDs.oversampling
+
+		ind=self._ramp_count
+		self._ramp_count+=1
+
+		total=self.backend.samples_acquired(self.ai_PDs.dq_task)
+		if self._cont_start==0:
+			done=ind+1 if total is None else total/n_raw
+			self._cont_start=now-done*period
+		if total is not None and total-(ind+1)*n_raw>(self.cont_buffers-1)*n_raw:
+			self._cont_overrun=True
+
+		if self._ramps.full():
+			try:
+				old=self._ramps.get_nowait()
+				self.skipped_ramps+=1
+				self._cont_overrun|=old[2]
+				self._free_slots.put(old[3])
+			except queue.Empty:
+				pass
+
+		slot=self._free_slots.get_nowait()
+		try:
+			data=self.ai_PDs.acquire_data(self._ramp_pool[slot])
+		except Exception:
+			self._cont_overrun=True
+			self._free_slots.put(slot)
+			return 0
+		self._ramps.put_nowait((ind,int(self._cont_start+ind*period),self._cont_overrun,slot,data))
+		self._cont_overrun=False
+		return 0
+
+
+	"""
+	Iteration of the continuous scan. Changes of the lasers' voltages and of the scan offset are written first, then
+	the newest acquired ramp is taken. Older ramps (if processing was slower than scanning) are dropped, so the locks
+	always work on the newest data (overrun flags of the dropped ramps are kept). Buffers of the dropped ramps and of
+	the previously processed one are given back to the callback. The power is measured in this mode only if it's 
+	combined with the main acquisition, because the analog input is occupied by the continuous task. If no ramp arrives in time, the wait is repeated
+	(the next scan is marked as overrun); if the input task doesn't recover, RuntimeError is raised.
+	"""
+	def _acquire_continuous(self,evnt):
+
+		prof=self.profiler
+		t=perf_counter_ns()
+
+		self.update_laser_voltages()
+		self.ao_scan.push_changes()
+
+		t=prof.record('daq.write',t)
+
+		timeout=max(1,10*self.ao_scan.scan_time/1000)
+		stalled=False
+		for attempt in range(self.cont_retries+1):
+			try:
+				ind,ts,overrun,slot,data=self._ramps.get(timeout=timeout)
+				break
+			except queue.Empty:
+				self.missing_ramps+=1
+				stalled=True
+				log.warning('No ramp acquired in {:.1f} s (attempt {} of {})'.format(timeout,attempt+1,self.cont_retries+1))
+		else:
+			raise RuntimeError('Continuous acquisition stalled: no ramp acquired in {:.1f} s'.format((self.cont_retries+1)*timeout))
+
+		while True:
+			try:
+				newer=self._ramps.get_nowait()
+			except queue.Empty:
+				break
+			self.skipped_ramps+=1
+			self._free_slots.put(slot)
+			ind,ts,o,slot,data=newer
+			overrun|=o
+		overrun=overrun or stalled
+
+		if self._current_slot is not None:
+			self._free_slots.put(self._current_slot)
+		self._current_slot=slot
+
+		self._stamp(ind,ts,overrun)
+
+		n=self.ai_PDs._channel_no
+		self.PD_data=data[:n]
+
+		if self.combined_power:
+			self.power_PDs.process_data(self.ai_PDs.to_volts(data[n:],n),self.simulation)
+
+		t=prof.record('daq.read',t)
+
+		if self.simulation:
+			self.PD_data=self.simulate_scan()
+			prof.record('daq.simulate',t)
+
+		evnt.set()
+
+
+	"""
+	Writing voltages of the lasers, if they changed by at least one LSB of the DAC since the last write. In the
+	staged mode they are only put into the waveform of the scan task, which is written afterwards.
+	"""
+	def update_laser_voltages(self):
+		if self.staged_laser_update:
+			self.ao_scan.stage_laser_voltages(self.ao_laser.voltages,self.ao_laser.lsb)
+		else:
+			self.ao_laser.update_voltages(True)
+
+
+	#Updating the record of the last scan (see "__init__").
+	def _stamp(self,ind,ts,overrun=False):
+		skipped=0
+		if self.scan_index>=0:
+			self.scan_dt=(ts-self.scan_timestamp)/1e9
+			skipped=max(0,ind-self.scan_index-1)
+			if skipped==0 and self.nominal_period>0:
+				skipped=max(0,int(round(self.scan_dt/self.nominal_period))-1)
+		self.scan_index=ind
+		self.scan_timestamp=ts
+		self.skipped_scans=skipped
+		self.total_skipped+=skipped
+		self.overrun=overrun
+		if overrun:
+			self.overruns+=1
+
+
+	#Wall clock time (as given by "time()") of the start of the last scan.
+	def scan_wall_time(self):
+		return self._epoch_offset+self.scan_timestamp/1e9
+
+
 	def get_power(self):
 
 		self.power_PDs.start()
@@ -257,30 +692,65 @@ class DAQ_tasks:
 		self.power_PDs.stop()
 
 
+	"""
+	Simulated traces for the master laser and all slave lasers. Master peaks move with the scan offset, slave peaks
+	with voltages of the lasers. All traces are generated at once by "lorentzians" into buffers that are reused as
+	long as the number of channels, samples and peaks doesn't change.
+	"""
 	def simulate_scan(self):
-		peak_m1=(self.ao_scan.mx_voltage/10-self.ao_scan.offset)+self.ao_scan.scan_time/8
-		peak_m2=peak_m1+self.ao_scan.scan_time*0.5
 
-		peak_s1=self.ao_laser.voltages[0]/5*self.ao_scan.scan_time
-		peak_s12p=peak_s1+(peak_m2-peak_m1)*1000/784.5
-		peak_s12m=peak_s1-(peak_m2-peak_m1)*1000/784.5
-		
-		M=generate_data([0.01,0.01],[peak_m1,peak_m2],[2/self.ao_scan.n_samples*self.ao_scan.scan_time,2/self.ao_scan.n_samples*self.ao_scan.scan_time],self.ao_scan.n_samples,0,self.ao_scan.scan_time)
-		M=add_noise(M,0.002)
-		
-		S1=generate_data([0.002,0.002,0.002],[peak_s1,peak_s12p,peak_s12m],[1/self.ao_scan.n_samples*self.ao_scan.scan_time,1/self.ao_scan.n_samples*self.ao_scan.scan_time,1/self.ao_scan.n_samples*self.ao_scan.scan_time],self.ao_scan.n_samples,0,self.ao_scan.scan_time)
-		S1=add_noise(S1,0.001)
-
-		if self.ao_laser._channel_no>1:
-			peak_s2=self.ao_laser.voltages[1]/5*self.ao_scan.scan_time
-			peak_s22p=peak_s2+(peak_m2-peak_m1)*1000/784.5
-			peak_s22m=peak_s2-(peak_m2-peak_m1)*1000/784.5
-			S2=generate_data([0.002,0.002,0.002],[peak_s2,peak_s22p,peak_s22m],[1/self.ao_scan.n_samples*self.ao_scan.scan_time,1/self.ao_scan.n_samples*self.ao_scan.scan_time,1/self.ao_scan.n_samples*self.ao_scan.scan_time],self.ao_scan.n_samples,0,self.ao_scan.scan_time)
-			S2=add_noise(S2,0.0015)
-		
-			return [M,S1,S2]
-		else:
-			return [M,S1]
+		scan=self.ao_scan
+		n_ch=1+self.ao_laser._channel_no
+		n_peaks=max(2,1+2*self.sim_sidebands)
+		shape=(n_ch,n_peaks,scan.n_samples,scan.scan_time)
+
+		if self._sim_shape!=shape:
+			self._sim_shape=shape
+			self._sim_data=np.zeros((n_ch,scan.n_samples))
+			self._sim_noise=np.zeros((n_ch,scan.n_samples))
+			self._sim_work=np.zeros((n_ch,n_peaks,scan.n_samples))
+			self._sim_x=np.linspace(0,scan.scan_time,num=scan.n_samples)
+			self._sim_A=np.zeros((n_ch,n_peaks))
+			self._sim_B=np.zeros((n_ch,n_peaks))
+			self._sim_G=np.zeros((n_ch,n_peaks))
+			self._sim_sigma=np.zeros((n_ch,1))
+
+		A,B,G=self._sim_A,self._sim_B,self._sim_G
+		dt=scan.scan_time/scan.n_samples
+
+		peak_m1=(scan.mx_voltage/10-scan.offset)+scan.scan_time/8
+		peak_m2=peak_m1+scan.scan_time*0.5
+
+		#Unused peaks have zero amplitude.
+		A[:]=0
+		A[0,:2]=0.01
+		B[0,:2]=peak_m1,peak_m2
+		G[0,:]=self.sim_master_width*dt
+		self._sim_sigma[0]=0.002
+
+		orders=np.arange(1,self.sim_sidebands+1)
+		spacing=orders*(peak_m2-peak_m1)*self.sim_sideband_spacing
+		side_amp=0.002*self.sim_sideband_amplitude**orders
+
+		for i in range(1,n_ch):
+			peak_s=self.ao_laser.voltages[i-1]/5*scan.scan_time
+			A[i,0]=0.002
+			B[i,0]=peak_s
+			A[i,1:1+2*self.sim_sidebands:2]=side_amp
+			B[i,1:1+2*self.sim_sidebands:2]=peak_s+spacing
+			A[i,2:2+2*self.sim_sidebands:2]=side_amp
+			B[i,2:2+2*self.sim_sidebands:2]=peak_s-spacing
+			G[i,:]=self.sim_slave_width*dt
+			self._sim_sigma[i]=0.0005+0.0005*i
+
+		lorentzians(self._sim_x,A,B,G,out=self._sim_data,work=self._sim_work)
+
+		self._sim_rng.standard_normal(out=self._sim_noise)
+		self._sim_noise*=self._sim_sigma
+		self._sim_data+=self._sim_noise
+
+		#Traces are generated for the full scan; only the scanned part is returned.
+		return self._sim_data[:,scan.zoom_start:scan.zoom_stop]
 
 	
 
@@ -295,8 +765,9 @@ number of samples per scan and scanning time).
 class Scan:
 
 	#We initialize by creating a DAQ Task and add an analog output channel used for the scan (channel number is in config file)
-	def __init__(self,dev,name,channel):
-		self.dq_task=dq.Task(new_task_name=name)
+	def __init__(self,backend,dev,name,channel):
+		self.backend=backend
+		self.dq_task=backend.Task(name)
 		self.dq_task.ao_channels.add_ao_voltage_chan(dev.name+"/ao"+str(channel))
 		self.n_samples=0
 		self.scan_time=0
@@ -309,6 +780,30 @@ class Scan:
 		self.scan_end=0
 		self.amplitude=0
 
+		#Part of the ramp that is scanned (indices; the whole ramp, unless zoomed).
+		self.zoom_start=0
+		self.zoom_stop=0
+		self.active_samples=0
+
+		#Set when scan points were changed, but not yet written to the DAQ (used in the continuous mode).
+		self._changed=False
+
+		"""
+		Laser channels added to this task in the staged mode. The waveform then has one row for the scan and one
+		(constant) row for every laser. "_laser_codes" are the staged voltages in units of the DAC LSB.
+		"""
+		self.waveform=None
+		self._laser_task=None
+		self._laser_volts=[]
+		self._laser_codes=None
+		self._laser_rows_changed=False
+
+		"""
+		Scan points are kept in a persistent buffer. The ramp scaled to the amplitude ("_ramp", from 0 to amplitude)
+		is cached, so a change of the offset is a single in-place addition instead of a new "linspace".
+		"""
+		self._ramp=np.zeros(0)
+
 
 	#Starting the task. Used if autostart is not used.
 	def start(self):
@@ -343,10 +838,19 @@ class Scan:
 		self.scan_end=offset+self.amplitude
 
 		#These are the points that will be writting to the DAQ (and then to cavity's piezo)
-		self.scan_points=np.linspace(self.offset,self.scan_end,num=self.n_samples)
+		self._ramp=np.linspace(0,self.amplitude,num=self.n_samples)
+		if not isinstance(self.scan_points,np.ndarray) or self.scan_points.shape!=self._ramp.shape:
+			self.scan_points=np.zeros(self.n_samples)
+		self._apply_offset()
 
 		self.scan_step=self.scan_points[1]-self.scan_points[0]
 
+		self.zoom_start=0
+		self.zoom_stop=self.n_samples
+		self.active_samples=self.n_samples
+
+		self._changed=True
+
 
 	#Method configuring scan sampling rate using number of samples per scan and the scan time.
 	def configure_scan_sampling(self,scan_time):
@@ -354,17 +858,104 @@ class Scan:
 		self.scan_time=scan_time #ms
 		self.sample_rate=1000*self.n_samples/scan_time #S/s
 
+		self._configure_clock()
+
+
+	def _configure_clock(self):
+
 		#The clock is configured using sample rate.
-		self.dq_task.timing.cfg_samp_clk_timing(self.sample_rate,samps_per_chan=self.n_samples)
+		self.dq_task.timing.cfg_samp_clk_timing(self.sample_rate,samps_per_chan=self.active_samples)
 
 		#We also need to adjust size of the buffer and set it to the number of samples that are supposed to be written. 
-		self.dq_task.out_stream.output_buf_size=self.n_samples
+		self.dq_task.out_stream.output_buf_size=self.active_samples
+
+
+	#Scanning only a part of the ramp (see DAQ_tasks.set_zoom).
+	def set_zoom(self,start,stop):
+		self.zoom_start=start
+		self.zoom_stop=stop
+		self.active_samples=stop-start
+		self._configure_clock()
+		self._changed=True
 
 
 	#Method performing writing data to DAQ.
 	def perform_scan(self,autostart_flag):
 
-		self.dq_task.write(self.scan_points,auto_start=autostart_flag)
+		self.dq_task.write(self._output(),auto_start=autostart_flag)
+
+
+	#Adding channels of the lasers to this task (staged mode). It's done once per task.
+	def attach_laser_channels(self,channels):
+		if self._laser_task is self.dq_task:
+			return
+		for ch in channels:
+			self.dq_task.ao_channels.add_ao_voltage_chan(ch)
+		self._laser_task=self.dq_task
+		self._laser_volts=[0]*len(channels)
+		self._laser_codes=None
+
+
+	#Staging new voltages of the lasers. They are written with the next scan (only if they changed by at least one LSB).
+	def stage_laser_voltages(self,voltages,lsb):
+		codes=tuple(round(v/lsb) for v in voltages)
+		if codes!=self._laser_codes:
+			self._laser_codes=codes
+			self._laser_volts=list(voltages)
+			self._laser_rows_changed=True
+			self._changed=True
+
+
+	"""
+	Data written to the task: scan points alone, or the waveform with rows for the lasers. In the latter case the
+	scan points become a view of the first row of the waveform, so offset changes are written there directly and
+	rows of the lasers are filled only when staged voltages changed.
+	"""
+	def _output(self):
+		if self._laser_task is not self.dq_task:
+			if self.active_samples<self.n_samples:
+				return self.scan_points[self.zoom_start:self.zoom_stop]
+			return self.scan_points
+
+		shape=(1+len(self._laser_volts),self.n_samples)
+		if self.waveform is None or self.waveform.shape!=shape or self.scan_points.base is not self.waveform:
+			self.waveform=np.zeros(shape)
+			self.waveform[0]=self.scan_points
+			self.scan_points=self.waveform[0]
+			self._laser_rows_changed=True
+
+		if self._laser_rows_changed:
+			self._laser_rows_changed=False
+			for i in range(len(self._laser_volts)):
+				self.waveform[i+1]=self._laser_volts[i]
+		if self.active_samples<self.n_samples:
+			return np.ascontiguousarray(self.waveform[:,self.zoom_start:self.zoom_stop])
+		return self.waveform
+
+
+	"""
+	Configuring the task for the continuous mode: the sampling is continuous and the buffer (exactly one ramp long)
+	is regenerated, so the ramp is written only once. The task is not started here.
+	"""
+	def configure_continuous(self):
+
+		self.dq_task.timing.cfg_samp_clk_timing(self.sample_rate,sample_mode=self.backend.CONTINUOUS,samps_per_chan=self.n_samples)
+		self.dq_task.out_stream.regen_mode=self.backend.ALLOW_REGENERATION
+		self.dq_task.out_stream.output_buf_size=self.n_samples
+
+		self.dq_task.write(self._output(),auto_start=False)
+		self._changed=False
+
+
+	"""
+	Writing changed scan points (new offset) to the running task in the continuous mode. Nothing is written if the
+	buffer didn't change. Otherwise the whole buffer is rewritten (a new offset changes every sample of the ramp, and
+	channels can't be written separately), so the write position stays aligned with the start of the ramp.
+	"""
+	def push_changes(self):
+		if self._changed:
+			self._changed=False
+			self.dq_task.write(self._output())
 
 
 	#Setting scanning offset. It has to modify all the scanning points. 
@@ -379,7 +970,7 @@ class Scan:
 
 		self.scan_end=offset+self.amplitude
 
-		self.scan_points=np.linspace(self.offset,self.scan_end,num=self.n_samples)
+		self._apply_offset()
 
 
 	#Moving scanning offset. It has to move all the scanning points. 
@@ -393,7 +984,13 @@ class Scan:
 
 		self.scan_end=self.offset+self.amplitude
 
-		self.scan_points=np.linspace(self.offset,self.scan_end,num=self.n_samples)
+		self._apply_offset()
+
+
+	#Writing the ramp shifted by the current offset to the persistent buffer of scan points (no allocation).
+	def _apply_offset(self):
+		np.add(self._ramp,self.offset,out=self.scan_points)
+		self._changed=True
 
 
 #################################################################################################################
@@ -405,8 +1002,8 @@ but doesn't add any channels.
 """
 class L_task:
 
-	def __init__(self,dev,name):
-		self.dq_task=dq.Task(new_task_name=name)
+	def __init__(self,backend,dev,name):
+		self.dq_task=backend.Task(name)
 		self.device=dev
 		self.voltages=[]
 		self.mn_voltages=[]
@@ -414,8 +1011,22 @@ class L_task:
 
 		#Number of slave lasers/channels used
 		self._channel_no=0
+
+		"""
+		Resolution of the DAC (in V). Voltages are written only if they changed by at least one LSB since the last
+		write ("_written" keeps them in units of the LSB) or if the task was recreated.
+		"""
+		self.set_resolution(16)
+		self._written=None
+		self._written_task=None
 	
 
+	#Resolution of the DAC in bits (for the +-10 V range).
+	def set_resolution(self,bits):
+		self.dac_bits=bits
+		self.lsb=20/2**bits
+
+
 	#Configuration of maximum and minimum voltages for all lasers.
 	def configure_voltage_boundaries(self,mn_voltages,mx_voltages):
 		for i in range(self._channel_no):
@@ -455,6 +1066,16 @@ class L_task:
 	#Method actually setting those voltages through the DAQ.
 	def set_voltages(self,as_flag):
 		self.dq_task.write(self.voltages,auto_start=as_flag)
+		self._written=tuple(round(v/self.lsb) for v in self.voltages)
+		self._written_task=self.dq_task
+
+
+	#Setting voltages only if they changed. Returns True, if they were written.
+	def update_voltages(self,as_flag):
+		if self._written_task is self.dq_task and self._written==tuple(round(v/self.lsb) for v in self.voltages):
+			return False
+		self.set_voltages(as_flag)
+		return True
 
 
 #################################################################################################################
@@ -466,16 +1087,51 @@ and by adding the first channel for the master (cavity reference) laser.
 """
 class PD_task:
 
-	def __init__(self,dev,name,scan_channel):
-		self.dq_task=dq.Task(new_task_name=name)
+	def __init__(self,backend,dev,name,scan_channel):
+		self.backend=backend
+		self.dq_task=backend.Task(name)
 		self.device=dev
 		self.dq_task.ai_channels.add_ai_voltage_chan(dev.name+"/ai"+str(scan_channel))
-		self.acq_data=[]
 		self.n_samples=0
 
+		"""
+		Data is read by a stream reader directly into a preallocated (channels x samples) array. "pd_data" and
+		"power_data" are views of its rows for the cavity photodetectors and for the power photodetectors (if they
+		are read by this task, see "attach_power_channels").
+		"""
+		self.acq_data=np.zeros((0,0))
+		self.pd_data=self.acq_data
+		self.power_data=self.acq_data[:0]
+		self._reader=None
+		self._reader_task=None
+
 		#Eventually equal to master laser + number of slave lasers.
 		self._channel_no=1
 
+		#Task to which power channels were added (they have to be added again when the task is recreated).
+		self._power_task=None
+
+		"""
+		Oversampling. Photodetectors are sampled "oversampling" (M) times faster than the scan and every M samples
+		are reduced to one ("Boxcar" - mean of the block, or "CIC" - second order CIC filter, i.e. a triangular 
+		window 2M samples long), so the processed data still has "n_samples" points, but lower noise. Raw samples
+		are read into "_raw".
+		"""
+		self.oversampling=1
+		self.decimation="Boxcar"
+		self._raw=np.zeros((0,0))
+
+		"""
+		Raw counts mode. Samples are read as int16 counts of the ADC (4 times less data than float64 volts) and
+		the peak finding works directly on them (all criteria are relative). "scale" keeps polynomial coefficients
+		(one row per channel, lowest order first) used to convert counts to volts for plotting and logging. With
+		oversampling, decimated data is kept in float64, but still in counts.
+		"""
+		self.raw_counts=False
+		self.scale=np.zeros((0,2))
+		self._dec_key=None
+		self._triggered=False
+
 
 	#Starting the task. Reading data is usually not started automatically.
 	def start(self):
@@ -486,6 +1142,17 @@ class PD_task:
 	def add_laser(self,channel):
 		self.dq_task.ai_channels.add_ai_voltage_chan(self.device.name+"/ai"+str(channel))
 		self._channel_no+=1
+		self._reader_task=None
+
+
+	#Adding channels of power photodetectors after all the cavity photodetectors (only once per task).
+	def attach_power_channels(self,channels):
+		if self._power_task is self.dq_task:
+			return
+		for ch in channels:
+			self.dq_task.ai_channels.add_ai_voltage_chan(ch)
+		self._power_task=self.dq_task
+		self._reader_task=None
 
 	"""
 	Synchronisation of the clock for this (read) task with the clock used to write voltages to the cavity (write task).
@@ -494,16 +1161,160 @@ class PD_task:
 	"""
 	def configure_clock(self,sample_rate,n_samples):
 		try:
-			self.dq_task.timing.cfg_samp_clk_timing(sample_rate,source='/'+self.device.name+'/ao/SampleClock',samps_per_chan=n_samples)
+			if self.oversampling>1:
+				self.dq_task.timing.cfg_samp_clk_timing(sample_rate*self.oversampling,samps_per_chan=n_samples*self.oversampling)
+			else:
+				self.dq_task.timing.cfg_samp_clk_timing(sample_rate,source='/'+self.device.name+'/ao/SampleClock',samps_per_chan=n_samples)
+			self._configure_trigger()
 			self.n_samples=n_samples
+			self._prepare_reader()
 
 		except NameError:
 			pass
 
 
-	#Method that actually acquires the data. The resulting array is (_channel_no x n_samples) (so n_samples per photodetctor).
-	def acquire_data(self):
-		self.acq_data=self.dq_task.read(number_of_samples_per_channel=self.n_samples)
+	"""
+	With oversampling, the task can't use the sample clock of the scan task. It uses its own (faster) clock, started
+	by the start trigger of the scan task, so the first sample is still taken at the start of the ramp.
+	"""
+	def _configure_trigger(self):
+		if self.oversampling>1:
+			self.dq_task.triggers.start_trigger.cfg_dig_edge_start_trig('/'+self.device.name+'/ao/StartTrigger')
+			self._triggered=True
+		elif self._triggered:
+			self.dq_task.triggers.start_trigger.disable_start_trig()
+			self._triggered=False
+
+
+	"""
+	Creating the stream reader and the buffer for the data. It has to be done again when the task is recreated, or
+	when the number of channels or samples changes.
+	"""
+	def _prepare_reader(self):
+		if self.raw_counts:
+			self._reader=self.backend.raw_reader(self.dq_task)
+			self._prepare_scale()
+		else:
+			self._reader=self.backend.reader(self.dq_task)
+		self._reader_task=self.dq_task
+		shape=(self.dq_task.number_of_channels,self.n_samples)
+		dtype=np.int16 if self.raw_counts and self.oversampling==1 else np.float64
+		if self.acq_data.shape!=shape or self.acq_data.dtype!=dtype:
+			self.acq_data=np.zeros(shape,dtype=dtype)
+		self.pd_data=self.acq_data[:self._channel_no]
+		self.power_data=self.acq_data[self._channel_no:]
+
+		if self.oversampling>1:
+			self._prepare_decimation()
+
+
+	"""
+	Buffers for the decimation. For the CIC filter, sums of the raw samples are calculated with cumulative sums:
+	"_c1" gives sums over M samples starting at every raw sample and "_c2" (cumulative sum of those) gives sums of
+	M such sums, which is the triangular window. "_cic_lo" and "_cic_hi" are indices of "_c2" for every output sample,
+	chosen so the window is centered at the block of M samples (and clipped at the edges of the scan).
+	"""
+	def _prepare_decimation(self):
+		M=self.oversampling
+		n_ch=self.acq_data.shape[0]
+		n_raw=self.n_samples*M
+
+		if self._dec_key!=(n_ch,n_raw,self.decimation,self.raw_counts):
+			self._dec_key=(n_ch,n_raw,self.decimation,self.raw_counts)
+			self._raw=np.zeros((n_ch,n_raw),dtype=np.int16 if self.raw_counts else np.float64)
+			if self.decimation=="CIC" and self.n_samples>1:
+				self._c1=np.zeros((n_ch,n_raw+1))
+				self._box=np.zeros((n_ch,n_raw-M+1))
+				self._c2=np.zeros((n_ch,n_raw-M+2))
+				self._cic_tmp=np.zeros((n_ch,self.n_samples))
+				self._cic_lo=np.clip(np.arange(self.n_samples)*M-M//2,0,n_raw-2*M+1)
+				self._cic_hi=self._cic_lo+M
+
+
+	#Reading the scaling coefficients of all channels (padded with zeros to the same length).
+	def _prepare_scale(self):
+		coeffs=self.backend.scaling_coeffs(self.dq_task)
+		order=max([2]+[len(c) for c in coeffs])
+		self.scale=np.zeros((len(coeffs),order))
+		for i in range(len(coeffs)):
+			self.scale[i,:len(coeffs[i])]=coeffs[i]
+
+
+	"""
+	Converting data (rows of channels starting from "first") from counts to volts. The polynomial is evaluated with
+	Horner's method for all channels at once. If data is already in volts, it's returned unchanged.
+	"""
+	def to_volts(self,data,first=0):
+		if not self.raw_counts:
+			return data
+		c=self.scale[first:first+len(data)]
+		res=np.multiply(data,c[:,-1:])
+		res+=c[:,-2:-1]
+		for k in range(c.shape[1]-3,-1,-1):
+			res*=data
+			res+=c[:,k:k+1]
+		return res
+
+
+	#Reducing raw samples (channels x n_samples*M) to (channels x n_samples), written to "out".
+	def _decimate(self,raw,out):
+		M=self.oversampling
+		if self.decimation=="CIC" and self.n_samples>1:
+			np.cumsum(raw,axis=1,out=self._c1[:,1:])
+			np.subtract(self._c1[:,M:],self._c1[:,:-M],out=self._box)
+			np.cumsum(self._box,axis=1,out=self._c2[:,1:])
+			np.take(self._c2,self._cic_hi,axis=1,out=out)
+			np.take(self._c2,self._cic_lo,axis=1,out=self._cic_tmp)
+			out-=self._cic_tmp
+			out/=M*M
+		else:
+			np.mean(raw.reshape(raw.shape[0],self.n_samples,M),axis=2,out=out)
+
+
+	"""
+	Configuration for the continuous mode. The task runs on the clock of the scan task, its buffer holds "n_buffers" 
+	scans and "callback" is called every time samples of one scan were acquired.
+	"""
+	def configure_continuous(self,sample_rate,n_samples,n_buffers,callback):
+		M=self.oversampling
+		if M>1:
+			self.dq_task.timing.cfg_samp_clk_timing(sample_rate*M,sample_mode=self.backend.CONTINUOUS,samps_per_chan=n_buffers*n_samples*M)
+		else:
+			self.dq_task.timing.cfg_samp_clk_timing(sample_rate,source='/'+self.device.name+'/ao/SampleClock',sample_mode=self.backend.CONTINUOUS,samps_per_chan=n_buffers*n_samples)
+		self._configure_trigger()
+		self.n_samples=n_samples
+		self._prepare_reader()
+		self.dq_task.register_every_n_samples_acquired_into_buffer_event(n_samples*M,callback)
+
+
+	#Unregistering the callback used in the continuous mode.
+	def release_continuous(self):
+		self.dq_task.register_every_n_samples_acquired_into_buffer_event(self.n_samples*self.oversampling,None)
+
+
+	"""
+	Method that actually acquires the data. The resulting array is (_channel_no x n_samples) (so n_samples per 
+	photodetctor). Data is written to "out" if given (it must have the same shape), otherwise to "acq_data". With
+	oversampling, raw samples are read first and then decimated into "out".
+	"""
+	def acquire_data(self,out=None):
+		if self._reader_task is not self.dq_task:
+			self._prepare_reader()
+		if out is None:
+			out=self.acq_data
+		if self.oversampling>1:
+			self._read(self._raw,self.n_samples*self.oversampling)
+			self._decimate(self._raw,out)
+		else:
+			self._read(out,self.n_samples)
+		return out
+
+
+	def _read(self,buf,n):
+		if self.raw_counts:
+			self._reader.read_int16(buf,number_of_samples_per_channel=n)
+		else:
+			self._reader.read_many_sample(buf,number_of_samples_per_channel=n)
 
 
 
@@ -517,16 +1328,24 @@ It initializes by creating a DAQ Task and by adding channel for the first scienc
 """
 class Power_PD_task:
 
-	def __init__(self,dev,name):
-		self.dq_task=dq.Task(new_task_name=name)
+	def __init__(self,backend,dev,name):
+		self.backend=backend
+		self.dq_task=backend.Task(name)
 		self.device=dev
-		self.acq_data=[]
 		self.power=[]
 		self.n_samples=10
 
+		#Same as for the PD_task, data is read into a preallocated array.
+		self.acq_data=np.zeros((0,0))
+		self._reader=None
+		self._reader_task=None
+
 		#Eventually equal to number of slave lasers.
 		self._channel_no=0
 
+		#How the power is calculated from the samples: "RMS" or "Mean".
+		self.reduction="RMS"
+
 
 	#Starting the task. Reading data is usually not started automatically.
 	def start(self):
@@ -541,22 +1360,45 @@ class Power_PD_task:
 	def add_laser(self,channel):
 		self.dq_task.ai_channels.add_ai_voltage_chan(self.device.name+"/ai"+str(channel))
 		self._channel_no+=1
-		self.power.append(deque(maxlen=40))
+		self._reader_task=None
+		self.power.append(RingBuffer(40))
 		self.power[-1].append(0)
 
 
+	def _prepare_reader(self):
+		self._reader=self.backend.reader(self.dq_task)
+		self._reader_task=self.dq_task
+		shape=(self.dq_task.number_of_channels,self.n_samples)
+		if self.acq_data.shape!=shape:
+			self.acq_data=np.zeros(shape)
+
+
 	#Method that actually acquires the data. The resulting array is (_channel_no x n_samples) (so n_samples per photodetctor).
 	def acquire_data(self,sim):
-		if self._channel_no>1:
-			self.acq_data=self.dq_task.read(number_of_samples_per_channel=self.n_samples)	
-		else:
-			self.acq_data=[self.dq_task.read(number_of_samples_per_channel=self.n_samples)]
+		if self._reader_task is not self.dq_task:
+			self._prepare_reader()
+
+		self._reader.read_many_sample(self.acq_data,number_of_samples_per_channel=self.n_samples)
+
+		self.process_data(self.acq_data,sim)
+
+
+	"""
+	Calculating power of every channel from the acquired samples ((channels x samples) array; it can be read by this
+	task or by the PD_task). Both reductions are done for all channels at once.
+	"""
+	def process_data(self,data,sim=False):
 
 		if sim:
-			self.acq_data=[[242+random.random() for i in range(self.n_samples)] for j in range(self._channel_no)]
+			data=242+np.random.random(data.shape)
+
+		if self.reduction=="Mean":
+			vals=np.mean(data,axis=1)
+		else:
+			vals=np.sqrt(np.einsum('ij,ij->i',data,data)/data.shape[1])
 
 		for i in range(self._channel_no):
-			self.power[i].append(math.sqrt(sum([x**2 for x in self.acq_data[i]])/self.n_samples))
+			self.power[i].append(vals[i])
 
 		
 
@@ -568,14 +1410,17 @@ class Power_PD_task:
 """
 The global function is defined to simply setup tasks using information from the config file. This function is run inside the GUI initialization
 when a TransferLock obejct is initialized. This method simply creates a DAQ_tasks object, adds references to Scan, L_task and PD_task objects,
-adjusts parameters and sets up and synchronises clocks. It returns object of the DAQ_tasks class.
+adjusts parameters and sets up and synchronises clocks. It returns object of the DAQ_tasks class. The backend is chosen
+with the "Backend" option in the DAQ section ("NI" by default, or "Sim" for the simulated cavity).
 """
 def setup_tasks(cfg,n,simulate):
 
-	if cfg['DAQ']['DeviceName']=="default":
-		tq=DAQ_tasks(simulate)
+	backend=get_backend(cfg)
+
+	if cfg['DAQ']['DeviceName']=="default" or backend.simulated:
+		tq=DAQ_tasks(simulate,backend=backend)
 	else:
-		tq=DAQ_tasks(simulate,dev_name=cfg['DAQ']['DeviceName'])
+		tq=DAQ_tasks(simulate,dev_name=cfg['DAQ']['DeviceName'],backend=backend)
 
 	tq.set_scan_task("Scan",channel=int(cfg['CAVITY']['OutputChannel']))
 	tq.set_laser_task("Lasers")
@@ -591,9 +1436,29 @@ def setup_tasks(cfg,n,simulate):
 		tq.set_laser_voltage_boundaries([float(cfg['LASER1']['MinVoltage'])],[float(cfg['LASER1']['MaxVoltage'])])
 		tq.set_laser_volts([float(cfg['LASER1']['SetVoltage'])])
 	
+	tq.combined_power=int(get_option(cfg,'DAQ','PowerInScan','0'))>0
+	tq.power_PDs.reduction=get_option(cfg,'DAQ','PowerReduction','RMS')
+
+	tq.ai_PDs.oversampling=max(1,int(get_option(cfg,'DAQ','Oversampling','1')))
+	tq.ai_PDs.decimation=get_option(cfg,'DAQ','Decimation','Boxcar')
+	tq.ai_PDs.raw_counts=int(get_option(cfg,'DAQ','RawCounts','0'))>0
+
+	tq.adaptive_zoom=int(get_option(cfg,'CAVITY','AdaptiveZoom','0'))>0
+	tq.zoom_margin=float(get_option(cfg,'CAVITY','ZoomMargin','0.15'))
+
+	tq.staged_laser_update=int(get_option(cfg,'DAQ','StagedLaserUpdate','0'))>0
+	tq.ao_laser.set_resolution(int(get_option(cfg,'DAQ','DACBits','16')))
+
 	tq.set_input_timing()
 
+	tq.continuous=int(get_option(cfg,'CAVITY','ContinuousScan','0'))>0
 
+	#Shape of the traces simulated with NI devices (optional).
+	tq.sim_master_width=float(get_option(cfg,'SIMULATION','MasterLinewidth',str(tq.sim_master_width)))
+	tq.sim_slave_width=float(get_option(cfg,'SIMULATION','SlaveLinewidth',str(tq.sim_slave_width)))
+	tq.sim_sidebands=int(get_option(cfg,'SIMULATION','Sidebands',str(tq.sim_sidebands)))
+	tq.sim_sideband_spacing=float(get_option(cfg,'SIMULATION','SidebandSpacing',str(tq.sim_sideband_spacing)))
+	tq.sim_sideband_amplitude=float(get_option(cfg,'SIMULATION','SidebandAmplitude',str(tq.sim_sideband_amplitude)))
 
 	return tq
 
@@ -607,13 +1472,32 @@ def channel_number(channel):
 
 	return x
 
+"""
+Vectorized sum of Lorentzian peaks A/(G^2+(x-B)^2). A, B and G have shape (channels, peaks) (or (peaks,) for a
+single trace) and the result has shape (channels, samples). The calculation is broadcast over samples, peaks and
+channels; "out" and "work" (channels x peaks x samples) can be given to avoid allocating arrays at every call.
+"""
+def lorentzians(x,A,B,G,out=None,work=None):
+
+	A=np.asarray(A,dtype=np.float64)
+	B=np.asarray(B,dtype=np.float64)
+	G=np.asarray(G,dtype=np.float64)
+
+	if work is None:
+		work=np.empty(B.shape+(len(x),))
+
+	np.subtract(x,B[...,None],out=work)
+	np.square(work,out=work)
+	work+=np.square(G)[...,None]
+	np.divide(A[...,None],work,out=work)
+
+	return np.sum(work,axis=-2,out=out)
+
 def generate_data(A,B,G,N,start,end):
 
 	X=np.linspace(start,end,num=N)
 
-	Y=[lor(X[i],A,B,G) for i in range(len(X))]
-
-	return Y
+	return lorentzians(X,A,B,G)
 
 def add_noise(data,var):
 
@@ -622,7 +1506,5 @@ def add_noise(data,var):
 	return data+noise
 
 def lor(x,A,B,G):
-	res=0
-	for i in range(len(A)):
-		res+=A[i]/(G[i]**2+(x-B[i])**2)
-	return res
\ No newline at end of file
+	res=lorentzians(np.atleast_1d(x),A,B,G)
+	return res if np.ndim(x) else res[0]
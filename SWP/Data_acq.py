@@ -1,15 +1,17 @@
-import nidaqmx as dq
 import matplotlib.pyplot as plt
 import numpy as np
 import math
 import queue
 import logging
-import h5py
 from threading import Thread, Event
-from time import sleep
+from time import sleep, perf_counter, perf_counter_ns
 
 from .DAQ_tasks import *
 from .Lock import *
+from .Statistics import RollingStats
+from .Buffers import RingBuffer
+from .Profiling import CadenceStats
+from .Config import get_option
 from .Themes import Colors
 
 """
@@ -28,7 +30,7 @@ log=logging.getLogger(__name__)
 """
 The method in this class that's directly run from GUI is the "start_scan" method. Other methods are run through
 the scan function and are called only if locks are engaged. This class also has conntainers for error signals'
-history (in a queue) that is used for plotting.
+history (in a ring buffer) that is used for plotting.
 """
 class TransferLock:
 
@@ -44,7 +46,8 @@ class TransferLock:
 
 		self._err_data_length=100   #Length of the error signal collected
 
-		self.rms_points=min(int(lock.cfg['CAVITY']['RMS']),self._err_data_length) #Number of points used for RMS calculation
+		#Number of points used for RMS calculation. It is independent of the length of the plotted history.
+		self.rms_points=int(lock.cfg['CAVITY']['RMS'])
 
 		#This variable defines the limit below which master laser is considered locked.
 		self.master_rms_crit=float(cfg['CAVITY']['LockThreshold']) #ms
@@ -53,10 +56,17 @@ class TransferLock:
 		self.master_lock_engaged=False
 		self.master_locked_flag=False
 
+		#Flag showing whether or not exactly 2 master peaks were found in the last scan
+		self.two_peaks=False
+
 		#Error signal history is contained in the queue (kept in MHz)
-		self.master_err_history=deque(maxlen=self._err_data_length)
+		self.master_err_history=RingBuffer(self._err_data_length)
 		self.master_err_history.append(0)
 
+		#Rolling statistics (mean, RMS, peak-to-peak) of the error signal over the last "rms_points" points
+		self.master_err_stats=RollingStats(self.rms_points)
+		self.master_err_stats.push(0)
+
 		#Current RMS of the error signal
 		self.master_err_rms=0
 
@@ -79,13 +89,17 @@ class TransferLock:
 			self.slave_locked_flags.append(Event())
 
 		#RMS history
-		self.slave_err_history=[deque(maxlen=self._err_data_length)]
+		self.slave_err_history=[RingBuffer(self._err_data_length)]
 		if n>1:
-			self.slave_err_history.append(deque(maxlen=self._err_data_length)) #Kept in MHz instead of r
+			self.slave_err_history.append(RingBuffer(self._err_data_length)) #Kept in MHz instead of r
 
 		for i in range(n):
 			self.slave_err_history[i].append(0)
 
+		self.slave_err_stats=[RollingStats(self.rms_points) for i in range(n)]
+		for i in range(n):
+			self.slave_err_stats[i].push(0)
+
 		#Current RMS (in MHz as well)
 		self.slave_err_rms=[0]*n
 
@@ -99,14 +113,31 @@ class TransferLock:
 		#Flags
 		self.slave_locks_engaged=[False]*n
 
-		#Queue to calculate average real scanning frequency
-		self._scan_frequency=deque(maxlen=10)
+		#Buffer to calculate average real scanning frequency
+		self._scan_frequency=RingBuffer(10)
+
+		#Per-stage latency histograms of the scan loop. Shared with DAQ_tasks, which records its own stages.
+		self.profiler=tasks.profiler
+
+		"""
+		Target period of the scan loop (in seconds). If it is set, iterations are started at fixed intervals, which
+		keeps the time step of the PI loops constant. If an iteration takes longer, plotting is skipped (rows are
+		still logged) in the next one so that the loop can catch up. If it is 0, scans are performed as fast as possible.
+		It is taken only from the config ("TargetPeriod" in ms), as the expected scan period of DAQ_tasks is set with it.
+		"""
+		self.target_period=float(get_option(cfg,'CAVITY','TargetPeriod','0'))/1000
+		tasks.nominal_period=self.target_period
+		self.cadence=CadenceStats()
+		self._behind=False
 
 		#Counter for number of times scan was performed (used when logging turned on) before being paused.
 		self._counter=0
 		self._master_counter=0
 		self._slave_counters=[0,0]
 
+		#Recorder of raw traces (see TraceRecorder in Log_writer.py), set by the GUI if traces are recorded.
+		self.trace_recorder=None
+
 		#Helpful flags and events
 		self._scan_thread=None
 		self._scan_flag=False
@@ -129,24 +160,36 @@ class TransferLock:
 	Two function below are responsible for "acquiring" signal, by which I mean filtering the signal and finding
 	peaks. The data is in reality obtained regardless of these functions and is contained in DAQ_tasks object,
 	which is used here as arguments of initialization for Signal class object. These functions are run only
-	if appropriate locks are engaged.
+	if appropriate locks are engaged. If positions of the peaks were found beforehand (see find_peaks_block), they
+	are given in "peaks" and the traces are not analyzed again.
 	"""
-	def obtain_master_signal(self):
+	def obtain_master_signal(self,peaks=None):
+		if peaks is not None:
+			self.master_signal=Peaks(peaks)
+			return
 		try:
-			self.master_signal=Signal(self.daq_tasks.time_samples,self.daq_tasks.PD_data[0],self.filter)
+			self.master_signal=Signal(self.daq_tasks.time_samples,self.daq_tasks.PD_data[0],self.filter,self._discarded())
 			self.master_signal.find_peaks(criterion=self.master_peak_crit,win_size=self.daq_tasks.ao_scan.n_samples//200)
 		except Exception as e:
 			log.warning(e)
 
 
-	def obtain_slave_signal(self,ind):
+	def obtain_slave_signal(self,ind,peaks=None):
+		if peaks is not None:
+			self.slave_signals[ind]=Peaks(peaks)
+			return
 		try:
-			self.slave_signals[ind]=Signal(self.daq_tasks.time_samples,self.daq_tasks.PD_data[ind+1],self.filter)
+			self.slave_signals[ind]=Signal(self.daq_tasks.time_samples,self.daq_tasks.PD_data[ind+1],self.filter,self._discarded())
 			self.slave_signals[ind].find_peaks(criterion=self.slave_peak_crits[ind],win_size=self.daq_tasks.ao_scan.n_samples//200)
 		except Exception as e:
 			log.warning(e)
 
 
+	#Number of samples at the start of the current (possibly zoomed) scan that are discarded by the peak finding.
+	def _discarded(self):
+		return discarded_samples(len(self.daq_tasks._full_time),self.daq_tasks.ao_scan.zoom_start)
+
+
 	"""
 	Series of locking functions that are used only if appropriate locks are engaged and if master signal has exactly
 	2 peaks. The flags (in form of threading.Event) are used to time different processes correctly. They're just a 
@@ -159,7 +202,8 @@ class TransferLock:
 	errors for this iterations and returns them ("mer" and "ser" variables below). 
 
 	These errors are then passed to update_master_error and update_slave_error methods. These simply add the error
-	to appropriate queues and then calculate RMS of the error signal using chosen number of points. The resulting
+	to appropriate queues and to the rolling statistics, which keep RMS of the error signal over the chosen number of 
+	points (without recalculating it from the whole history). The resulting
 	RMS is compared with thresholds and status of the laser is changed to "locked", if criterion is met. For slave
 	laser the criterion has to be met for 25 consecutive iterations to considered the laser locked.
 
@@ -210,13 +254,11 @@ class TransferLock:
 
 	def update_master_error(self,err):
 
-		#It is a FIFO queue which automatically removes the oldest element if it becomes over limit
+		#It is a FIFO buffer which automatically overwrites the oldest element if it becomes over limit
 		self.master_err_history.append(err) 
 
-		if len(self.master_err_history)<=self.rms_points:
-			self.master_err_rms=math.sqrt(np.sum(np.power(list(self.master_err_history),2))/len(list(self.master_err_history)))
-		else:
-			self.master_err_rms=math.sqrt(np.sum(np.power(list(self.master_err_history)[-self.rms_points:],2))/self.rms_points)
+		self.master_err_stats.push(err)
+		self.master_err_rms=self.master_err_stats.rms()
 
 		if self.master_err_rms<self.master_rms_crit:
 			self.master_locked_flag=True
@@ -227,10 +269,9 @@ class TransferLock:
 	def update_slave_error(self,err,ind):
 
 		self.slave_err_history[ind].append(err)
-		if len(self.slave_err_history[ind])<=self.rms_points:
-			self.slave_err_rms[ind]=math.sqrt(np.sum(np.power(list(self.slave_err_history[ind]),2))/len(list(self.slave_err_history[ind])))
-		else:
-			self.slave_err_rms[ind]=math.sqrt(np.sum(np.power(list(self.slave_err_history[ind])[-self.rms_points:],2))/self.rms_points)
+
+		self.slave_err_stats[ind].push(err)
+		self.slave_err_rms[ind]=self.slave_err_stats[ind].rms()
 
 		if self.slave_err_rms[ind]<self.slave_rms_crits[ind]:
 			self.slave_lock_counters[ind]+=1
@@ -244,276 +285,375 @@ class TransferLock:
 
 
 
-	def master_logging_loop(self,GUI_object=None):
-		
+	#Changing number of points used for RMS. Points that are still within the new window are kept.
+	def set_rms_points(self,n):
+		self.rms_points=max(int(n),1)
+		self.master_err_stats.set_window(self.rms_points)
+		for stats in self.slave_err_stats:
+			stats.set_window(self.rms_points)
 
-		while GUI_object.master_logging_flag.is_set():
 
-			sleep(10)
+	#Clearing error history, statistics and feedback of the lock when it is disengaged.
+	def reset_master_error(self):
+		self.master_err_history.clear()
+		self.master_err_history.append(0)
+		self.master_err_stats.clear()
+		self.master_err_stats.push(0)
+		self.master_err_rms=0
+		self.lock.master_err=0
+		self.lock.master_err_prev=0
+		self.lock.master_ctrl=0
 
-			if GUI_object.master_error_temp.empty():
-					continue
 
-			with h5py.File(GUI_object.mlog_filename,'a') as f:
+	def reset_slave_error(self,ind):
+		self.slave_err_history[ind].clear()
+		self.slave_err_history[ind].append(0)
+		self.slave_err_stats[ind].clear()
+		self.slave_err_stats[ind].push(0)
+		self.slave_err_rms[ind]=0
+		self.slave_locked_flags[ind].clear()
+		self.lock.slave_errs[ind]=0
+		self.lock.slave_errs_prev[ind]=0
+		self.lock.slave_ctrls[ind]=0
 
-				queue_length=len(list(GUI_object.master_error_temp.queue))
 
-				dataset_length=f['Errors'].shape[0]
+	#Used when the lockpoint of a slave laser is changed and we have to wait until the laser is locked again.
+	def restart_slave_lock_count(self,ind):
+		self.slave_locked_flags[ind].clear()
+		self.slave_lock_counters[ind]=0
 
-				if dataset_length==1:
-					f['Errors'].resize(queue_length,axis=0)
-					f['Time'].resize(queue_length,axis=0)
-				else:
-					f['Errors'].resize(dataset_length+queue_length,axis=0)
-					f['Time'].resize(dataset_length+queue_length,axis=0)
-				
-				f['Errors'][-queue_length:]=list(GUI_object.master_error_temp.queue)
-				f['Time'][-queue_length:]=list(GUI_object.master_time_temp.queue)
 
-				GUI_object.master_error_temp=queue.Queue(maxsize=10000)
-				GUI_object.master_time_temp=queue.Queue(maxsize=10000)
 
-			
+	"""
+	The functions below manage the scan and perform it through the DAQ_tasks class methods. The "scan" function is 
+	run in a separate thread that is open from the level of GUI. This function runs as long as the scan flag is
+	set to True. Each iteration is split into two parts: "control_step", which acquires the data and runs the 
+	locks (it does not touch the GUI, so it can also be run in a separate process), and "update_gui", which puts
+	the results on the GUI. The order is as follows:
+		- scan is performed, i.e. cavity's piezo is ramped and data from photodetectors acquired
+		- time of that task is measured and added to the buffer used for calculating real scanning frequency
+		- next, if the cavity lock is not engaged, nothing else happens in the control step
+		- the signal from the master signal is analyzed (peaks are found)
+		- if there are not exactly 2 peaks, nothing more happens 
+		- otherwise the locking function is called (described above), after which, if the master laser/cavity is
+		locked, the slave lasers are locked, if the locks are engaged of course
+		- in the GUI part new values of labels and 2D lines on the plot are posted to the GUI update bus, which
+		applies the latest ones in the Tk thread once per frame (lines are blitted); axes limits are adjusted only 
+		if the data left them
+		- the plotting of error signal happens, as well as logging to a container, if the user chose to record
+		the error signal; that occurs at the very end of the iteration
+		- if the target period is set, the loop waits for the scheduled start of the next iteration; if the 
+		deadline was missed, the next iteration skips plotting (logging is never skipped)
 
+	"""
+	def control_step(self):
 
-	def slave_logging_loop(self,GUI_object=None,ind=None):
+		prof=self.profiler
 
-		
-		while GUI_object.slave_logging_flag[ind].is_set():
-			sleep(10)
+		self._scan_finished.clear()
 
+		t_start=perf_counter_ns()
 
-			if GUI_object.slave_err_temp[ind].empty():
-				continue
+		self.daq_tasks.scan_and_acquire(self._scan_finished)
 
-			with h5py.File(GUI_object.laslog_filenames[ind],'a') as f:
+		self._scan_finished.wait()
 
-				queue_length=len(list(GUI_object.slave_err_temp[ind].queue))
-				dataset_length=f['Errors'].shape[0]
+		#Scan rate and the time step of the PI loops are taken from timestamps of consecutive scans.
+		if self.daq_tasks.scan_dt>0:
+			self._scan_frequency.append(1/self.daq_tasks.scan_dt)
+		self.lock.dt=self.daq_tasks.scan_dt
 
+		prof.record('scan.acquire',t_start)
 
-				if dataset_length==1:
-					f['Errors'].resize(queue_length,axis=0)
-					f['Time'].resize(queue_length,axis=0)
-					f['RealFrequency'].resize(queue_length,axis=0)
-					f['LockFrequency'].resize(queue_length,axis=0)
-					f['RealR'].resize(queue_length,axis=0)
-					f['LockR'].resize(queue_length,axis=0)
-					f['Power'].resize(queue_length,axis=0)
-					f['WvmFrequency'].resize(queue_length,axis=0)
+		self.process_scan()
+
+		if self.daq_tasks.adaptive_zoom:
+			self.update_zoom()
+
+		return t_start
 
-				else:
-					f['Errors'].resize(dataset_length+queue_length,axis=0)
-					f['Time'].resize(dataset_length+queue_length,axis=0)
-					f['RealFrequency'].resize(dataset_length+queue_length,axis=0)
-					f['LockFrequency'].resize(dataset_length+queue_length,axis=0)
-					f['RealR'].resize(dataset_length+queue_length,axis=0)
-					f['LockR'].resize(dataset_length+queue_length,axis=0)
-					f['Power'].resize(dataset_length+queue_length,axis=0)
-					f['WvmFrequency'].resize(dataset_length+queue_length,axis=0)
-
-				try:
-					f['Errors'][-queue_length:]=list(GUI_object.slave_err_temp[ind].queue)
-				except TypeError:
-					ql=len(list(GUI_object.slave_err_temp[ind].queue))
-					f['Errors'][-ql:]=list(GUI_object.slave_err_temp[ind].queue)
-
-				try:
-					f['Time'][-queue_length:]=list(GUI_object.slave_time_temp[ind].queue)
-				except TypeError:
-					ql=len(list(GUI_object.slave_time_temp[ind].queue))
-					f['Time'][-ql:]=list(GUI_object.slave_time_temp[ind].queue)
-
-				try:
-					f['RealFrequency'][-queue_length:]=list(GUI_object.slave_rfreq_temp[ind].queue)
-				except TypeError:
-					ql=len(list(GUI_object.slave_rfreq_temp[ind].queue))
-					f['RealFrequency'][-ql:]=list(GUI_object.slave_rfreq_temp[ind].queue)
-
-				try:
-					f['LockFrequency'][-queue_length:]=list(GUI_object.slave_lfreq_temp[ind].queue)
-				except TypeError:
-					ql=len(list(GUI_object.slave_lfreq_temp[ind].queue))
-					f['LockFrequency'][-ql:]=list(GUI_object.slave_lfreq_temp[ind].queue)
-
-				try:
-					f['RealR'][-queue_length:]=list(GUI_object.slave_rr_temp[ind].queue)
-				except TypeError:
-					ql=len(list(GUI_object.slave_rr_temp[ind].queue))
-					f['RealR'][-ql:]=list(GUI_object.slave_rr_temp[ind].queue)
-
-				try:	
-					f['LockR'][-queue_length:]=list(GUI_object.slave_lr_temp[ind].queue)
-				except TypeError:
-					ql=len(list(GUI_object.slave_lr_temp[ind].queue))
-					f['LockR'][-ql:]=list(GUI_object.slave_lr_temp[ind].queue)
-
-				try:
-					f['Power'][-queue_length:]=list(GUI_object.slave_pow_temp[ind].queue)
-				except TypeError:
-					ql=len(list(GUI_object.slave_pow_temp[ind].queue))
-					f['Power'][-ql:]=list(GUI_object.slave_pow_temp[ind].queue)
-
-				try:
-					f['WvmFrequency'][-queue_length:]=list(GUI_object.slave_wvmfreq_temp[ind].queue)
-				except TypeError:
-					ql=len(list(GUI_object.slave_wvmfreq_temp[ind].queue))
-					f['WvmFrequency'][-ql:]=list(GUI_object.slave_wvmfreq_temp[ind].queue)
-					
-				GUI_object.slave_err_temp[ind]=queue.Queue(maxsize=10000)
-				GUI_object.slave_time_temp[ind]=queue.Queue(maxsize=10000)
-				GUI_object.slave_rfreq_temp[ind]=queue.Queue(maxsize=10000)
-				GUI_object.slave_lfreq_temp[ind]=queue.Queue(maxsize=10000)
-				GUI_object.slave_rr_temp[ind]=queue.Queue(maxsize=10000)
-				GUI_object.slave_lr_temp[ind]=queue.Queue(maxsize=10000)
-				GUI_object.slave_pow_temp[ind]=queue.Queue(maxsize=10000)
-				GUI_object.slave_wvmfreq_temp[ind]=queue.Queue(maxsize=10000)
-
-
-			
 
 	"""
-	The function below manages the scan and performs it through the DAQ_tasks class methods. It is run in 
-	a separate thread that is open from the level of GUI. This function runs as long as the scan flag is
-	set to True. Currently, acquiring data and updating the plots is done sequentially in this function.
-	The order is as follows:
-		- scan is performed, i.e. cavity's piezo is ramped and data from photodetectors acquired
-		- time of that task is measured and added to the queue used for calculating real scanning frequency
-		- label in the GUI is updated
-		- 2D lines on the plot are updated (and redrawn at the end of the function) and axes limits adjusted.
-		This refers to the plot showing the data from photodiodes, not the error signal.
-		- next, if the cavity lock is not engaged, nothing happens (graphs are just told to redraw) and next
-		iteration begins
-		- the signal from the master signal is analyzed (peaks are found)
-		- if there are not exactly 2 peaks, nothing more happens and next iteration begins
-		- otherwise first a GUI element is changed and the locking function called (described above), after
-		which, if the master laser/cavity is locked, other GUI elements are updated
-		- now whether or not the cavity is locked, the plotting of error signal happens, as well as logging
-		to a container, if the user chose to record the error signal; that occurs at the very end of the iteration
-		- if the cavity is locked, before error signal plotting happens, the slave lasers are locked, if the
-		locks are engaged of course; GUI elements are updated as well
+	Locking part of the iteration: finding peaks in the traces that are in DAQ_tasks ("PD_data", "time_samples") and
+	running the locks. It is separate from the acquisition, so recorded traces can be put through exactly the same
+	code (see Replay.py). "peaks" can be a list of positions of peaks (for every channel of the PDs) found beforehand.
+	"""
+	def process_scan(self,peaks=None):
+
+		prof=self.profiler
+		t=perf_counter_ns()
+
+		self.two_peaks=False
+
+		if self.master_lock_engaged:
+
+			self.obtain_master_signal(None if peaks is None else peaks[0])
+
+			t=prof.record('scan.master_peaks',t)
+
+			if len(self.master_signal.peaks_x)==2:
 
+				self.two_peaks=True
+
+				self.lock_master()
+
+				self._lck_adjust_fin.wait()
+
+				t=prof.record('scan.master_lock',t)
+
+			if self.master_locked_flag and any(self.slave_locks_engaged):
+				for i in range(len(self.slave_locks_engaged)):
+					if self.slave_locks_engaged[i]:
+						self.obtain_slave_signal(i,None if peaks is None else peaks[i+1])
+						self.lock_laser(i)
+						self._slck_adjust_fin[i].wait()
+
+				prof.record('scan.slave_locks',t)
+
+
+	"""
+	Adaptive zoom of the scan. When the master laser is locked, the scan is narrowed to the part of the ramp that 
+	contains both master peaks and peaks of the slave lasers that are locked (with a margin). The range is changed
+	only if a peak gets too close to its edge or if the range is much wider than needed, so the tasks are not
+	reconfigured at every iteration. If the master lock is lost or a peak of a locked slave laser disappears, the 
+	full scan is restored.
 	"""
+	def update_zoom(self):
 
-	def scan(self,GUI_object=None):
+		tq=self.daq_tasks
+		if tq.running_continuous:
+			return
 
-		self._scan_paused.clear()
-		self._counter=0
+		lost=not (self.master_lock_engaged and self.master_locked_flag and self.two_peaks)
 
-		while self._scan_flag:
+		peaks=list(self.lock.master_peaks)
+		if not lost:
+			for i in range(len(self.slave_locks_engaged)):
+				if self.slave_locks_engaged[i]:
+					if isinstance(self.slave_signals[i],Signal) and len(self.slave_signals[i].peaks_x)>0:
+						peaks.append(self.lock.slave_peaks[i])
+					else:
+						lost=True
 
-			self._scan_finished.clear()
+		if lost:
+			if tq.zoomed():
+				tq.reset_zoom()
+			return
 
-			ts=time()
+		margin=tq.zoom_margin*abs(peaks[1]-peaks[0])
+		needed=np.searchsorted(tq._full_time,[min(peaks)-margin,max(peaks)+margin])
+		start,stop=tq.ao_scan.zoom_start,tq.ao_scan.zoom_stop
 
-			self.daq_tasks.scan_and_acquire(self._scan_finished)
+		if needed[0]<start or needed[1]>stop or (stop-start)>2*(needed[1]-needed[0]):
+			#The new range has twice the margin, so small drifts don't require another change.
+			wider=np.searchsorted(tq._full_time,[min(peaks)-2*margin,max(peaks)+2*margin])
+			tq.set_zoom(wider[0],wider[1]+1)
 
-			self._scan_finished.wait()
-			self._scan_frequency.append(1/(time()-ts))
 
-			GUI_object.real_scfr.config(text='{:.1f}'.format(np.mean(list(self._scan_frequency))))
+	"""
+	GUI part of the iteration. If "skip" is True, plotting is skipped; rows are still logged (pushing them to the
+	log writers is cheap, and skipping them would leave gaps in the logs). Logging can be turned off
+	with "log", if the rows are pushed separately (in the separate process mode every record is logged, but the GUI
+	is updated once for all records read at once).
+	"""
+	def update_gui(self,GUI_object,skip=False,log=True):
 
-			for i in range(len(self.daq_tasks.PD_data)):
-				GUI_object.plot_win.all_lines[i].set_data(self.daq_tasks.time_samples,self.daq_tasks.PD_data[i])
+		prof=self.profiler
+		t=perf_counter_ns()
+
+		#Changes of widgets and plots are posted to the update bus and applied in the Tk thread.
+		bus=GUI_object.gui_bus
+		pw=GUI_object.plot_win
+
+		bus.config(GUI_object.real_scfr,text='{:.1f}'.format(self._scan_frequency.mean()))
+
+		if not skip:
+			#Traces may be kept in raw counts; they're converted to volts only for plotting. The scan thread reuses
+			#its buffers, so the plots get a copy (they're drawn later, in the Tk thread).
+			volts=np.array(self.daq_tasks.get_PD_volts())
+			for i in range(len(volts)):
+				bus.post(pw.all_lines[i],pw.all_lines[i].set_data,self.daq_tasks.time_samples,volts[i])
 				if i==0:
-					GUI_object.plot_win.all_lines[i+3].set_data([self.lock.master_lockpoint]*2,[-10,10])
+					bus.post(pw.all_lines[i+3],pw.all_lines[i+3].set_data,[self.lock.master_lockpoint]*2,[-10,10])
 				else:
-					GUI_object.plot_win.all_lines[i+3].set_data([self.lock.slave_lockpoints[i-1]*self.lock.interval+self.lock.master_lockpoint]*2,[-10,10])
-			GUI_object.plot_win.ax.set_xlim(self.daq_tasks.ao_scan.scan_time*0.2, self.daq_tasks.ao_scan.scan_time*1.01)
-			GUI_object.plot_win.ax.set_ylim(np.amin(self.daq_tasks.PD_data)-0.05, np.amax(self.daq_tasks.PD_data)+0.2)
-	
-			if self.master_lock_engaged:
-
-				self.obtain_master_signal()
+					bus.post(pw.all_lines[i+3],pw.all_lines[i+3].set_data,[self.lock.slave_lockpoints[i-1]*self.lock.interval+self.lock.master_lockpoint]*2,[-10,10])
+			bus.post(('autoscale',0),pw.autoscale,0,self.daq_tasks.ao_scan.scan_time*0.2,self.daq_tasks.ao_scan.scan_time*1.01,np.amin(volts)-0.05,np.amax(volts)+0.2)
 
-				if len(self.master_signal.peaks_x)==2:
+			t=prof.record('scan.plot_traces',t)
 
-					GUI_object.twopeak_status_cv.itemconfig(GUI_object.twopeak_status,fill=Colors['on_color'])
+		if self.master_lock_engaged:
 
-					self.lock_master()
+			if self.two_peaks:
+				bus.itemconfig(GUI_object.twopeak_status_cv,GUI_object.twopeak_status,fill=Colors['on_color'])
+				bus.config(GUI_object.rms_cav,text="{:.3f}".format(self.master_err_rms))
+				bus.config(GUI_object.real_scoff,text='{:.2f}'.format(self.daq_tasks.ao_scan.offset))
+			else:
+				bus.itemconfig(GUI_object.twopeak_status_cv,GUI_object.twopeak_status,fill=Colors['off_color'])
+				
+			if self.master_locked_flag:
 
-					self._lck_adjust_fin.wait()
+				bus.itemconfig(GUI_object.cav_lock_status_cv,GUI_object.cav_lock_status,fill=Colors['on_color'])
 
-					GUI_object.rms_cav.config(text="{:.3f}".format(self.master_err_rms))
-					GUI_object.real_scoff.config(text='{:.2f}'.format(self.daq_tasks.ao_scan.offset))
-				else:
-					GUI_object.twopeak_status_cv.itemconfig(GUI_object.twopeak_status,fill=Colors['off_color'])
-					
-				if self.master_locked_flag:
-
-					GUI_object.cav_lock_status_cv.itemconfig(GUI_object.cav_lock_status,fill=Colors['on_color'])
-
-					if any(self.slave_locks_engaged):
-						for i in range(len(self.slave_locks_engaged)):
-							if self.slave_locks_engaged[i]:
-								self.obtain_slave_signal(i)
-								self.lock_laser(i)
-								self._slck_adjust_fin[i].wait()
-
-								GUI_object.rms_laser[i].config(text="{:.2f}".format(self.slave_err_rms[i]))
-								GUI_object.app_volt[i].config(text='{:.3f}'.format(self.daq_tasks.ao_laser.voltages[i]))
-								GUI_object.laser_r[i].config(text='{:.3f}'.format(GUI_object.lock.slave_Rs[i]))
-
-								if self.slave_locked_flags[i].is_set():
-									GUI_object.laser_lock_status_cv[i].itemconfig(GUI_object.laser_lock_status[i],fill=Colors['on_color'])
-								else:
-									GUI_object.laser_lock_status_cv[i].itemconfig(GUI_object.laser_lock_status[i],fill=Colors['off_color'])
-				else:
-					GUI_object.cav_lock_status_cv.itemconfig(GUI_object.cav_lock_status,fill=Colors['off_color'])
+				for i in range(len(self.slave_locks_engaged)):
+					if self.slave_locks_engaged[i]:
 
-			
-			if self.master_lock_engaged and len(self.master_signal.peaks_x)==2:
+						bus.config(GUI_object.rms_laser[i],text="{:.2f}".format(self.slave_err_rms[i]))
+						bus.config(GUI_object.app_volt[i],text='{:.3f}'.format(self.daq_tasks.ao_laser.voltages[i]))
+						bus.config(GUI_object.laser_r[i],text='{:.3f}'.format(GUI_object.lock.slave_Rs[i]))
 
-				X=np.linspace(0,len(self.master_err_history)-1,len(self.master_err_history))
-				GUI_object.plot_win.mline.set_data(X,self.master_err_history)
-				GUI_object.plot_win.ax_err.set_ylim(min(self.master_err_history)-self.master_rms_crit/3, self.master_rms_crit/3+max(self.master_err_history))
-				GUI_object.plot_win.ax_err.set_xlim(min(X), max(X))
+						if self.slave_locked_flags[i].is_set():
+							bus.itemconfig(GUI_object.laser_lock_status_cv[i],GUI_object.laser_lock_status[i],fill=Colors['on_color'])
+						else:
+							bus.itemconfig(GUI_object.laser_lock_status_cv[i],GUI_object.laser_lock_status[i],fill=Colors['off_color'])
+			else:
+				bus.itemconfig(GUI_object.cav_lock_status_cv,GUI_object.cav_lock_status,fill=Colors['off_color'])
 
-				if GUI_object.master_logging_set:
+			t=prof.record('scan.labels',t)
 
-					GUI_object.master_time_temp.put(time()-GUI_object.mt_start)
-					GUI_object.master_error_temp.put(GUI_object.lock.master_err)
+		
+		if self.master_lock_engaged and self.two_peaks:
 
-					self._master_counter+=1
+			if not skip:
+				hist=self.master_err_history
+				bus.post(pw.mline,pw.mline.set_data,hist.x_axis(),hist.view().copy())
+				bus.post(('autoscale',1),pw.autoscale,1,0,hist.capacity-1,hist.min(),hist.max(),ypad=self.master_rms_crit/3)
 
 				for j in range(len(self.slave_locks_engaged)):
 					if self.slave_locks_engaged[j]:
 
-						Xs=np.linspace(0,len(self.slave_err_history[j])-1,len(self.slave_err_history[j]))
-						GUI_object.plot_win.slines[j].set_data(Xs,self.slave_err_history[j])
-						try:
-							GUI_object.plot_win.ax_err_L[j].set_ylim(min(self.slave_err_history[j])-self.slave_rms_crits[j]/3, self.slave_rms_crits[j]/3+max(self.slave_err_history[j]))
-						except:
-							pass
-						try:
-							GUI_object.plot_win.ax_err_L[j].set_xlim(min(Xs), max(Xs))
-						except:
-							pass
+						hist=self.slave_err_history[j]
+						bus.post(pw.slines[j],pw.slines[j].set_data,hist.x_axis(),hist.view().copy())
+						bus.post(('autoscale',j+2),pw.autoscale,j+2,0,hist.capacity-1,hist.min(),hist.max(),ypad=self.slave_rms_crits[j]/3)
+
+				t=prof.record('scan.plot_errors',t)
+
+			if log:
+				self.push_log_rows(GUI_object)
+
+				t=prof.record('scan.log_queue',t)
+
+		if skip:
+			self.cadence.add_skip('Plots')
+		else:
+			bus.post('refresh',pw.refresh)
+
+			prof.record('scan.post_draw',t)
+
+
+	def scan(self,GUI_object=None):
 
+		self._scan_paused.clear()
+		self._counter=0
+		self._behind=False
 
-						if GUI_object.laser_logging_set[j]:
+		try:
+			#In the continuous mode the tasks run for the whole time of scanning.
+			if self.daq_tasks.continuous:
+				self.daq_tasks.start_continuous()
 
+			self._scan_loop(GUI_object)
 
-							GUI_object.slave_time_temp[j].put(time()-GUI_object.lt_start[j])
-							GUI_object.slave_err_temp[j].put(self.slave_err_history[j][-1])
-							GUI_object.slave_rfreq_temp[j].put(-GUI_object.lock.get_laser_abs_freq(j))
-							GUI_object.slave_lfreq_temp[j].put(-GUI_object.lock.get_laser_abs_lockpoint(j))
-							GUI_object.slave_rr_temp[j].put(GUI_object.lock.slave_Rs[j])
-							GUI_object.slave_lr_temp[j].put(GUI_object.lock.slave_lockpoints[j])
-							GUI_object.slave_pow_temp[j].put(1000*np.mean(self.daq_tasks.power_PDs.power[j]))
-							GUI_object.slave_wvmfreq_temp[j].put(GUI_object.real_frequency[j][0])
+		#If the acquisition fails, the scan is stopped (and the locks disengaged) by the GUI, instead of the thread
+		#ending silently with the locks engaged.
+		except Exception as e:
+			log.exception(e)
+			self._scan_flag=False
+			if GUI_object is not None:
+				GUI_object.gui_bus.post('scan_failed',GUI_object.scan_failed,str(e))
 
+		finally:
+			if self.daq_tasks.running_continuous:
+				self.daq_tasks.stop_continuous()
+			self._scan_paused.set()
 
-							self._slave_counters[j]+=1
 
+	def _scan_loop(self,GUI_object):
 
+		#Scheduled start of the next iteration (used only if the target period is set).
+		next_start=None
+		prev_start=None
+
+		while self._scan_flag:
+
+			#If the previous iteration missed its deadline, plotting is skipped in this one.
+			skip=self._behind
+
+			t_start=self.control_step()
+
+			recorder=self.trace_recorder
+			if recorder is not None:
+				recorder.record(self)
+
+			if self.target_period>0 and prev_start is not None:
+				self.cadence.add_period((t_start-prev_start)/1e9,self.target_period)
+			prev_start=t_start
+
+			self.update_gui(GUI_object,skip)
 
 			self._counter+=1
 
+			self.profiler.record('scan.total',t_start)
+
+			#Waiting for the scheduled start of the next iteration.
+			if self.target_period>0:
+				if next_start is None:
+					next_start=t_start/1e9
+				next_start=self._wait_until(next_start+self.target_period)
+			else:
+				self._behind=False
+
+
+	"""
+	Helper keeping the fixed cadence of the scan loop. If the deadline (scheduled start of the next iteration) has 
+	already passed, it is counted as a miss, the schedule is realigned to the current time and the loop is marked as
+	being behind (so the next iteration skips non-essential work). Otherwise the function sleeps until the deadline;
+	the last ~2ms are spent polling the clock, because sleep is not precise enough (especially on Windows).
+	"""
+	def _wait_until(self,deadline):
+		now=perf_counter()
+		if now>deadline:
+			self.cadence.add_miss()
+			self._behind=True
+			return now
+
+		self._behind=False
+		if deadline-now>0.002:
+			sleep(deadline-now-0.002)
+		while perf_counter()<deadline:
+			sleep(0)
+		return deadline
+
 
-			GUI_object.plot_win.fig.canvas.draw_idle()
+	"""
+	Logging of the error signals (and other parameters for slave lasers) to the log writers (see Log_writer.py).
+	Time of the scan can be given, if the data was acquired earlier (e.g. in a separate process). Otherwise, the 
+	timestamp of the last scan is used, so logged rows are aligned with the scans, not with the time of logging.
+	Logging can be stopped in the GUI (and the writers removed) at any time, so the writers are taken once; appending
+	to a writer that has already been closed does nothing.
+	"""
+	def push_log_rows(self,GUI_object,t=None):
+
+		if t is None:
+			t=self.daq_tasks.scan_wall_time()
+
+		writer=GUI_object.master_log
+		if GUI_object.master_logging_set and writer is not None:
+
+			writer.append(GUI_object.lock.master_err,t-GUI_object.mt_start)
+
+			self._master_counter+=1
+
+		for j in range(len(self.slave_locks_engaged)):
+			if self.slave_locks_engaged[j]:
+
+				writer=GUI_object.slave_logs[j]
+				if GUI_object.laser_logging_set[j] and writer is not None:
 
-		self._scan_paused.set()
+
+					writer.append(self.slave_err_history[j].last(),t-GUI_object.lt_start[j],-GUI_object.lock.get_laser_abs_freq(j),-GUI_object.lock.get_laser_abs_lockpoint(j),GUI_object.lock.slave_Rs[j],GUI_object.lock.slave_lockpoints[j],1000*self.daq_tasks.power_PDs.power[j].mean(),GUI_object.real_frequency[j].last())
+
+
+					self._slave_counters[j]+=1
 
 
 #################################################################################################################
@@ -528,14 +668,16 @@ class Signal:
 
 	"""
 	To initialize an object of this class one needs the X and Y data and an object of Filter class. During the 
-	initialization the data is smoothed using an SG filter. 
+	initialization the data is smoothed using an SG filter. "discard" is the number of samples at the start of the
+	data that are ignored (see discarded_samples); by default, the first 20% of the data.
 	"""
-	def __init__(self,datax,datay,fltr):
+	def __init__(self,datax,datay,fltr,discard=None):
 
 		self.data_x=datax
-		self.data_y=datay-np.mean(datay[int(len(datay)/5):])
+		self.discard=int(len(datay)/5) if discard is None else discard
+		self.data_y=datay-np.mean(datay[self.discard:])
 		self.dx=datax[1]-datax[0]
-		self.mx=np.max(self.data_y)
+		self.mx=self.data_y.max()
 		# self.smooth_y=fltr.apply(datay,0,datax[1]-datax[0])
 		self.smooth_y=fltr.peak_filter(self.data_y)
 		self.fltr=fltr
@@ -558,6 +700,9 @@ class Signal:
 	To find the position of the peak, we fit a linear function to 14 points around the zero crossing and get the zero 
 	crossing from the fit. 14 points used for a fit works very well for 1000 points per scan and peaks that are not extremely
 	narrow. This can be changed if necessary. Once the peak is found, the loop is skipped by "win_size".
+
+	Zero crossings and heights of the peaks around them are found for the whole scan at once; only the (few) crossings
+	that pass the criterion are then checked one by one, which gives the same peaks as checking every sample in a loop.
 	"""
 	def find_peaks(self,criterion=0.2,win_size=3,hs=10):
 
@@ -568,23 +713,24 @@ class Signal:
 		self.smooth_der=D
 
 		points=[]
-		skip=0
 
 		#We discard/ignore first 20% of the data. Real scan introduces terrible noise there.
-		for i in range(int(0.2*len(D)),len(D)-win_size):
-
-			if skip>0:
-				skip-=1
-				continue
-
-			if D[i-1]<0 and D[i]>0:
-
-				if np.amax(self.data_y[i-win_size:i+win_size])>criterion*self.mx:
-
-					a,b=np.polyfit(self.data_x[i-win_size:i+win_size],D[i-win_size:i+win_size],1)
-					points.append(-b/a)
-					skip=10*win_size
-
+		start=max(self.discard,1)
+		stop=len(D)-win_size
+		crossings=np.flatnonzero((D[start-1:stop-1]<0)&(D[start:stop]>0))+start
+
+		if len(crossings)>0:
+			#The peak is high enough if any point in the window is above the criterion (the number of such points in
+			#the window is a difference of the cumulative sum).
+			above=np.zeros(len(self.data_y)+1,dtype=np.int64)
+			np.cumsum(self.data_y>criterion*self.mx,out=above[1:])
+			high=above[crossings+win_size]>above[crossings-win_size]
+			last=-1
+			for i in crossings[high].tolist():
+				if last>=0 and i<=last+10*win_size:
+					continue
+				points.append(zero_crossing(self.data_x[i-win_size:i+win_size],D[i-win_size:i+win_size]))
+				last=i
 
 		self.peaks_x=np.array(points)
 
@@ -600,6 +746,22 @@ class Signal:
 		self.peaks_y=f(self.peaks_x)
 
 
+"""
+Number of samples discarded at the start of a trace by the peak finding. The noise is at the start of the full ramp
+(of "n_full" samples), so for a zoomed scan starting at sample "start" only the part of the first 20% of the ramp
+that is still in the scan is discarded; otherwise the window of a zoomed scan would lose peaks close to its start.
+"""
+def discarded_samples(n_full,start):
+	return max(int(0.2*n_full)-start,0)
+
+
+#Positions of peaks found beforehand (see find_peaks_block). The locks use it in place of a Signal.
+class Peaks:
+
+	def __init__(self,peaks_x):
+		self.peaks_x=peaks_x
+
+
 #################################################################################################################
 
 
@@ -614,12 +776,13 @@ class Filter:
 	def __init__(self):
 
 		self.coeffs=[[-2/21,3/21,6/21,7/21,6/21,3/21,-2/21],[-3/10,-1/5,-1/10,0,1/10,1/5,3/10],[5/42,0,-3/42,-4/42,-3/42,0,5/42],[-1/6,1/6,1/6,0,-1/6,-1/6,1/6]]
+		self._windows=[np.array(c) for c in self.coeffs]
 
 	def apply(self,signal,der,sp): #Make it more efficient with np.convolve!
 
-		C=self.coeffs[der][:]
+		C=self._windows[der]
 		if der>1:
-			C=[c/sp**der for c in C]
+			C=C/sp**der
 
 		return np.convolve(signal,C,"same")
 
@@ -629,4 +792,78 @@ class Filter:
 
 
 	def peak_filter(self,data,k=10):
-		return np.concatenate((np.concatenate((data[:k],[data[i]**2-data[i-k]*data[i+k] for i in range(k,len(data)-k)])),data[-k:]))
\ No newline at end of file
+		out=np.array(data,dtype=np.float64)
+		out[k:-k]=data[k:-k]**2-data[:-2*k]*data[2*k:]
+		return out
+
+
+#Zero crossing of a straight line fitted (least squares) to the points; the same as the root of np.polyfit(x,y,1).
+def zero_crossing(x,y):
+	n=len(x)
+	xm=x.sum()/n
+	ym=y.sum()/n
+	dx=x-xm
+	a=dx.dot(y)/dx.dot(dx)
+	return xm-ym/a
+
+
+"""
+Peak finding for many scans (rows of "data", all sampled at "datax") at once, with the same steps as in Signal and
+Signal.find_peaks. Calls of numpy functions on short traces take most of the time of the peak finding, so for
+recorded scans (see Replay.py) they are made once per block of scans. Positions of the peaks are the same as found
+for every scan separately (up to rounding errors). Returns a list with a list of peaks for every scan.
+"""
+def find_peaks_block(datax,data,fltr,criterion=0.2,win_size=3,k=10,discard=None):
+
+	rows,n=data.shape
+	if discard is None:
+		discard=int(n/5)
+
+	data_y=data-np.mean(data[:,discard:],axis=1,keepdims=True)
+	mx=data_y.max(axis=1)
+
+	smooth_y=data_y.copy()
+	smooth_y[:,k:-k]=data_y[:,k:-k]**2-data_y[:,:-2*k]*data_y[:,2*k:]
+
+	#Rows separated by zeros are convolved at once, which gives the same as np.convolve with "same" for every row.
+	C=fltr._windows[1]
+	h=len(C)//2
+	padded=np.zeros((rows,n+2*h))
+	padded[:,h:h+n]=smooth_y
+	D=np.convolve(padded.ravel(),C,"same").reshape(rows,n+2*h)[:,h:h+n]
+
+	start=max(discard,1)
+	stop=n-win_size
+	r,c=np.nonzero((D[:,start-1:stop-1]<0)&(D[:,start:stop]>0))
+	c+=start
+
+	#Windows around the crossings don't go beyond their rows, so points above the criterion are searched in all rows.
+	above=np.flatnonzero(data_y>criterion*mx[:,None])
+	flat=r*n+c
+	high=np.searchsorted(above,flat-win_size)<np.searchsorted(above,flat+win_size)
+
+	#Skipping crossings too close to the previous peak (the order of the crossings is the same as in the scan).
+	keep=[]
+	last_row=-1
+	last=-1
+	for j,(ri,ci) in enumerate(zip(r[high].tolist(),c[high].tolist())):
+		if ri==last_row and ci<=last+10*win_size:
+			continue
+		keep.append(j)
+		last_row=ri
+		last=ci
+	r=r[high][keep]
+	c=c[high][keep]
+
+	#Zero crossings of lines fitted to the derivative around the crossings (see zero_crossing).
+	idx=c[:,None]+np.arange(-win_size,win_size)
+	x=datax[idx]
+	y=D[r[:,None],idx]
+	xm=x.mean(axis=1)
+	ym=y.mean(axis=1)
+	dx=x-xm[:,None]
+	a=(dx*y).sum(axis=1)/(dx*dx).sum(axis=1)
+	points=(xm-ym/a).tolist()
+
+	bounds=np.searchsorted(r,np.arange(rows+1)).tolist()
+	return [points[bounds[j]:bounds[j+1]] for j in range(rows)]
\ No newline at end of file
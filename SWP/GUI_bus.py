@@ -0,0 +1,99 @@
+import threading
+from time import perf_counter_ns
+from tkinter import TclError
+
+
+"""
+This file contains the class used to pass updates of the GUI from worker threads (scan loop, sweeps, wavemeter
+updates) to the Tk thread. Tk is not thread-safe, so widgets should only be changed from the thread running the
+main loop. Besides, worker threads used to change labels at every iteration, much more often than the screen is
+refreshed.
+"""
+
+
+"""
+Coalescing update bus. Every update is posted under a key (e.g. a widget and one of its options) and only the latest
+update for each key is kept. Once per frame (every "period" ms) a callback scheduled with Tk's "after" swaps the map
+of pending updates for an empty one and applies them in the Tk thread, in the order in which the keys were first
+posted during the frame. Posting is cheap and never touches Tk, so it can be done from any thread.
+"""
+class GUIUpdateBus:
+
+	def __init__(self,widget,period=40,profiler=None):
+
+		#Any widget can be used to schedule callbacks.
+		self.widget=widget
+		self.period=period
+		self.profiler=profiler
+
+		self._pending={}
+		self._lock=threading.Lock()
+		self._running=False
+
+		#Number of updates posted and actually applied. Their ratio shows how many updates were coalesced.
+		self.posted=0
+		self.applied=0
+
+
+	def start(self):
+		if not self._running:
+			self._running=True
+			self.widget.after(self.period,self._apply)
+
+
+	def stop(self):
+		self._running=False
+
+
+	#Generic update: "func" is called in the Tk thread with given arguments.
+	def post(self,key,func,*args,**kwargs):
+		with self._lock:
+			self._pending[key]=(func,args,kwargs)
+			self.posted+=1
+
+
+	#Changing options of a widget (like "config" method). Each option is coalesced separately.
+	def config(self,widget,**options):
+		for name,value in options.items():
+			self.post((widget,name),widget.config,**{name:value})
+
+
+	#Changing options of an item on a canvas (like "itemconfig" method).
+	def itemconfig(self,canvas,item,**options):
+		for name,value in options.items():
+			self.post((canvas,item,name),canvas.itemconfig,item,**{name:value})
+
+
+	#Setting Tk variable. Variables are not hashable, so their Tcl names are used as keys.
+	def set_var(self,var,value):
+		self.post(('var',str(var)),var.set,value)
+
+
+	#Applying all pending updates. Has to be called from the Tk thread.
+	def flush(self):
+
+		t=perf_counter_ns()
+
+		with self._lock:
+			pending=self._pending
+			self._pending={}
+
+		for func,args,kwargs in pending.values():
+			try:
+				func(*args,**kwargs)
+			except TclError:
+				#Widget was destroyed (e.g. a settings window was closed) before the update was applied.
+				pass
+
+		self.applied+=len(pending)
+
+		if self.profiler is not None and pending:
+			self.profiler.record('gui.apply',t)
+
+
+	def _apply(self):
+		try:
+			self.flush()
+		finally:
+			if self._running:
+				self.widget.after(self.period,self._apply)
@@ -10,6 +10,8 @@ import math
 import threading 
 import logging
 
+from .Config import get_option
+
 
 
 """
@@ -76,6 +78,15 @@ class Lock:
 		#Interval between master peaks (t2-t1) 
 		self.interval=0 #ms
 
+		"""
+		Time step of the PI loops. By default the integral term uses the interval between master peaks as a time 
+		base. If "exact_dt" is set, the real time between consecutive scans ("dt", in seconds, set by TransferLock 
+		from timestamps of the scans) is used instead. It is scaled so that both are equal for the default scan,
+		where master peaks are half of the scan apart and there's no delay between scans.
+		"""
+		self.exact_dt=int(get_option(cfg,'CAVITY','ExactDt','0'))>0
+		self.dt=0
+
 		#Frequency of slave lasers that are used to calculate adjusted FSRs. Doesn't have to be too precise.
 		self.slave_freqs=[0]*len(wvls)
 
@@ -293,13 +304,19 @@ class Lock:
 	The various numerical coeffiicients are there to make the feedback loop work correctly for gains of the order of 1 (so they basically
 	rescale the parameters). This can be changed, but once set, it should not be touched.
 	"""
+	def _time_step(self):
+		if self.exact_dt and self.dt>0:
+			return self.dt/20
+		return self.interval/10000
+
+
 	def refresh_master_control(self):
-		self.master_ctrl=(self.master_ctrl+0.05*self.prop_gain[0]*(self.master_err-self.master_err_prev)+self.int_gain[0]*self.master_err*self.interval/10000)
+		self.master_ctrl=(self.master_ctrl+0.05*self.prop_gain[0]*(self.master_err-self.master_err_prev)+self.int_gain[0]*self.master_err*self._time_step())
 
 	
 
 	def refresh_slave_control(self,i):
-		self.slave_ctrls[i]=self.slave_ctrls[i]+0.05*self.prop_gain[i+1]*(self.slave_errs[i]-self.slave_errs_prev[i])+self.int_gain[i+1]*self.slave_errs[i]*self.interval/10000
+		self.slave_ctrls[i]=self.slave_ctrls[i]+0.05*self.prop_gain[i+1]*(self.slave_errs[i]-self.slave_errs_prev[i])+self.int_gain[i+1]*self.slave_errs[i]*self._time_step()
 		
 
 
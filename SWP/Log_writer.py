@@ -0,0 +1,678 @@
+import numpy as np
+import h5py
+import threading
+import logging
+import os
+import re
+import datetime
+from time import time
+
+from .Config import get_option
+from .Buffers import RowRingBuffer, TraceRingBuffer
+
+
+"""
+This file contains the writer of the error signal logs. Previously, the logging threads reopened the HDF5 file every
+10 s, resized every dataset separately and converted the queues with logged values to lists several times. Now, the
+file is opened once, when logging starts, and kept open until it's stopped:
+	- rows are passed from the scan thread to the writing thread through a bounded, lock-free buffer (see 
+	RowRingBuffer in Buffers.py), so the scan thread never waits for the file; if the buffer is full, rows are
+	dropped and counted
+	- rows are kept column-wise (one row of the buffer per dataset), so every dataset is written from contiguous 
+	slices, with one or two writes per flush
+	- datasets are chunked and grown in whole chunks, ahead of the data, so they aren't resized at every write; they
+	are trimmed to the number of rows when the file is closed
+	- optionally, datasets are compressed with LZF or gzip (both with the shuffle filter)
+	- optionally ("compact" schema), all values are kept in one dataset of records, with the time as int64
+	nanoseconds since the Unix epoch, so a flush is one resize and one write (see compact_dtype and convert_log)
+The number of valid rows is kept in the "Rows" attribute of the file, so a file that wasn't closed properly can
+still be read. Optionally, the file is written in the SWMR (single writer, multiple readers) mode of HDF5, so other
+programs can read it safely while the log is written (see LogTail). Raw traces from the photodetectors can be
+recorded the same way as logs (see TraceRecorder).
+"""
+
+log=logging.getLogger(__name__)
+
+
+#Datasets of the log files (names and types are the same as in the files written by older versions).
+MASTER_LOG_FIELDS=[('Errors','float32'),('Time','float32')]
+SLAVE_LOG_FIELDS=[('Errors','float32'),('Time','float32'),('RealFrequency','float32'),('LockFrequency','float32'),('RealR','float32'),('LockR','float32'),('Power','float32'),('WvmFrequency','float64')]
+
+#Layouts of the log files: a dataset per field ("columns", as written by older versions) or one dataset of records.
+LOG_SCHEMAS=['columns','compact']
+COMPACT_DATASET='Log'
+
+
+#Type of the records of the compact schema. "Time" is stored as int64 nanoseconds since the Unix epoch.
+def compact_dtype(fields):
+	return np.dtype([(name,'int64' if name=='Time' else dtype) for name,dtype in fields])
+
+
+#Options of the writer read from the [LOGGING] section of the config (missing in configs saved by older versions).
+def log_options(cfg):
+	return {"compression":get_option(cfg,'LOGGING','Compression','none'),"chunk_rows":int(get_option(cfg,'LOGGING','ChunkRows','4096')),"flush_interval":float(get_option(cfg,'LOGGING','FlushInterval','1')),"buffer_rows":int(get_option(cfg,'LOGGING','BufferRows','65536')),"swmr":int(get_option(cfg,'LOGGING','SWMR','1'))>0,"schema":get_option(cfg,'LOGGING','Schema','columns').strip().lower()}
+
+
+#Translating the name of the compression ("none", "lzf", "gzip" or "gzip:level") to arguments of "create_dataset".
+def compression_args(compression):
+	name=str(compression).strip().lower()
+	if name in ('','none','0'):
+		return {}
+	if name=='lzf':
+		return {"compression":"lzf","shuffle":True}
+	if name.startswith('gzip'):
+		level=int(name.split(':')[1]) if ':' in name else 4
+		return {"compression":"gzip","compression_opts":level,"shuffle":True}
+	raise ValueError('Unknown compression: '+str(compression))
+
+
+"""
+Writer of one log file. "fields" is a list of (dataset name, type). Rows are added with "append" (values in the
+order of the fields) from the scan thread, and written to the file by a separate thread every "flush_interval"
+seconds. "chunk_rows" is the chunk size of the datasets and "buffer_rows" the number of rows that can wait in the
+buffer (it should be enough for a few flush intervals).
+
+"Time" is appended as seconds since "start_time" (the time "start" was called). With the "compact" schema, rows are
+written as records of one "Log" dataset (see compact_dtype), with the time converted to int64 nanoseconds since the
+Unix epoch; the "columns" schema keeps the float32 time of older versions. A file that already contains a log is
+appended to in its own schema.
+
+If "swmr" is True, the file is switched to the SWMR mode once the datasets are created. Attributes can't be changed
+in this mode, so instead of the "Rows" attribute the datasets are kept exactly as long as the number of written rows
+(they are resized at every flush) and the "Dropped" attribute isn't updated. Files created by older versions (with
+the earliest HDF5 file format) can't be written in the SWMR mode; they are appended to in the normal mode.
+"""
+class HDF5LogWriter:
+
+	def __init__(self,filename,fields,attrs=None,chunk_rows=4096,compression='none',flush_interval=1.0,buffer_rows=65536,swmr=False,schema='columns'):
+
+		if schema not in LOG_SCHEMAS:
+			raise ValueError('Unknown log schema: '+str(schema))
+
+		self.filename=filename
+		self.fields=fields
+		self.schema=schema
+		self.attrs=attrs if attrs is not None else {}
+		self.chunk_rows=max(int(chunk_rows),1)
+		self.compression=compression
+		self.flush_interval=flush_interval
+		self.swmr=swmr
+
+		#Number of rows written to the file and the current length of the (preallocated) datasets.
+		self.rows=0
+		self.capacity=0
+		self.flushes=0
+
+		self._file=None
+		self._dsets=[]
+		self.start_time=None
+
+		#Records of the compact schema are assembled in this array (grown when needed).
+		self._records=None
+
+		self.buffer=RowRingBuffer(len(fields),buffer_rows)
+
+		self._stop=threading.Event()
+		self._thread=None
+		self._closed=False
+
+
+	#Opening the file and starting the writing thread. Datasets that already exist in the file are appended to.
+	def start(self):
+
+		kwargs=compression_args(self.compression)
+
+		if self.swmr:
+			self._file=h5py.File(self.filename,'a',libver='latest')
+		else:
+			self._file=h5py.File(self.filename,'a')
+		for key,val in self.attrs.items():
+			self._file.attrs[key]=val
+
+		if COMPACT_DATASET in self._file:
+			self.schema='compact'
+		elif self.fields[0][0] in self._file:
+			self.schema='columns'
+
+		self._dsets=[]
+		if self.schema=='compact':
+			if COMPACT_DATASET in self._file:
+				self._dsets.append(self._file[COMPACT_DATASET])
+			else:
+				self._dsets.append(self._file.create_dataset(COMPACT_DATASET,(0,),maxshape=(None,),dtype=compact_dtype(self.fields),chunks=(self.chunk_rows,),**kwargs))
+		else:
+			for name,dtype in self.fields:
+				if name in self._file:
+					self._dsets.append(self._file[name])
+				else:
+					self._dsets.append(self._file.create_dataset(name,(0,),maxshape=(None,),dtype=dtype,chunks=(self.chunk_rows,),**kwargs))
+
+		self.capacity=self._dsets[0].shape[0]
+		self.rows=int(self._file.attrs.get('Rows',self.capacity))
+
+		if self.swmr:
+			self._start_swmr()
+
+		self.start_time=time()
+		self._start_ns=int(round(self.start_time*1e9))
+
+		self._thread=threading.Thread(target=self._run,daemon=True)
+		self._thread.start()
+
+
+	#Trimming the datasets to the written rows (their length is the number of rows from now on) and switching modes.
+	def _start_swmr(self):
+
+		for dset in self._dsets:
+			dset.resize(self.rows,axis=0)
+		self.capacity=self.rows
+		if 'Rows' in self._file.attrs:
+			del self._file.attrs['Rows']
+
+		try:
+			self._file.swmr_mode=True
+		except Exception as e:
+			log.warning('Log file {} can\'t be written in the SWMR mode: {}'.format(self.filename,e))
+			self.swmr=False
+
+
+	#Adding a row (from the scan thread). It never waits; rows added after the file was closed are counted as dropped.
+	def append(self,*values):
+		if self._closed:
+			self.buffer.dropped+=1
+			return False
+		return self.buffer.push(values)
+
+
+	#Rows lost because the buffer was full or the file was closed.
+	@property
+	def dropped(self):
+		return self.buffer.dropped
+
+
+	#Datasets are extended by at least half of their length (in whole chunks), so they are resized rarely (in the SWMR
+	#mode, only by the new rows).
+	def _reserve(self,n):
+		if self.rows+n<=self.capacity:
+			return
+		if self.swmr:
+			self.capacity=self.rows+n
+		else:
+			needed=max(self.rows+n,self.capacity+self.capacity//2)
+			self.capacity=-(-needed//self.chunk_rows)*self.chunk_rows
+		for dset in self._dsets:
+			dset.resize(self.capacity,axis=0)
+
+
+	#Writing all rows waiting in the buffer. They are released only after they are written.
+	def flush(self):
+
+		parts,n=self.buffer.peek()
+		if n==0:
+			return
+
+		self._reserve(n)
+		row=self.rows
+		if self.schema=='compact':
+			self._dsets[0][row:row+n]=self._assemble(parts,n)
+			row+=n
+		else:
+			for part in parts:
+				k=part.shape[1]
+				for i,dset in enumerate(self._dsets):
+					dset[row:row+k]=part[i]
+				row+=k
+
+		self.buffer.release(n)
+		self.rows=row
+
+		#In the SWMR mode, readers see new rows once the datasets are flushed.
+		if self.swmr:
+			for dset in self._dsets:
+				dset.flush()
+		else:
+			self._file.attrs['Rows']=self.rows
+			self._file.attrs['Dropped']=self.buffer.dropped
+			self._file.flush()
+		self.flushes+=1
+
+
+	#Records of the compact schema for the rows waiting in the buffer (a view of the preallocated array).
+	def _assemble(self,parts,n):
+
+		if self._records is None or len(self._records)<n:
+			self._records=np.zeros(max(n,self.chunk_rows),dtype=self._dsets[0].dtype)
+		records=self._records[:n]
+
+		k0=0
+		for part in parts:
+			k=part.shape[1]
+			for i,(name,dtype) in enumerate(self.fields):
+				if name=='Time':
+					records[name][k0:k0+k]=np.rint(part[i]*1e9).astype(np.int64)+self._start_ns
+				else:
+					records[name][k0:k0+k]=part[i]
+			k0+=k
+		return records
+
+
+	def _run(self):
+		while not self._stop.wait(self.flush_interval):
+			try:
+				self.flush()
+			except Exception as e:
+				log.exception(e)
+
+
+	#Stopping the thread, writing the remaining rows and trimming the datasets to the number of rows.
+	def close(self):
+
+		if self._file is None:
+			return
+
+		self._closed=True
+		self._stop.set()
+		self._thread.join()
+
+		try:
+			self.flush()
+			for dset in self._dsets:
+				dset.resize(self.rows,axis=0)
+			self.capacity=self.rows
+		finally:
+			self._file.close()
+			self._file=None
+
+
+"""
+Reading a log file while it's written, e.g. by a script that monitors the locks. The file is opened in the SWMR read
+mode (if it was written in the normal mode, it's opened as usual). "read" returns rows added since the previous call,
+as a dictionary of arrays (field name: values); "follow" does it in a loop. Datasets are flushed one by one, so
+only rows that are already in all datasets are returned. "fields" are the names of fields (by default all of them).
+Both schemas are read the same way; with the compact schema "compact" is True and "Time" is in ns since the epoch.
+"""
+class LogTail:
+
+	def __init__(self,filename,fields=None):
+
+		self.filename=filename
+		try:
+			self._file=h5py.File(filename,'r',libver='latest',swmr=True)
+			self.swmr=True
+		except Exception:
+			self._file=h5py.File(filename,'r')
+			self.swmr=False
+
+		self.compact=COMPACT_DATASET in self._file
+		if self.compact:
+			self._dsets=[self._file[COMPACT_DATASET]]
+			self.names=list(fields) if fields is not None else list(self._dsets[0].dtype.names)
+		else:
+			self.names=list(fields) if fields is not None else [name for name in self._file if isinstance(self._file[name],h5py.Dataset)]
+			self._dsets=[self._file[name] for name in self.names]
+
+		#Number of rows already read.
+		self.rows=0
+
+
+	#Number of complete rows in the file.
+	def available(self):
+		if self.swmr:
+			for dset in self._dsets:
+				dset.refresh()
+		n=min(dset.shape[0] for dset in self._dsets)
+		if 'Rows' in self._file.attrs:
+			n=min(n,int(self._file.attrs['Rows']))
+		return n
+
+
+	#New rows (at most "max_rows", if it's given).
+	def read(self,max_rows=None):
+		n=self.available()
+		if max_rows is not None:
+			n=min(n,self.rows+max_rows)
+		if self.compact:
+			records=self._dsets[0][self.rows:n]
+			rows={name:records[name] for name in self.names}
+		else:
+			rows={name:dset[self.rows:n] for name,dset in zip(self.names,self._dsets)}
+		self.rows=max(self.rows,n)
+		return rows
+
+
+	#Yielding new rows every "interval" seconds (only if there are any), until "stop" (threading.Event) is set.
+	def follow(self,interval=1.0,stop=None):
+		stop=stop if stop is not None else threading.Event()
+		while not stop.is_set():
+			rows=self.read()
+			if len(rows[self.names[0]])>0:
+				yield rows
+			stop.wait(interval)
+
+
+	def close(self):
+		self._file.close()
+
+
+"""
+Converting a log written in the "columns" schema (a dataset per field, e.g. by older versions) to the compact one.
+The fields are recognized from the datasets (slave or master laser log). Old files store the time as float32
+seconds since the start of the log, so its precision isn't recovered; the start is taken from "start_time" (Unix
+time in seconds), or from the name of the file ("logM-..." or "logS-...", given when the log was created), or it's
+0 if neither is known. If a log was stopped and engaged again into the same file, the time of the later parts
+started from 0 again and they can't be placed correctly. Rows are copied in blocks of "block_rows". Attributes are
+copied, and the name of the old file is saved in "ConvertedFrom". Returns the number of converted rows.
+"""
+def convert_log(src,dst,start_time=None,compression='none',chunk_rows=4096,block_rows=1<<20):
+
+	with h5py.File(src,'r') as f:
+
+		if COMPACT_DATASET in f:
+			raise ValueError('{} is already a compact log'.format(src))
+		fields=None
+		for candidate in [SLAVE_LOG_FIELDS,MASTER_LOG_FIELDS]:
+			if all(name in f for name,dtype in candidate):
+				fields=candidate
+				break
+		if fields is None:
+			raise ValueError('No log datasets in {}'.format(src))
+
+		if start_time is None:
+			start_time=log_start_time(src)
+		start_ns=int(round(start_time*1e9)) if start_time is not None else 0
+
+		#Files not closed properly have preallocated rows after the written ones.
+		rows=min(f[name].shape[0] for name,dtype in fields)
+		if 'Rows' in f.attrs:
+			rows=min(rows,int(f.attrs['Rows']))
+
+		dtype=compact_dtype(fields)
+		with h5py.File(dst,'w',libver='latest') as g:
+			for key,val in f.attrs.items():
+				if key!='Rows':
+					g.attrs[key]=val
+			g.attrs['ConvertedFrom']=os.path.basename(src)
+			dset=g.create_dataset(COMPACT_DATASET,(rows,),maxshape=(None,),dtype=dtype,chunks=(max(min(int(chunk_rows),rows),1),),**compression_args(compression))
+
+			records=np.zeros(min(block_rows,max(rows,1)),dtype=dtype)
+			for lo in range(0,rows,block_rows):
+				hi=min(lo+block_rows,rows)
+				block=records[:hi-lo]
+				for name,ftype in fields:
+					if name=='Time':
+						block[name]=np.rint(f[name][lo:hi].astype(np.float64)*1e9).astype(np.int64)+start_ns
+					else:
+						block[name]=f[name][lo:hi]
+				dset[lo:hi]=block
+
+	return rows
+
+
+#Start of a log from the name of its file (as given by the GUI), or None.
+def log_start_time(filename):
+	match=re.search(r'-(\d{4}-\d{2}-\d{2}-\d{2}\.\d{2}\.\d{2})',os.path.basename(filename))
+	if match is None:
+		return None
+	return datetime.datetime.strptime(match.group(1),'%Y-%m-%d-%H.%M.%S').timestamp()
+
+
+#################################################################################################################
+
+
+#Values saved with every recorded scan (columns of the "State" dataset).
+TRACE_STATE_FIELDS=['time','scan_index','master_engaged','master_locked','two_peaks','master_err','master_lockpoint','master_ctrl','offset','zoom_start','zoom_stop']
+for _i in range(2):
+	TRACE_STATE_FIELDS+=[name+str(_i) for name in ['slave_engaged','slave_locked','slave_err','slave_lockpoint','slave_ctrl','voltage']]
+
+TS={name:ind for ind,name in enumerate(TRACE_STATE_FIELDS)}
+
+
+#Options of the trace recording ([LOGGING] section of the config).
+def trace_options(cfg):
+	return {"every":int(get_option(cfg,'LOGGING','TraceEvery','0')),"pre_trigger":int(get_option(cfg,'LOGGING','TracePreTrigger','0')),"post_trigger":int(get_option(cfg,'LOGGING','TracePostTrigger','0')),"buffer_scans":int(get_option(cfg,'LOGGING','TraceBufferScans','256')),"compression":get_option(cfg,'LOGGING','TraceCompression','lzf')}
+
+
+"""
+Recording of raw traces from the photodetectors of the cavity. Every recorded scan is a (channels x samples) row of
+the "Traces" dataset, with a matching row of the "State" dataset (scan time and index, state of the locks; see
+TRACE_STATE_FIELDS, which are also saved in its "Fields" attribute). Scans are recorded:
+	- every "every" scans (0 - off)
+	- around a loss of the lock (of the master laser, or of a slave laser with the lock engaged): "pre_trigger"
+	scans before it and "post_trigger" scans after it (the scan in which the lock was lost included)
+Scans before a trigger are kept in a small ring on the side of the scan thread and passed to the writer only when
+the lock is lost, so rows of the file are ordered by the time they were recorded; the "scan_index" column gives the
+order of the scans. "record" is called by the scan thread and only copies the traces into a preallocated slot; the
+file is written by a separate thread. If the PD task reads raw counts, traces are saved in counts of the ADC (the
+"Scale" attribute has the coefficients converting them to volts): as int16, or as float32 if they were decimated
+(oversampling), because then they're averages of counts. Otherwise they're saved as float32 volts. Additional file
+attributes (e.g. wavelengths of the slave lasers, needed to replay the traces, and gains of the locks when the
+recording started) can be given in "attrs".
+"""
+class TraceRecorder:
+
+	def __init__(self,filename,tasks,every=0,pre_trigger=0,post_trigger=0,buffer_scans=256,compression='lzf',flush_interval=1.0,attrs=None):
+
+		self.filename=filename
+		self.every=max(int(every),0)
+		self.pre_trigger=max(int(pre_trigger),0)
+		self.post_trigger=max(int(post_trigger),0)
+		self.compression=compression
+		self.flush_interval=flush_interval
+
+		pds=tasks.ai_PDs
+		self.n_channels=pds._channel_no
+		self.n_samples=tasks.ao_scan.n_samples
+		self.counts=pds.raw_counts
+		self.dtype=np.int16 if self.counts and pds.oversampling==1 else np.float32
+
+		self.attrs={'ScanTime':tasks.ao_scan.scan_time,'Samples':self.n_samples,'SamplingRate':tasks.ao_scan.sample_rate,'ScanAmplitude':tasks.ao_scan.amplitude,'Every':self.every,'PreTrigger':self.pre_trigger,'PostTrigger':self.post_trigger,'Units':'counts' if self.counts else 'V','Fields':TRACE_STATE_FIELDS}
+		if self.counts:
+			self.attrs['Scale']=pds.scale[:self.n_channels]
+		if attrs is not None:
+			self.attrs.update(attrs)
+
+		#Chunks of ~1 MB (whole scans).
+		scan_bytes=self.n_channels*self.n_samples*np.dtype(self.dtype).itemsize
+		self.chunk_scans=max(1,min(256,(1<<20)//scan_bytes))
+
+		self.buffer=TraceRingBuffer(buffer_scans,self.n_channels,self.n_samples,len(TRACE_STATE_FIELDS),dtype=self.dtype)
+		self._pre=TraceRingBuffer(self.pre_trigger,self.n_channels,self.n_samples,len(TRACE_STATE_FIELDS),dtype=self.dtype) if self.pre_trigger>0 else None
+		self._state=np.zeros(len(TRACE_STATE_FIELDS))
+
+		#State of the scan thread side: scans seen, scans left after a trigger and lock states in the previous scan.
+		self.scans=0
+		self.triggers=0
+		self._post=0
+		self._prev_locked=[False,False,False]
+
+		self.rows=0
+		self.capacity=0
+		self._file=None
+		self._stop=threading.Event()
+		self._thread=None
+		self._closed=False
+
+
+	#Scans are appended to an existing file only if it was recorded with the same layout (ValueError otherwise).
+	def start(self):
+
+		kwargs=compression_args(self.compression)
+		shape=(self.n_channels,self.n_samples)
+
+		self._file=h5py.File(self.filename,'a')
+		problem=self._incompatible(shape)
+		if problem is not None:
+			self._file.close()
+			self._file=None
+			raise ValueError('Traces can\'t be appended to {}: {}'.format(self.filename,problem))
+
+		for key,val in self.attrs.items():
+			self._file.attrs[key]=val
+
+		if 'Traces' in self._file:
+			self._traces=self._file['Traces']
+			self._states=self._file['State']
+		else:
+			self._traces=self._file.create_dataset('Traces',(0,)+shape,maxshape=(None,)+shape,dtype=self.dtype,chunks=(self.chunk_scans,)+shape,**kwargs)
+			self._states=self._file.create_dataset('State',(0,len(TRACE_STATE_FIELDS)),maxshape=(None,len(TRACE_STATE_FIELDS)),dtype='float64',chunks=(self.chunk_scans,len(TRACE_STATE_FIELDS)),**kwargs)
+
+		self.capacity=self._traces.shape[0]
+		self.rows=int(self._file.attrs.get('Rows',self.capacity))
+
+		self._thread=threading.Thread(target=self._run,daemon=True)
+		self._thread.start()
+
+
+	#Reason why scans can't be appended to the open file (None if they can, or if it's empty).
+	def _incompatible(self,shape):
+		f=self._file
+		if 'Traces' not in f and 'State' not in f:
+			return None
+		if 'Traces' not in f or 'State' not in f:
+			return 'only one of the Traces and State datasets exists'
+		if f['Traces'].shape[1:]!=shape:
+			return 'scans of shape {} instead of {}'.format(f['Traces'].shape[1:],shape)
+		if f['Traces'].dtype!=self.dtype:
+			return 'traces of type {} instead of {}'.format(f['Traces'].dtype,np.dtype(self.dtype))
+		if f['State'].shape[1:]!=(len(TRACE_STATE_FIELDS),) or [n.decode() if isinstance(n,bytes) else str(n) for n in f.attrs.get('Fields',[])]!=TRACE_STATE_FIELDS:
+			return 'different state fields'
+		for key in ['Units','ScanTime','SamplingRate','ScanAmplitude']:
+			if key in f.attrs and f.attrs[key]!=self.attrs[key]:
+				return 'different {} ({} instead of {})'.format(key,f.attrs[key],self.attrs[key])
+		return None
+
+
+	@property
+	def dropped(self):
+		return self.buffer.dropped
+
+
+	"""
+	Called by the scan thread after every scan ("tl" is the TransferLock). "t" is the time of the scan; if it's not
+	given, the timestamp of the last scan is used.
+	"""
+	def record(self,tl,t=None):
+
+		if self._closed:
+			return
+
+		tasks=tl.daq_tasks
+		self.scans+=1
+
+		#A scan without both master peaks also counts as a loss (the locked flag isn't updated then).
+		locked=[tl.master_lock_engaged and tl.master_locked_flag and tl.two_peaks]
+		for i in range(len(tl.slave_locks_engaged)):
+			locked.append(tl.slave_locks_engaged[i] and tl.slave_locked_flags[i].is_set())
+
+		#The lock is lost only if it's still engaged (disengaging it is not a loss).
+		engaged=[tl.master_lock_engaged]+list(tl.slave_locks_engaged)
+		lost=any(self._prev_locked[i] and engaged[i] and not locked[i] for i in range(len(locked)))
+		self._prev_locked[:len(locked)]=locked
+
+		st=self._state
+		st[TS['time']]=tasks.scan_wall_time() if t is None else t
+		st[TS['scan_index']]=tasks.scan_index
+		st[TS['master_engaged']]=tl.master_lock_engaged
+		st[TS['master_locked']]=tl.master_locked_flag
+		st[TS['two_peaks']]=tl.two_peaks
+		st[TS['master_err']]=tl.lock.master_err
+		st[TS['master_lockpoint']]=tl.lock.master_lockpoint
+		st[TS['master_ctrl']]=tl.lock.master_ctrl
+		st[TS['offset']]=tasks.ao_scan.offset
+		st[TS['zoom_start']]=tasks.ao_scan.zoom_start
+		st[TS['zoom_stop']]=tasks.ao_scan.zoom_stop
+		for i in range(len(tl.slave_locks_engaged)):
+			s=str(i)
+			st[TS['slave_engaged'+s]]=tl.slave_locks_engaged[i]
+			st[TS['slave_locked'+s]]=tl.slave_locked_flags[i].is_set()
+			st[TS['slave_err'+s]]=tl.lock.slave_errs[i]
+			st[TS['slave_lockpoint'+s]]=tl.lock.slave_lockpoints[i]
+			st[TS['slave_ctrl'+s]]=tl.lock.slave_ctrls[i]
+			st[TS['voltage'+s]]=tasks.ao_laser.voltages[i]
+
+		traces=tasks.PD_data
+		start=tasks.ao_scan.zoom_start if traces.shape[1]!=self.n_samples else 0
+
+		if lost and (self.pre_trigger>0 or self.post_trigger>0):
+			self.triggers+=1
+			self._flush_pre()
+			self._post=self.post_trigger
+			self.buffer.push(traces,st,start)
+		elif self._post>0:
+			self._post-=1
+			self.buffer.push(traces,st,start)
+		elif self.every>0 and self.scans%self.every==0:
+			self.buffer.push(traces,st,start)
+		elif self._pre is not None:
+			if len(self._pre)==self._pre.capacity:
+				self._pre.release(1)
+			self._pre.push(traces,st,start)
+
+
+	#Passing scans from before the trigger to the writer.
+	def _flush_pre(self):
+		if self._pre is None:
+			return
+		parts,n=self._pre.peek()
+		for traces,states in parts:
+			for k in range(len(traces)):
+				self.buffer.push(traces[k],states[k])
+		self._pre.release(n)
+
+
+	def _reserve(self,n):
+		if self.rows+n<=self.capacity:
+			return
+		needed=max(self.rows+n,self.capacity+self.capacity//2)
+		self.capacity=-(-needed//self.chunk_scans)*self.chunk_scans
+		self._traces.resize(self.capacity,axis=0)
+		self._states.resize(self.capacity,axis=0)
+
+
+	def flush(self):
+
+		parts,n=self.buffer.peek()
+		if n==0:
+			return
+
+		self._reserve(n)
+		row=self.rows
+		for traces,states in parts:
+			k=len(traces)
+			self._traces[row:row+k]=traces
+			self._states[row:row+k]=states
+			row+=k
+
+		self.buffer.release(n)
+		self.rows=row
+
+		self._file.attrs['Rows']=self.rows
+		self._file.attrs['Dropped']=self.buffer.dropped
+		self._file.flush()
+
+
+	def _run(self):
+		while not self._stop.wait(self.flush_interval):
+			try:
+				self.flush()
+			except Exception as e:
+				log.exception(e)
+
+
+	def close(self):
+
+		if self._file is None:
+			return
+
+		self._closed=True
+		self._stop.set()
+		self._thread.join()
+
+		try:
+			self.flush()
+			self._traces.resize(self.rows,axis=0)
+			self._states.resize(self.rows,axis=0)
+			self.capacity=self.rows
+		finally:
+			self._file.close()
+			self._file=None
@@ -0,0 +1,184 @@
+from time import perf_counter_ns
+import datetime
+
+
+"""
+This file contains tools used to measure how long different stages of the scan loop take. Every stage has a
+histogram with fixed, logarithmically spaced bins, so recording a measurement is just a couple of integer operations
+(well below a microsecond), and percentiles can be read at any time without storing individual measurements.
+"""
+
+
+"""
+Histogram of durations (in ns). Each power of two is divided into 8 bins, which gives ~9% resolution over the whole
+range. Bin index is calculated directly from the bit length of the duration, so no search is needed.
+"""
+class LatencyHistogram:
+
+	_SUB_BITS=3
+	_SUB_BINS=8
+	_N_BINS=64*8
+
+	def __init__(self):
+		self.counts=[0]*self._N_BINS
+		self.n=0
+		self.total=0
+		self.max=0
+
+
+	def add(self,dt):
+		b=dt.bit_length()
+		if b>self._SUB_BITS:
+			ind=(b<<self._SUB_BITS)+((dt>>(b-self._SUB_BITS-1))&(self._SUB_BINS-1))
+		else:
+			ind=dt
+		self.counts[ind]+=1
+		self.n+=1
+		self.total+=dt
+		if dt>self.max:
+			self.max=dt
+
+
+	#Lower edge of a bin (in ns).
+	def _bin_edge(self,ind):
+		b=ind>>self._SUB_BITS
+		if b<=self._SUB_BITS:
+			return ind
+		sub=ind&(self._SUB_BINS-1)
+		return (self._SUB_BINS+sub)<<(b-self._SUB_BITS-1)
+
+
+	#Approximate percentile (p in %) given as the middle of the bin containing it.
+	def percentile(self,p):
+		if self.n==0:
+			return 0
+		target=p/100*self.n
+		acc=0
+		for i in range(self._N_BINS):
+			acc+=self.counts[i]
+			if acc>=target and self.counts[i]>0:
+				return (self._bin_edge(i)+self._bin_edge(i+1))/2
+		return self.max
+
+
+	def mean(self):
+		if self.n==0:
+			return 0
+		return self.total/self.n
+
+
+	def reset(self):
+		self.counts=[0]*self._N_BINS
+		self.n=0
+		self.total=0
+		self.max=0
+
+
+"""
+Collection of histograms, one per stage. Usage in the hot path:
+
+	t=perf_counter_ns()
+	...
+	t=profiler.record('stage1',t)
+	...
+	t=profiler.record('stage2',t)
+
+"record" returns the current time, so consecutive stages are measured with a single clock read each.
+"""
+class LatencyProfiler:
+
+	def __init__(self):
+		self.stages={}
+		self.enabled=True
+
+
+	def record(self,stage,t0):
+		t=perf_counter_ns()
+		if self.enabled:
+			try:
+				self.stages[stage].add(t-t0)
+			except KeyError:
+				self.stages[stage]=LatencyHistogram()
+				self.stages[stage].add(t-t0)
+		return t
+
+
+	def reset(self):
+		for hist in self.stages.values():
+			hist.reset()
+
+
+	#List of (stage, count, mean, p50, p99, max) with times in microseconds.
+	def summary(self):
+		res=[]
+		for name,hist in list(self.stages.items()):
+			res.append((name,hist.n,hist.mean()/1000,hist.percentile(50)/1000,hist.percentile(99)/1000,hist.max/1000))
+		return res
+
+
+	#Writing the summary to a text file. Additional statistics (a dictionary) can be appended at the end.
+	def dump(self,filename,extra=None):
+		with open(filename,'w') as f:
+			f.write('#Scan loop latency, '+datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')+'\n')
+			f.write('#Stage\tCount\tMean[us]\tP50[us]\tP99[us]\tMax[us]\n')
+			for row in self.summary():
+				f.write('{}\t{}\t{:.1f}\t{:.1f}\t{:.1f}\t{:.1f}\n'.format(*row))
+			if extra is not None:
+				for key,val in extra.items():
+					f.write('#{}\t{}\n'.format(key,val))
+
+
+"""
+Statistics of a loop run with a fixed target period. For every iteration the real period (start to start) is compared
+with the target one to obtain the jitter (mean and standard deviation are kept with Welford's algorithm). Iterations
+that end after their deadline are counted as deadline misses. Work that was skipped because the loop was behind 
+schedule (plotting) is counted as well.
+"""
+class CadenceStats:
+
+	def __init__(self):
+		self.reset()
+
+
+	def reset(self):
+		self.n=0
+		self.mean_period=0
+		self.mean_jitter=0
+		self._m2=0
+		self.max_jitter=0
+		self.misses=0
+		self.skipped={}
+
+
+	#Period and target are given in seconds.
+	def add_period(self,period,target):
+		self.n+=1
+		self.mean_period+=(period-self.mean_period)/self.n
+		jitter=period-target
+		delta=jitter-self.mean_jitter
+		self.mean_jitter+=delta/self.n
+		self._m2+=delta*(jitter-self.mean_jitter)
+		if abs(jitter)>self.max_jitter:
+			self.max_jitter=abs(jitter)
+
+
+	def add_miss(self):
+		self.misses+=1
+
+
+	def add_skip(self,name):
+		self.skipped[name]=self.skipped.get(name,0)+1
+
+
+	def jitter_std(self):
+		if self.n<2:
+			return 0
+		return (self._m2/(self.n-1))**0.5
+
+
+	#Dictionary with all statistics (times in ms), used for monitoring.
+	def summary(self):
+		res={'Iterations':self.n,'MeanPeriod':1000*self.mean_period,'MeanJitter':1000*self.mean_jitter,'JitterStd':1000*self.jitter_std(),'MaxJitter':1000*self.max_jitter,'DeadlineMisses':self.misses}
+		for name,count in self.skipped.items():
+			res['Skipped'+name]=count
+		return res
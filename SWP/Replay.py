@@ -0,0 +1,331 @@
+import numpy as np
+import h5py
+from collections import OrderedDict
+from time import perf_counter, sleep
+
+from .DAQ_tasks import setup_tasks
+from .Data_acq import TransferLock, find_peaks_block, discarded_samples
+from .Lock import Lock
+
+
+"""
+This file contains the offline replay of raw traces recorded by TraceRecorder (see Log_writer.py). Recorded scans
+are put through the same code as in the scan loop (peak finding, master and slave locks; see
+TransferLock.process_scan), with the DAQ replaced by the simulated backend, which only receives the feedback. It's
+used to check changes to the peak finding and to the locks (or different gains, criteria, etc. set in the config) on
+real data, and to compare the resulting error and control signals with the recorded ones.
+"""
+
+
+#Values saved for every replayed scan (columns of the "Replay" dataset of the output file). "seeded" is set for the
+#first scans of runs, whose errors, feedback signals and voltages are copied from the recording (see Replay._seed).
+REPLAY_FIELDS=['time','scan_index','seeded','two_peaks','master_locked','master_err','master_ctrl','offset']
+for _i in range(2):
+	REPLAY_FIELDS+=[name+str(_i) for name in ['slave_locked','slave_err','slave_ctrl','voltage']]
+
+RF={name:ind for ind,name in enumerate(REPLAY_FIELDS)}
+
+
+#Names saved in attributes are returned as bytes by some versions of h5py.
+def _names(names):
+	return [n.decode() if isinstance(n,bytes) else str(n) for n in names]
+
+
+"""
+Reading a file with recorded traces. The "State" dataset is small and is read at once. Traces are read in blocks of
+whole chunks (with "read_direct" to buffers that are reused), or, if the dataset is contiguous and uncompressed,
+straight from the memory-mapped file. A few blocks are cached, because scans recorded before a trigger are saved
+after the ones recorded periodically in the meantime, so the file isn't read exactly in order of the scans.
+"""
+class TraceFile:
+
+	def __init__(self,filename,cache_blocks=4):
+
+		self.filename=filename
+		self._file=h5py.File(filename,'r')
+		self.traces=self._file['Traces']
+		attrs=self._file.attrs
+
+		self.rows=min(int(attrs.get('Rows',self.traces.shape[0])),self.traces.shape[0])
+		self.n_channels=self.traces.shape[1]
+		self.n_samples=self.traces.shape[2]
+		self.attrs=dict(attrs)
+
+		self.fields={name:ind for ind,name in enumerate(_names(attrs['Fields']))}
+		self.state=self._file['State'][:self.rows]
+
+		self._mmap=None
+		if self.traces.chunks is None and self.traces.compression is None:
+			offset=self.traces.id.get_offset()
+			if offset is not None:
+				self._mmap=np.memmap(filename,mode='r',dtype=self.traces.dtype,offset=offset,shape=self.traces.shape)
+
+		self.block=self.traces.chunks[0] if self.traces.chunks is not None else max(1,(1<<20)//(self.n_channels*self.n_samples*self.traces.dtype.itemsize))
+		self._raw=np.zeros((self.block,self.n_channels,self.n_samples),dtype=self.traces.dtype)
+		self._cache=OrderedDict()
+		self._free=[np.zeros((self.block,self.n_channels,self.n_samples)) for i in range(max(1,cache_blocks))]
+
+
+	#Column of the state (None if it wasn't recorded by the version that wrote the file).
+	def column(self,name):
+		if name not in self.fields:
+			return None
+		return self.state[:,self.fields[name]]
+
+
+	#Traces of the scan in row "row" of the file (channels x samples, float64).
+	def scan(self,row):
+		b=row//self.block
+		if b in self._cache:
+			self._cache.move_to_end(b)
+		else:
+			self._cache[b]=self._read_block(b)
+		return self._cache[b][row-b*self.block]
+
+
+	def _read_block(self,b):
+		buf=self._free.pop() if self._free else self._cache.popitem(last=False)[1]
+		self.read(b*self.block,buf)
+		return buf
+
+
+	#Reading traces of scans from row "lo" (at most one block) to "out" (float64). Returns the number of scans read.
+	def read(self,lo,out):
+		hi=min(lo+self.block,self.rows)
+		if self._mmap is not None:
+			out[:hi-lo]=self._mmap[lo:hi]
+		else:
+			self.traces.read_direct(self._raw,np.s_[lo:hi],np.s_[:hi-lo])
+			out[:hi-lo]=self._raw[:hi-lo]
+		return hi-lo
+
+
+	def close(self):
+		self._mmap=None
+		self._cache.clear()
+		self._file.close()
+
+
+"""
+Replay of a file with recorded traces. "cfg" is the config used for the locks (e.g. the one the traces were recorded
+with, possibly with changed gains or criteria). Scan parameters are taken from the file and the DAQ is simulated, so
+only the tasks of the scan and the lasers (which receive the feedback) are created. By default, peaks are found for
+blocks of scans at once (see find_peaks_block in Data_acq.py) before the locks are run scan by scan; with "exact",
+every scan is analyzed separately by the same code as in the scan loop (several times slower). Scans are replayed in order of
+their index; every run of consecutive scans starts from the recorded state of its first scan (errors, feedback
+signals, lock flags, scan offset and voltages of the lasers); after that, the state of the locks comes only from the
+replayed scans. Lockpoints and engaged locks are set from the recorded state of every scan. Seeded scans are marked
+in the results, as they match the recording by construction; "closed_loop" is the number of the other ones.
+"""
+class Replay:
+
+	def __init__(self,filename,cfg,exact=False,cache_blocks=4):
+
+		self.file=f=TraceFile(filename,cache_blocks)
+		self.exact=exact
+
+		wavelengths=list(f.attrs.get('SlaveWavelengths',[1086,1087][:max(1,min(2,f.n_channels-1))]))
+		self.n=len(wavelengths)
+
+		cfg['DAQ']['Backend']='Sim'
+		cfg['DAQ']['PowerInScan']='0'
+		if not cfg.has_section('SIMULATION'):
+			cfg.add_section('SIMULATION')
+		cfg['SIMULATION']['RealTime']='0'
+		cfg['CAVITY']['ScanTime']=str(int(round(float(f.attrs['ScanTime']))))
+		cfg['CAVITY']['ScanSamples']=str(f.n_samples)
+		cfg['CAVITY']['ScanAmplitude']=str(float(f.attrs.get('ScanAmplitude',cfg['CAVITY']['ScanAmplitude'])))
+		cfg['CAVITY']['AdaptiveZoom']='0'
+		cfg['CAVITY']['ContinuousScan']='0'
+		cfg['CAVITY']['TargetPeriod']='0'
+
+		self.tl=TransferLock(Lock(wavelengths,cfg),setup_tasks(cfg,self.n,False),cfg)
+
+		index=f.column('scan_index')
+		self.order=np.argsort(index,kind='stable')
+		self.results=np.zeros((f.rows,len(REPLAY_FIELDS)))
+		self._columns={name:f.state[:,ind].tolist() for name,ind in f.fields.items()}
+		self.elapsed=0
+		self.closed_loop=0
+		self.scan_period=float(f.attrs['ScanTime'])/1000
+
+
+	#Recorded value (a default one, if it wasn't recorded by the version that wrote the file).
+	def _value(self,name,row,default):
+		col=self._columns.get(name)
+		return default if col is None else col[row]
+
+
+	#Range of samples of the scan (zoomed scans are saved with zeros outside of the scanned range).
+	def _zoom(self,row):
+		start=int(self._value('zoom_start',row,0))
+		stop=int(self._value('zoom_stop',row,0))
+		return start,(stop if stop>start else self.file.n_samples)
+
+
+	"""
+	Finding peaks in all scans, reading the file block by block. Scans of a block with the same range of samples are
+	analyzed at once. Returns a list (for every channel) of lists of peaks in every row of the file.
+	"""
+	def find_peaks(self):
+
+		f=self.file
+		tl=self.tl
+		full_time=tl.daq_tasks._full_time
+		win_size=tl.daq_tasks.ao_scan.n_samples//200
+		criteria=[tl.master_peak_crit]+tl.slave_peak_crits[:self.n]
+
+		peaks=[[None]*f.rows for i in range(self.n+1)]
+		buf=np.zeros((f.block,f.n_channels,f.n_samples))
+
+		for lo in range(0,f.rows,f.block):
+			m=f.read(lo,buf)
+			ranges=[self._zoom(row) for row in range(lo,lo+m)]
+			for start,stop in set(ranges):
+				rows=[k for k in range(m) if ranges[k]==(start,stop)]
+				for ch in range(self.n+1):
+					found=find_peaks_block(full_time[start:stop],buf[rows,ch,start:stop],tl.filter,criteria[ch],win_size,discard=discarded_samples(len(full_time),start))
+					for k,p in zip(rows,found):
+						peaks[ch][lo+k]=p
+
+		return peaks
+
+
+	#Clearing the locks before the first scan of a run of consecutive scans. Lock flags are taken from the file.
+	def _reset(self,row):
+
+		tl=self.tl
+
+		tl.reset_master_error()
+		tl.master_locked_flag=bool(self._value('master_locked',row,0))
+		for i in range(self.n):
+			tl.reset_slave_error(i)
+			tl.lock._wrong_peak_counter[i]=0
+			if self._value('slave_locked'+str(i),row,0):
+				tl.slave_lock_counters[i]=tl._slave_lock_count+1
+				tl.slave_locked_flags[i].set()
+			else:
+				tl.slave_lock_counters[i]=0
+
+
+	"""
+	After the first scan of a run is processed (which finds the peaks), errors, feedback signals, the scan offset and
+	voltages of the lasers are set to the recorded ones, so the next scans continue from the recorded state.
+	"""
+	def _seed(self,row):
+
+		tl=self.tl
+		lock=tl.lock
+		tasks=tl.daq_tasks
+
+		lock.master_err=self._value('master_err',row,lock.master_err)
+		lock.master_ctrl=self._value('master_ctrl',row,lock.master_ctrl)
+		tasks.ao_scan.set_offset(self._value('offset',row,tasks.ao_scan.offset))
+
+		voltages=tasks.ao_laser.voltages
+		for i in range(self.n):
+			s=str(i)
+			lock.slave_errs[i]=self._value('slave_err'+s,row,lock.slave_errs[i])
+			lock.slave_ctrls[i]=self._value('slave_ctrl'+s,row,lock.slave_ctrls[i])
+			voltages[i]=self._value('voltage'+s,row,voltages[i])
+		tasks.set_laser_volts(voltages)
+
+
+	#Writing the state after the scan to a row of the results (in the order of REPLAY_FIELDS).
+	def _store(self,out,row,seeded):
+
+		tl=self.tl
+		lock=tl.lock
+		tasks=tl.daq_tasks
+
+		values=[self._value('time',row,0),self._value('scan_index',row,row),seeded,tl.two_peaks,tl.master_locked_flag,lock.master_err,lock.master_ctrl,tasks.ao_scan.offset]
+		for i in range(self.n):
+			values+=[tl.slave_locked_flags[i].is_set(),lock.slave_errs[i],lock.slave_ctrls[i],tasks.ao_laser.voltages[i]]
+		out[:len(values)]=values
+
+
+	"""
+	Replaying all scans. If "speed" is 0, scans are replayed as fast as possible; otherwise with the recorded time
+	between consecutive scans divided by "speed" (1 - real time). Returns the array of results (columns as in
+	REPLAY_FIELDS, rows in order of the scans).
+	"""
+	def run(self,speed=0):
+
+		f=self.file
+		tl=self.tl
+		lock=tl.lock
+		tasks=tl.daq_tasks
+		full_time=tasks._full_time
+
+		index=self._columns['scan_index']
+		times=self._columns.get('time')
+		prev=None
+		self.closed_loop=0
+		t0=perf_counter()
+		peaks=None if self.exact else self.find_peaks()
+		deadline=perf_counter()
+
+		for k,row in enumerate(self.order.tolist()):
+
+			consecutive=prev is not None and index[row]==index[prev]+1
+			if not consecutive:
+				self._reset(row)
+
+			dt=times[row]-times[prev] if consecutive and times is not None else 0
+			tasks.scan_dt=dt
+			lock.dt=dt
+
+			tl.master_lock_engaged=bool(self._value('master_engaged',row,1))
+			lock.master_lockpoint=self._value('master_lockpoint',row,lock.master_lockpoint)
+			for i in range(self.n):
+				s=str(i)
+				tl.slave_locks_engaged[i]=bool(self._value('slave_engaged'+s,row,1))
+				lock.slave_lockpoints[i]=self._value('slave_lockpoint'+s,row,lock.slave_lockpoints[i])
+
+			if peaks is None:
+				start,stop=self._zoom(row)
+				tasks.time_samples=full_time[start:stop]
+				tasks.PD_data=f.scan(row)[:,start:stop]
+				tl.process_scan()
+			else:
+				tl.process_scan([p[row] for p in peaks])
+
+			if not consecutive:
+				self._seed(row)
+			else:
+				self.closed_loop+=1
+
+			self._store(self.results[k],row,not consecutive)
+			prev=row
+
+			if speed>0:
+				deadline+=(dt if dt>0 else self.scan_period)/speed
+				wait=deadline-perf_counter()
+				if wait>0:
+					sleep(wait)
+
+		self.elapsed=perf_counter()-t0
+		return self.results
+
+
+	#Recorded state in order of the scans (rows matching the results).
+	def recorded(self):
+		return self.file.state[self.order]
+
+
+	"""
+	Saving the results to an HDF5 file: the "Replay" dataset (REPLAY_FIELDS) and the recorded "State" of the same
+	scans, both with names of the columns in the "Fields" attribute.
+	"""
+	def save(self,filename):
+		with h5py.File(filename,'w') as out:
+			out.attrs['Source']=self.file.filename
+			out.attrs['Elapsed']=self.elapsed
+			res=out.create_dataset('Replay',data=self.results)
+			res.attrs['Fields']=REPLAY_FIELDS
+			st=out.create_dataset('State',data=self.recorded())
+			st.attrs['Fields']=list(self.file.fields.keys())
+
+
+	def close(self):
+		self.file.close()
@@ -0,0 +1,142 @@
+import numpy as np
+import math
+from collections import deque
+
+
+"""
+This file contains helper classes used to keep statistics of signals that are updated at every scan (like error
+signals of the locks). They are designed so that a single update takes constant time, regardless of the length
+of the window over which the statistics are calculated.
+"""
+
+
+"""
+Rolling statistics over the last "window" values. The sum and the sum of squares of the values in the window are
+kept and updated when a value enters or leaves the window, so mean and RMS are obtained in O(1). Because adding and
+subtracting floats accumulates rounding errors, both sums are recalculated from the stored values every "resync"
+updates. Minimum and maximum (used for peak-to-peak) are tracked with monotonic queues, which is amortized O(1).
+"""
+class RollingStats:
+
+	def __init__(self,window,resync=1000):
+
+		self.window=max(int(window),1)
+		self.resync=resync
+
+		#Values currently in the window are kept in a circular buffer.
+		self._values=np.zeros(self.window)
+		self._pos=0
+		self._count=0
+
+		#Total number of values pushed. Used to identify elements of monotonic queues.
+		self._index=0
+		self._updates=0
+
+		self._sum=0.0
+		self._sum_sq=0.0
+
+		#Monotonic queues of (index, value) pairs.
+		self._min_queue=deque()
+		self._max_queue=deque()
+
+
+	def __len__(self):
+		return self._count
+
+
+	#Removes all values from the window.
+	def clear(self):
+		self._values[:]=0
+		self._pos=0
+		self._count=0
+		self._index=0
+		self._updates=0
+		self._sum=0.0
+		self._sum_sq=0.0
+		self._min_queue.clear()
+		self._max_queue.clear()
+
+
+	#Changes the length of the window. Values that are still in the new window are kept.
+	def set_window(self,window):
+
+		old=self.values()[-int(window):]
+		self.window=max(int(window),1)
+		self._values=np.zeros(self.window)
+		self.clear()
+		for v in old:
+			self.push(v)
+
+
+	#Adds a new value to the window. If the window is full, the oldest value is removed.
+	def push(self,value):
+
+		value=float(value)
+
+		if self._count==self.window:
+			old=self._values[self._pos]
+			self._sum-=old
+			self._sum_sq-=old*old
+		else:
+			self._count+=1
+
+		self._values[self._pos]=value
+		self._pos=(self._pos+1)%self.window
+
+		self._sum+=value
+		self._sum_sq+=value*value
+
+		#Elements with indices below "first" are outside the window.
+		first=self._index-self._count+1
+
+		while self._min_queue and self._min_queue[-1][1]>=value:
+			self._min_queue.pop()
+		self._min_queue.append((self._index,value))
+		while self._min_queue[0][0]<first:
+			self._min_queue.popleft()
+
+		while self._max_queue and self._max_queue[-1][1]<=value:
+			self._max_queue.pop()
+		self._max_queue.append((self._index,value))
+		while self._max_queue[0][0]<first:
+			self._max_queue.popleft()
+
+		self._index+=1
+		self._updates+=1
+
+		if self._updates>=self.resync:
+			self._resynchronize()
+
+
+	#Recalculates running sums from the stored values to remove accumulated rounding errors.
+	def _resynchronize(self):
+		vals=self._values[:self._count] if self._count<self.window else self._values
+		self._sum=float(np.sum(vals))
+		self._sum_sq=float(np.dot(vals,vals))
+		self._updates=0
+
+
+	#Values in the window, from the oldest to the newest.
+	def values(self):
+		if self._count<self.window:
+			return self._values[:self._count].copy()
+		return np.roll(self._values,-self._pos)
+
+
+	def mean(self):
+		if self._count==0:
+			return 0
+		return self._sum/self._count
+
+
+	def rms(self):
+		if self._count==0:
+			return 0
+		#Rounding errors can make the sum of squares slightly negative when all values are ~0.
+		return math.sqrt(max(self._sum_sq,0)/self._count)
+
+
+	def peak_to_peak(self):
+		if self._count==0:
+			return 0
+		return self._max_queue[0][1]-self._min_queue[0][1]
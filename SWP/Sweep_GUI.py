@@ -8,13 +8,15 @@ from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 from matplotlib.gridspec import GridSpec
 import threading
 import datetime
-import h5py
 import logging
 import os
 
 from .Config import *
 from .Devices import *
 from .Data_acq import *
+from .Control_process import ControlProcess, apply_state
+from .GUI_bus import GUIUpdateBus
+from .Log_writer import HDF5LogWriter, TraceRecorder, MASTER_LOG_FIELDS, SLAVE_LOG_FIELDS, log_options, trace_options
 from .Bristol import SocketClientBristol671A
 
 
@@ -112,6 +114,11 @@ class GUI:
 		except:
 			pass
 
+		try:
+			self.ld.TC.close_logs()
+		except:
+			pass
+
 		try:
 			del self.ld.TC.transfer_lock.daq_tasks
 		except:
@@ -689,6 +696,13 @@ class TransferCavity:
 		self.adset_window=None
 		self.daqset_window=None
 
+		#Window showing latency of the scan loop stages
+		self.diag_window=None
+
+		#Acquisition and locking can be run in a separate process (see Control_process.py).
+		self.separate_process=int(get_option(config,'DAQ','SeparateProcess','0'))>0
+		self.control_process=None
+
 
 		"""
 		Lock initialization. 
@@ -714,6 +728,14 @@ class TransferCavity:
 		"""
 
 		self.transfer_lock=TransferLock(self.lock,setup_tasks(config,len(self.lasers),simulate),config)
+
+		"""
+		GUI update bus.
+		Threads other than the main one (scan, sweeps, wavemeter updates) don't change widgets directly. They post
+		new values to the bus, which applies the latest ones in the Tk thread once per frame.
+		"""
+		self.gui_bus=GUIUpdateBus(parent,profiler=self.transfer_lock.profiler)
+		self.gui_bus.start()
 		
 		"""
 		Sweep thread.
@@ -1030,23 +1052,15 @@ class TransferCavity:
 		self.master_logging_set=False
 		self.log_las_file=[None]*2
 		
+		#Writers of the log files (see Log_writer.py); they exist only while logging is on.
+		self.master_log=None
+		self.slave_logs=[None,None]
+		self.log_options=log_options(config)
 
-		self.master_logging_flag=threading.Event()
-		self.slave_logging_flag=[threading.Event(),threading.Event()]
-		self.master_logging_flag.clear()
-		self.slave_logging_flag[0].clear()
-		self.slave_logging_flag[1].clear()
-		self.master_logging_thread=None
-		self.slave_logging_thread=[None,None]
-
-		self.slave_err_temp=[None]*2
-		self.slave_time_temp=[None]*2
-		self.slave_rfreq_temp=[None]*2
-		self.slave_lfreq_temp=[None]*2
-		self.slave_rr_temp=[None]*2
-		self.slave_lr_temp=[None]*2
-		self.slave_pow_temp=[None]*2
-		self.slave_wvmfreq_temp=[None]*2
+		#Recording of raw traces while scanning (see TraceRecorder in Log_writer.py).
+		self.record_traces=int(get_option(config,'LOGGING','RecordTraces','0'))>0
+		self.trace_options=trace_options(config)
+		self.trace_recorder=None
 
 		self.lt_start=[None]*2
 
@@ -1056,10 +1070,10 @@ class TransferCavity:
 		self.mlog_filename=None
 		self.laslog_filenames=[None,None]
 
-		self.real_frequency=[deque(maxlen=1)]
+		self.real_frequency=[RingBuffer(1)]
 		self.real_frequency[0].append(0)
 		if len(self.lasers)>1:
-			self.real_frequency.append(deque(maxlen=1))
+			self.real_frequency.append(RingBuffer(1))
 			self.real_frequency[1].append(0)
 		
 		#We loop over two lasers. One of them might be just greyed out.
@@ -1333,6 +1347,9 @@ class TransferCavity:
 		self.change_channels=Button(self.bottom_frame,text="Change DAQ channels",width=20,command=self.change_daq_channels,font="Arial 12 bold",fg=label_fg_color,bg=button_bg_color)
 		self.change_channels.grid(row=5, column=1,sticky=W)
 
+		self.diagnostics_button=Button(self.bottom_frame,text="Diagnostics",width=10,command=self.open_diagnostics,font="Arial 10 bold",fg=label_fg_color,bg=button_bg_color)
+		self.diagnostics_button.grid(row=5,column=3,sticky=SW)
+
 		Label(self.bottom_frame,bg=bg_color,fg=label_fg_color,font="Arial 14 bold",text="IP address:").grid(row=5,column=4,sticky=SW)
 
 		self.IP_label=Label(self.bottom_frame,bg=bg_color,fg=on_color,font="Arial 14 bold",text="")
@@ -1453,22 +1470,57 @@ class TransferCavity:
 		if flname=="":
 			return
 
-		daq_d={"DeviceName":self.transfer_lock.daq_tasks.device.name}
+		settings=self.current_settings()
+		standard=[settings.pop(section,None) for section in ["DAQ","WAVEMETER","CAVITY","LASER1","LASER2"]]
+
+		save_conf(flname,*standard,extra=settings)
+
+
+	#Current settings in the form of a dictionary of config sections. Used to save the config and to start the control process.
+	def current_settings(self):
+
+		backend=self.transfer_lock.daq_tasks.backend
+
+		daq_d={"DeviceName":self.transfer_lock.daq_tasks.device.name,"SeparateProcess":int(self.separate_process),"Backend":backend.name,"PowerInScan":int(self.transfer_lock.daq_tasks.combined_power),"PowerReduction":self.transfer_lock.daq_tasks.power_PDs.reduction,"StagedLaserUpdate":int(self.transfer_lock.daq_tasks.staged_laser_update),"DACBits":self.transfer_lock.daq_tasks.ao_laser.dac_bits,"Oversampling":self.transfer_lock.daq_tasks.ai_PDs.oversampling,"Decimation":self.transfer_lock.daq_tasks.ai_PDs.decimation,"RawCounts":int(self.transfer_lock.daq_tasks.ai_PDs.raw_counts)}
 
 		wvm_d={"IP":self.host_ip,"Port":self.wvm_port,"Laser1":self.wvm_L1,"Laser2":self.wvm_L2}
 
-		cav_d={"RMS":self.transfer_lock.rms_points,"LockThreshold":self.transfer_lock.master_rms_crit,"PeakCriterion":self.transfer_lock.master_peak_crit,"ScanTime":self.transfer_lock.daq_tasks.ao_scan.scan_time,"ScanSamples":self.transfer_lock.daq_tasks.ao_scan.n_samples,"ScanOffset":self.transfer_lock.daq_tasks.ao_scan.offset,"ScanAmplitude":self.transfer_lock.daq_tasks.ao_scan.amplitude,"PGain":self.lock.prop_gain[0],"IGain":self.lock.int_gain[0],"FSR":self.lock._FSR,"Wavelength":self.lock.get_master_wavelength(),"Lockpoint":self.lock.master_lockpoint,"MinVoltage":self.transfer_lock.daq_tasks.ao_scan.mn_voltage,"MaxVoltage":self.transfer_lock.daq_tasks.ao_scan.mx_voltage,"InputChannel":channel_number(self.transfer_lock.daq_tasks.get_scan_ai_channel()),"OutputChannel":channel_number(self.transfer_lock.daq_tasks.get_scan_ao_channel())}
-		
-		laser1_d={"LockpointR":self.lock.slave_lockpoints[0],"LockpointMHz":self.lock.get_laser_lockpoint(0),"Wavelength":self.lasers[0].get_set_wavelength(),"PeakCriterion":self.transfer_lock.slave_peak_crits[0],"LockThreshold":self.transfer_lock.slave_rms_crits[0],"PGain":self.lock.prop_gain[1],"IGain":self.lock.int_gain[1],"MinVoltage":self.transfer_lock.daq_tasks.ao_laser.mn_voltages[0],"MaxVoltage":self.transfer_lock.daq_tasks.ao_laser.mx_voltages[0],"SetVoltage":self.transfer_lock.daq_tasks.ao_laser.voltages[0],"InputChannel":channel_number(self.transfer_lock.daq_tasks.get_laser_ai_channel(0)),"OutputChannel":channel_number(self.transfer_lock.daq_tasks.get_laser_ao_channel(0)),"PowerChannel":channel_number(self.transfer_lock.daq_tasks.get_laser_power_channel(0))}
-		
-		if len(self.lasers)>1:
-		
-			laser2_d={"LockpointR":self.lock.slave_lockpoints[1],"LockpointMHz":self.lock.get_laser_lockpoint(1),"Wavelength":self.lasers[1].get_set_wavelength(),"PeakCriterion":self.transfer_lock.slave_peak_crits[1],"LockThreshold":self.transfer_lock.slave_rms_crits[1],"PGain":self.lock.prop_gain[2],"IGain":self.lock.int_gain[2],"MinVoltage":self.transfer_lock.daq_tasks.ao_laser.mn_voltages[1],"MaxVoltage":self.transfer_lock.daq_tasks.ao_laser.mx_voltages[1],"SetVoltage":self.transfer_lock.daq_tasks.ao_laser.voltages[1],"InputChannel":channel_number(self.transfer_lock.daq_tasks.get_laser_ai_channel(1)),"OutputChannel":channel_number(self.transfer_lock.daq_tasks.get_laser_ao_channel(1)),"PowerChannel":channel_number(self.transfer_lock.daq_tasks.get_laser_power_channel(1))}
-		
-			save_conf(flname,daq_d,wvm_d,cav_d,laser1_d,laser2_d)
-		
-		else:
-			save_conf(flname,daq_d,wvm_d,cav_d,laser1_d)
+		cav_d={"RMS":self.transfer_lock.rms_points,"LockThreshold":self.transfer_lock.master_rms_crit,"PeakCriterion":self.transfer_lock.master_peak_crit,"ScanTime":self.transfer_lock.daq_tasks.ao_scan.scan_time,"ScanSamples":self.transfer_lock.daq_tasks.ao_scan.n_samples,"ScanOffset":self.transfer_lock.daq_tasks.ao_scan.offset,"ScanAmplitude":self.transfer_lock.daq_tasks.ao_scan.amplitude,"PGain":self.lock.prop_gain[0],"IGain":self.lock.int_gain[0],"FSR":self.lock._FSR,"Wavelength":self.lock.get_master_wavelength(),"Lockpoint":self.lock.master_lockpoint,"MinVoltage":self.transfer_lock.daq_tasks.ao_scan.mn_voltage,"MaxVoltage":self.transfer_lock.daq_tasks.ao_scan.mx_voltage,"InputChannel":channel_number(self.transfer_lock.daq_tasks.get_scan_ai_channel()),"OutputChannel":channel_number(self.transfer_lock.daq_tasks.get_scan_ao_channel()),"TargetPeriod":1000*self.transfer_lock.target_period,"ContinuousScan":int(self.transfer_lock.daq_tasks.continuous),"AdaptiveZoom":int(self.transfer_lock.daq_tasks.adaptive_zoom),"ZoomMargin":self.transfer_lock.daq_tasks.zoom_margin,"ExactDt":int(self.lock.exact_dt)}
+
+		settings={"DAQ":daq_d,"WAVEMETER":wvm_d,"CAVITY":cav_d}
+
+		settings["LOGGING"]={"Compression":self.log_options["compression"],"ChunkRows":self.log_options["chunk_rows"],"FlushInterval":self.log_options["flush_interval"],"BufferRows":self.log_options["buffer_rows"],"SWMR":int(self.log_options["swmr"]),"Schema":self.log_options["schema"],"RecordTraces":int(self.record_traces),"TraceEvery":self.trace_options["every"],"TracePreTrigger":self.trace_options["pre_trigger"],"TracePostTrigger":self.trace_options["post_trigger"],"TraceBufferScans":self.trace_options["buffer_scans"],"TraceCompression":self.trace_options["compression"]}
+
+		for i in range(len(self.lasers)):
+
+			#In the simulation mode there are no lasers, so the wavelength used by the lock is saved.
+			if self.simulate:
+				wvl=self.lock.get_slave_wavelength(i)
+			else:
+				wvl=self.lasers[i].get_set_wavelength()
+
+			settings["LASER"+str(i+1)]={"LockpointR":self.lock.slave_lockpoints[i],"LockpointMHz":self.lock.get_laser_lockpoint(i),"Wavelength":wvl,"PeakCriterion":self.transfer_lock.slave_peak_crits[i],"LockThreshold":self.transfer_lock.slave_rms_crits[i],"PGain":self.lock.prop_gain[i+1],"IGain":self.lock.int_gain[i+1],"MinVoltage":self.transfer_lock.daq_tasks.ao_laser.mn_voltages[i],"MaxVoltage":self.transfer_lock.daq_tasks.ao_laser.mx_voltages[i],"SetVoltage":self.transfer_lock.daq_tasks.ao_laser.voltages[i],"InputChannel":channel_number(self.transfer_lock.daq_tasks.get_laser_ai_channel(i)),"OutputChannel":channel_number(self.transfer_lock.daq_tasks.get_laser_ao_channel(i)),"PowerChannel":channel_number(self.transfer_lock.daq_tasks.get_laser_power_channel(i))}
+
+		#Parameters of the simulated cavity (if the simulated backend is used).
+		if backend.settings() is not None:
+			settings["SIMULATION"]=backend.settings()
+
+		return settings
+
+
+	#In the separate process mode, changes made by the user are also sent to the control process.
+	def forward(self,target,name,*args):
+		if self.control_process is not None:
+			self.control_process.send(target,name,*args)
+
+
+	#Same as above, but for attributes (or elements of list attributes, if "ind" is given).
+	def forward_set(self,target,name,value,ind=None):
+		if self.control_process is not None:
+			if ind is None:
+				self.control_process.set(target,name,value)
+			else:
+				self.control_process.set_item(target,name,ind,value)
 
 
 
@@ -1925,6 +1977,110 @@ class TransferCavity:
 			self.adset_window=None
 
 	
+	"""
+	The method below opens a small window with diagnostics of the scan loop. For every measured stage (of both
+	the DAQ and the processing in TransferLock) it shows the number of measurements, median (p50), 99th percentile
+	and maximum duration. The table is refreshed every 500ms as long as the window is open. The histograms can be 
+	reset or saved to a text file.
+	"""
+	def open_diagnostics(self):
+
+		if self.diag_window is not None:
+			self.diag_window.lift()
+			return
+
+		self.diag_window=Toplevel(self.parent,bg=bg_color)
+		self.diag_window.title("Scan loop diagnostics")
+		self.diag_window.bind("<Escape>",self.cancel_diagnostics)
+		self.diag_window.protocol("WM_DELETE_WINDOW",self.cancel_diagnostics)
+
+		self.diag_window.grid_columnconfigure(0,minsize=10)
+		self.diag_window.grid_columnconfigure(2,minsize=10)
+		self.diag_window.grid_rowconfigure(0,minsize=10)
+		self.diag_window.grid_rowconfigure(2,minsize=10)
+		self.diag_window.grid_rowconfigure(4,minsize=10)
+
+		self.diag_text=Label(self.diag_window,text="",font="Courier 10",justify=LEFT,bg=bg_color,fg=inftext_color)
+		self.diag_text.grid(row=1,column=1,sticky=W)
+
+		diag_buttons=Frame(self.diag_window,bg=bg_color)
+		diag_buttons.grid(row=3,column=1)
+		diag_buttons.grid_columnconfigure(1,minsize=10)
+
+		Button(diag_buttons,command=self.reset_diagnostics,text="Reset",font="Arial 10 bold",width=12,bg=button_bg_color,fg=label_fg_color).grid(row=0,column=0)
+		Button(diag_buttons,command=self.dump_diagnostics,text="Save to file",font="Arial 10 bold",width=12,bg=button_bg_color,fg=label_fg_color).grid(row=0,column=2)
+
+		self.refresh_diagnostics()
+
+
+	def refresh_diagnostics(self):
+
+		if self.diag_window is None:
+			return
+
+		lines=['{:<20}{:>9}{:>11}{:>11}{:>11}'.format('Stage','Count','p50 [us]','p99 [us]','max [us]')]
+		for name,n,mean,p50,p99,mx in self.transfer_lock.profiler.summary():
+			lines.append('{:<20}{:>9}{:>11.1f}{:>11.1f}{:>11.1f}'.format(name,n,p50,p99,mx))
+
+		#Updates of widgets posted by the worker threads and updates actually applied after coalescing.
+		lines.append('')
+		lines.append('{:<20}{:>9}'.format('GUI posted',self.gui_bus.posted))
+		lines.append('{:<20}{:>9}'.format('GUI applied',self.gui_bus.applied))
+
+		if self.transfer_lock.daq_tasks.continuous:
+			lines.append('{:<20}{:>9}'.format('Skipped ramps',self.transfer_lock.daq_tasks.skipped_ramps))
+			lines.append('{:<20}{:>9}'.format('Missing ramps',self.transfer_lock.daq_tasks.missing_ramps))
+		lines.append('{:<20}{:>9}'.format('Skipped scans',self.transfer_lock.daq_tasks.total_skipped))
+		lines.append('{:<20}{:>9}'.format('Overruns',self.transfer_lock.daq_tasks.overruns))
+
+		#Buffers of the log writers: rows dropped because a buffer was full and the highest fill (in rows).
+		for name,writer in [('Log M',self.master_log)]+[('Log S'+str(i+1),w) for i,w in enumerate(self.slave_logs)]:
+			if writer is not None:
+				lines.append('{:<20}{:>9}{:>11}'.format(name+' dropped/max',writer.dropped,writer.buffer.high_water))
+		if self.trace_recorder is not None:
+			lines.append('{:<20}{:>9}{:>11}'.format('Traces dropped/max',self.trace_recorder.dropped,self.trace_recorder.buffer.high_water))
+			lines.append('{:<20}{:>9}'.format('Trace triggers',self.trace_recorder.triggers))
+
+		#Statistics of the fixed cadence are shown only if the target period is set.
+		if self.transfer_lock.target_period>0:
+			lines.append('')
+			lines.append('Target period: {:.2f} ms'.format(1000*self.transfer_lock.target_period))
+			for key,val in self.transfer_lock.cadence.summary().items():
+				if isinstance(val,int):
+					lines.append('{:<20}{:>9}'.format(key,val))
+				else:
+					lines.append('{:<20}{:>9.3f} ms'.format(key,val))
+		self.diag_text.config(text="\n".join(lines))
+
+		self.parent.after(500,self.refresh_diagnostics)
+
+
+	def reset_diagnostics(self):
+		self.transfer_lock.profiler.reset()
+		self.transfer_lock.cadence.reset()
+
+
+	def dump_diagnostics(self):
+		flname=filedialog.asksaveasfilename(initialdir = os.path.dirname(os.path.realpath(__file__))+"/logs",title = "Select file",filetypes = (("Text files","*.txt"),))
+
+		if flname!="":
+			if flname[-4:]!=".txt":
+				flname+=".txt"
+			if self.transfer_lock.target_period>0:
+				self.transfer_lock.profiler.dump(flname,extra=self.transfer_lock.cadence.summary())
+			else:
+				self.transfer_lock.profiler.dump(flname)
+
+		if self.diag_window is not None:
+			self.diag_window.focus_force()
+
+
+	def cancel_diagnostics(self,event=None):
+		if self.diag_window is not None:
+			self.diag_window.destroy()
+			self.diag_window=None
+
+
 	#Function that destroys the channel selection window if Cancel button is clicked (or Esc key)
 	def cancel_daqtop(self,event=None):
 		if self.daqset_window is not None:
@@ -1990,6 +2146,7 @@ class TransferCavity:
 			try:
 				fsr=float(self.new_fsr.get())
 				self.lock.set_FSR(fsr)
+				self.forward('lock','set_FSR',fsr)
 			except ValueError:
 				fsr=None
 						
@@ -2011,28 +2168,34 @@ class TransferCavity:
 					self.transfer_lock.daq_tasks.ao_scan.configure_voltage_boundaries(mnv,mxv)
 				else:
 					self.transfer_lock.daq_tasks.ao_scan.configure_voltage_boundaries(mnv,self.transfer_lock.daq_tasks.ao_scan.mx_voltage)
+			if mnv is not None or mxv is not None:
+				self.forward('ao_scan','configure_voltage_boundaries',self.transfer_lock.daq_tasks.ao_scan.mn_voltage,self.transfer_lock.daq_tasks.ao_scan.mx_voltage)
 
 			try:
 				mwv=float(self.new_master_wv.get())
 				self.lock.set_master_frequency(mwv)
+				self.forward('lock','set_master_frequency',mwv)
 			except ValueError:
 				mwv=None
 
 			try:
 				rmt=float(self.new_rms_thr.get())
 				self.transfer_lock.master_rms_crit=rmt
+				self.forward_set('transfer_lock','master_rms_crit',rmt)
 			except ValueError:
 				pass
 
 			try:
 				rmp=float(self.new_rms_points.get())
-				self.transfer_lock.rms_points=rmp
+				self.transfer_lock.set_rms_points(rmp)
+				self.forward('transfer_lock','set_rms_points',rmp)
 			except ValueError:
 				pass
 
 			try:
 				npc=float(self.new_peak_crit.get())
 				self.transfer_lock.master_peak_crit=npc
+				self.forward_set('transfer_lock','master_peak_crit',npc)
 			except ValueError:
 				pass
 
@@ -2042,6 +2205,7 @@ class TransferCavity:
 			"""
 			if mwv is not None or fsr is not None:
 				self.lock.update_slave_FSRs()
+				self.forward('lock','update_slave_FSRs')
 				for i in range(2):
 					self.laser_lckp[i].config(text='{:.0f}'.format(self.lock.get_laser_lockpoint(i)))
 					self.adj_fsr[i].config(text='{:.1f}'.format(1000*self.lock._slave_FSR[i]))
@@ -2075,23 +2239,28 @@ class TransferCavity:
 					self.transfer_lock.daq_tasks.ao_laser.configure_voltage_boundary(mnv,mxv,ind)
 				else:
 					self.transfer_lock.daq_tasks.ao_laser.configure_voltage_boundary(mnv,self.transfer_lock.daq_tasks.ao_laser.mx_voltages[ind],ind)
+			if mnv is not None or mxv is not None:
+				self.forward('ao_laser','configure_voltage_boundary',self.transfer_lock.daq_tasks.ao_laser.mn_voltages[ind],self.transfer_lock.daq_tasks.ao_laser.mx_voltages[ind],ind)
 
 
 			try:
 				swv=float(self.new_laser_wv.get())
 				self.lock.set_slave_frequency(swv,ind)
+				self.forward('lock','set_slave_frequency',swv,ind)
 			except ValueError:
 				swv=None
 
 			try:
 				rmt=float(self.new_rms_thr.get())
 				self.transfer_lock.slave_rms_crits[ind]=rmt
+				self.forward_set('transfer_lock','slave_rms_crits',rmt,ind)
 			except ValueError:
 				pass
 
 			try:
 				npc=float(self.new_peak_crit.get())
 				self.transfer_lock.slave_peak_crits[ind]=npc
+				self.forward_set('transfer_lock','slave_peak_crits',npc,ind)
 			except ValueError:
 				pass
 
@@ -2154,13 +2323,21 @@ class TransferCavity:
 	#Analogical method for the cavity/scan settings. 
 	def default_adset(self):
 		if self.adset_window is not None:
-			self.lock.set_FSR(1000*float(self.default_cfg['CAVITY']['FSR']))
-			self.lock.set_master_frequency(float(self.default_cfg['CAVITY']['Wavelength']))
-			self.transfer_lock.master_rms_crit=float(self.default_cfg['CAVITY']['LockThreshold'])
-			self.transfer_lock.rms_points=int(self.default_cfg['CAVITY']['RMS'])
+			cav=self.default_cfg['CAVITY']
+			self.lock.set_FSR(1000*float(cav['FSR']))
+			self.forward('lock','set_FSR',1000*float(cav['FSR']))
+			self.lock.set_master_frequency(float(cav['Wavelength']))
+			self.forward('lock','set_master_frequency',float(cav['Wavelength']))
+			self.transfer_lock.master_rms_crit=float(cav['LockThreshold'])
+			self.forward_set('transfer_lock','master_rms_crit',float(cav['LockThreshold']))
+			self.transfer_lock.set_rms_points(int(cav['RMS']))
+			self.forward('transfer_lock','set_rms_points',int(cav['RMS']))
 			self.lock.update_slave_FSRs()
-			self.transfer_lock.master_peak_crit=float(self.default_cfg['CAVITY']['PeakCriterion'])
-			self.transfer_lock.daq_tasks.ao_scan.configure_voltage_boundaries(float(self.default_cfg['CAVITY']['MinVoltage']),float(self.default_cfg['CAVITY']['MaxVoltage']))
+			self.forward('lock','update_slave_FSRs')
+			self.transfer_lock.master_peak_crit=float(cav['PeakCriterion'])
+			self.forward_set('transfer_lock','master_peak_crit',float(cav['PeakCriterion']))
+			self.transfer_lock.daq_tasks.ao_scan.configure_voltage_boundaries(float(cav['MinVoltage']),float(cav['MaxVoltage']))
+			self.forward('ao_scan','configure_voltage_boundaries',float(cav['MinVoltage']),float(cav['MaxVoltage']))
 
 			self.adset_window.destroy()
 			self.adset_window=None
@@ -2169,10 +2346,15 @@ class TransferCavity:
 	#And a similar method for laser settings.
 	def default_las_adset(self,ind):
 		if self.adset_window is not None:
+			las=self.default_cfg["LASER"+str(ind+1)]
 			self.lock.slave_freqs[ind]=self.lock._def_slave_freqs[ind]
-			self.transfer_lock.slave_rms_crits[ind]=float(self.default_cfg["LASER"+str(ind+1)]['LockThreshold'])
-			self.transfer_lock.slave_peak_crits[ind]=float(self.default_cfg["LASER"+str(ind+1)]['PeakCriterion'])
-			self.transfer_lock.daq_tasks.ao_laser.configure_voltage_boundary(float(self.default_cfg["LASER"+str(ind+1)]['MinVoltage']),float(self.default_cfg["LASER"+str(ind+1)]['MaxVoltage']),ind)
+			self.forward_set('lock','slave_freqs',self.lock._def_slave_freqs[ind],ind)
+			self.transfer_lock.slave_rms_crits[ind]=float(las['LockThreshold'])
+			self.forward_set('transfer_lock','slave_rms_crits',float(las['LockThreshold']),ind)
+			self.transfer_lock.slave_peak_crits[ind]=float(las['PeakCriterion'])
+			self.forward_set('transfer_lock','slave_peak_crits',float(las['PeakCriterion']),ind)
+			self.transfer_lock.daq_tasks.ao_laser.configure_voltage_boundary(float(las['MinVoltage']),float(las['MaxVoltage']),ind)
+			self.forward('ao_laser','configure_voltage_boundary',float(las['MinVoltage']),float(las['MaxVoltage']),ind)
 			self.adset_window.destroy()
 			self.adset_window=None
 
@@ -2223,6 +2405,7 @@ class TransferCavity:
 		try:
 			sc_off=float(self.scan_off.get())
 			self.transfer_lock.daq_tasks.ao_scan.set_offset(sc_off)
+			self.forward('ao_scan','set_offset',sc_off)
 			self.real_scoff.config(text='{:.2f}'.format(self.transfer_lock.daq_tasks.ao_scan.offset))
 
 		except ValueError:
@@ -2232,12 +2415,14 @@ class TransferCavity:
 	#Special function to move the scan offset only.
 	def move_scan_offset(self,x):
 		self.transfer_lock.daq_tasks.ao_scan.move_offset(x)
+		self.forward('ao_scan','move_offset',x)
 		self.real_scoff.config(text='{:.2f}'.format(self.transfer_lock.daq_tasks.ao_scan.offset))
 
 
 	#Method moving the cavity lock (of the master laser)
 	def move_master_lck(self,num):
 		self.lock.move_master_lockpoint(num)
+		self.forward('lock','move_master_lockpoint',num)
 		self.real_lckp.config(text='{:.1f}'.format(self.lock.master_lockpoint))
 
 
@@ -2245,6 +2430,7 @@ class TransferCavity:
 	def move_slave_lck(self,num,ind):
 		if self.lock is not None:
 			self.lock.move_laser_lockpoint(num,ind)
+			self.forward('lock','move_laser_lockpoint',num,ind)
 			self.laser_lckp[ind].config(text='{:.0f}'.format(-self.lock.get_laser_lockpoint(ind)))
 			self.laser_r_lckp[ind].config(text="{:.3f}".format(self.lock.slave_lockpoints[ind]))
 
@@ -2260,6 +2446,7 @@ class TransferCavity:
 			self.engage_lock_button.config(text="Disengage Lock",command=self.disengage_cavity_lock)
 
 			self.transfer_lock.master_lock_engaged=True
+			self.forward_set('transfer_lock','master_lock_engaged',True)
 
 			#If error logging is checked, we create an empty array.
 			if self.cav_err_log.get():
@@ -2267,25 +2454,15 @@ class TransferCavity:
 				if self.mlog_filename is None:
 					self.mlog_filename=self.mlog_default_directory+"logM"+datetime.datetime.fromtimestamp(time()).strftime('-%Y-%m-%d-%H.%M.%S')+".hdf5"
 
-				with h5py.File(self.mlog_filename,'a') as f:
-					f.create_dataset('Errors',(1,),maxshape=(None,),dtype='float32')
-					f.create_dataset('Time',(1,),maxshape=(None,),dtype='float32')
-					f.attrs['Lockpoint']=self.lock.master_lockpoint
-					f.attrs['ScanAmplitude']=self.transfer_lock.daq_tasks.ao_scan.amplitude
-					f.attrs['ScanTime']=self.transfer_lock.daq_tasks.ao_scan.scan_time
-					f.attrs['Samples']=self.transfer_lock.daq_tasks.ao_scan.n_samples
-					f.attrs['SamplingRate']=self.transfer_lock.daq_tasks.ao_scan.sample_rate
+				attrs={'Lockpoint':self.lock.master_lockpoint,'ScanAmplitude':self.transfer_lock.daq_tasks.ao_scan.amplitude,'ScanTime':self.transfer_lock.daq_tasks.ao_scan.scan_time,'Samples':self.transfer_lock.daq_tasks.ao_scan.n_samples,'SamplingRate':self.transfer_lock.daq_tasks.ao_scan.sample_rate}
 
-				self.master_error_temp=queue.Queue()
-				self.master_time_temp=queue.Queue()
+				self.master_log=HDF5LogWriter(self.mlog_filename,MASTER_LOG_FIELDS,attrs=attrs,**self.log_options)
+				self.master_log.start()
 
-				self.mt_start=time()
+				self.mt_start=self.master_log.start_time
 
 				self.transfer_lock._master_counter=0
 
-				if not self.master_logging_flag.is_set():
-					self.start_master_logging_thread()
-
 				self.master_logging_set=True
 
 		
@@ -2295,81 +2472,79 @@ class TransferCavity:
 
 		if self.running and self.transfer_lock.master_lock_engaged:
 
-			self.las_err_log_check[ind].config(state="disabled")
+			self.gui_bus.config(self.las_err_log_check[ind],state="disabled")
 
-			self.laser_lock_state[ind].config(text="Engaged",fg=on_color)
+			self.gui_bus.config(self.laser_lock_state[ind],text="Engaged",fg=on_color)
 
 			self.lock.slave_sectors[ind]=0
+			self.forward_set('lock','slave_sectors',0,ind)
 
 			self.transfer_lock.slave_locks_engaged[ind]=True
+			self.forward_set('transfer_lock','slave_locks_engaged',True,ind)
 
 
 			if not sweep:
-				self.sweep_start_entry[ind].config(state="disabled")
-				self.sweep_stop_entry[ind].config(state="disabled")
-				self.sweep_step_entry[ind].config(state="disabled")
-				try:
-					self.sweep_wait_entry[ind].config(state="disabled")
-				except:
-					self.sweep_speed_entry[ind].config(state="disabled")
-				self.sweep_type_entry[ind].config(state="disabled")
-				self.sw_button[ind].config(state="disabled")
-				self.set_volt[ind].config(state="disabled")
-				self.new_volt_entry[ind].config(state="disabled")
-				self.engage_laser_lock_button[ind].config(text="Disengage Lock",command=lambda x=ind: self.disengage_laser_lock(x))
+				self.gui_bus.config(self.sweep_start_entry[ind],state="disabled")
+				self.gui_bus.config(self.sweep_stop_entry[ind],state="disabled")
+				self.gui_bus.config(self.sweep_step_entry[ind],state="disabled")
+				#Only one of these widgets exists at a time (see sweep_type_change).
+				if self.sweep_type[ind].get()=="Discrete":
+					self.gui_bus.config(self.sweep_wait_entry[ind],state="disabled")
+				else:
+					self.gui_bus.config(self.sweep_speed_entry[ind],state="disabled")
+				self.gui_bus.config(self.sweep_type_entry[ind],state="disabled")
+				self.gui_bus.config(self.sw_button[ind],state="disabled")
+				self.gui_bus.config(self.set_volt[ind],state="disabled")
+				self.gui_bus.config(self.new_volt_entry[ind],state="disabled")
+				self.gui_bus.config(self.engage_laser_lock_button[ind],text="Disengage Lock",command=lambda x=ind: self.disengage_laser_lock(x))
 
 			if self.las_err_log[ind].get():
 
 				if self.laslog_filenames[ind] is None:
 					self.laslog_filenames[ind]=self.laslog_default_directories[ind]+"logS"+datetime.datetime.fromtimestamp(time()).strftime('-%Y-%m-%d-%H.%M.%S')+".hdf5"
 
-				with h5py.File(self.laslog_filenames[ind],'a') as f:
-					if not self.simulate:
-						f.attrs['SetFrequency']=self.lasers[ind].get_set_frequency()
-				
-					f.create_dataset('Errors',(1,),maxshape=(None,),dtype='float32')
-					f.create_dataset('Time',(1,),maxshape=(None,),dtype='float32')
-					f.create_dataset('RealFrequency',(1,),maxshape=(None,),dtype='float32')
-					f.create_dataset('LockFrequency',(1,),maxshape=(None,),dtype='float32')
-					f.create_dataset('RealR',(1,),maxshape=(None,),dtype='float32')
-					f.create_dataset('LockR',(1,),maxshape=(None,),dtype='float32')
-					f.create_dataset('Power',(1,),maxshape=(None,),dtype='float32')
-					f.create_dataset('WvmFrequency',(1,),maxshape=(None,),dtype='float64')
+				attrs={}
+				if not self.simulate:
+					attrs['SetFrequency']=self.lasers[ind].get_set_frequency()
 
+				self.slave_logs[ind]=HDF5LogWriter(self.laslog_filenames[ind],SLAVE_LOG_FIELDS,attrs=attrs,**self.log_options)
+				self.slave_logs[ind].start()
 				
-				self.slave_err_temp[ind]=queue.Queue()
-				self.slave_time_temp[ind]=queue.Queue()
-				self.slave_rfreq_temp[ind]=queue.Queue()
-				self.slave_lfreq_temp[ind]=queue.Queue()
-				self.slave_rr_temp[ind]=queue.Queue()
-				self.slave_lr_temp[ind]=queue.Queue()
-				self.slave_pow_temp[ind]=queue.Queue()
-				self.slave_wvmfreq_temp[ind]=queue.Queue()
-				
-				self.lt_start[ind]=time()
+				self.lt_start[ind]=self.slave_logs[ind].start_time
 
 				self.transfer_lock._slave_counters[ind]=0
 
-				if not self.slave_logging_flag[ind].is_set():
-					self.start_slave_logging_thread(ind)
-
 				self.laser_logging_set[ind]=True
 
 
 
 
-	def start_master_logging_thread(self):
+	#Closing the log files that are still open (e.g. when the program is closed with the locks engaged).
+	def close_logs(self):
+		self.master_logging_set=False
+		self.laser_logging_set=[False,False]
+		for writer in [self.master_log]+self.slave_logs:
+			if writer is not None:
+				writer.close()
+		self.master_log=None
+		self.slave_logs=[None,None]
+		self.stop_trace_recording()
 
-		self.master_logging_flag.set()
-		self.master_logging_thread=threading.Thread(target=self.transfer_lock.master_logging_loop,kwargs={"GUI_object":self})
-		self.master_logging_thread.start()
 
-	def start_slave_logging_thread(self,ind):
+	#Trace recording is started with the scan (if enabled in the config); every run is saved to a new file.
+	def start_trace_recording(self):
+		filename=self.mlog_default_directory+"traces"+datetime.datetime.fromtimestamp(time()).strftime('-%Y-%m-%d-%H.%M.%S')+".hdf5"
+		wavelengths=[self.lock.get_slave_wavelength(i) for i in range(len(self.lock.slave_freqs))]
+		self.trace_recorder=TraceRecorder(filename,self.transfer_lock.daq_tasks,attrs={'SlaveWavelengths':wavelengths,'PGains':self.lock.prop_gain,'IGains':self.lock.int_gain},**self.trace_options)
+		self.trace_recorder.start()
+		self.transfer_lock.trace_recorder=self.trace_recorder
 
 
-		self.slave_logging_flag[ind].set()
-		self.slave_logging_thread[ind]=threading.Thread(target=self.transfer_lock.slave_logging_loop,kwargs={"GUI_object":self,"ind":ind})
-		self.slave_logging_thread[ind].start()
+	def stop_trace_recording(self):
+		self.transfer_lock.trace_recorder=None
+		if self.trace_recorder is not None:
+			self.trace_recorder.close()
+			self.trace_recorder=None
 
 
 	"""
@@ -2380,6 +2555,7 @@ class TransferCavity:
 
 		self.master_locked_flag=False
 		self.transfer_lock.master_lock_engaged=False
+		self.forward_set('transfer_lock','master_lock_engaged',False)
 
 		self.cav_err_log_check.config(state="normal")
 
@@ -2388,39 +2564,15 @@ class TransferCavity:
 
 		
 		#Some parameters are reset
-		self.transfer_lock.master_err_history=deque(maxlen=self.transfer_lock._err_data_length)
-		self.transfer_lock.master_err_history.append(0)
-		self.transfer_lock.master_err_rms=0
-		self.lock.master_err=0
-		self.lock.master_err_prev=0
-		self.lock.master_ctrl=0
+		self.transfer_lock.reset_master_error()
+		self.forward('transfer_lock','reset_master_error')
 		self.rms_cav.config(text="0")
 
 		#If error signal logging was checked, the hdf5 file is closed.
-		if self.cav_err_log.get():
+		if self.cav_err_log.get() and self.master_log is not None:
 			self.master_logging_set=False
-			self.master_logging_flag.clear()
-
-			with h5py.File(self.mlog_filename,'a') as f:
-
-				queue_length=len(list(self.master_error_temp.queue))
-				dataset_length=f['Errors'].shape[0]
-
-				if dataset_length==1:
-					f['Errors'].resize(queue_length,axis=0)
-					f['Time'].resize(queue_length,axis=0)
-				else:
-					f['Errors'].resize(dataset_length+queue_length,axis=0)
-					f['Time'].resize(dataset_length+queue_length,axis=0)
-				
-				f['Errors'][-queue_length:]=list(self.master_error_temp.queue)
-				f['Time'][-queue_length:]=list(self.master_time_temp.queue)
-
-
-				try:
-					f['Errors'][0]=f['Errors'][1]
-				except:
-					pass
+			self.master_log.close()
+			self.master_log=None
 
 
 		
@@ -2438,91 +2590,42 @@ class TransferCavity:
 	def disengage_laser_lock(self,ind,sweep=False):
 
 		self.transfer_lock.slave_locks_engaged[ind]=False
-		self.transfer_lock.slave_locked_flags[ind].clear()
+		self.forward_set('transfer_lock','slave_locks_engaged',False,ind)
 
-		self.las_err_log_check[ind].config(state="normal")
+		self.gui_bus.config(self.las_err_log_check[ind],state="normal")
 
-		self.laser_lock_state[ind].config(text="Disengaged",fg=off_color)
+		self.gui_bus.config(self.laser_lock_state[ind],text="Disengaged",fg=off_color)
 
 
-		self.laser_lock_status_cv[ind].itemconfig(self.laser_lock_status[ind],fill=off_color)
+		self.gui_bus.itemconfig(self.laser_lock_status_cv[ind],self.laser_lock_status[ind],fill=off_color)
 
-		self.transfer_lock.slave_err_history[ind]=deque(maxlen=self.transfer_lock._err_data_length)
-		self.transfer_lock.slave_err_history[ind].append(0)
-		self.transfer_lock.slave_err_rms[ind]=0
-		self.lock.slave_errs[ind]=0
-		self.lock.slave_errs_prev[ind]=0
-		self.lock.slave_ctrls[ind]=0
-		self.rms_laser[ind].config(text="0")
+		self.transfer_lock.reset_slave_error(ind)
+		self.forward('transfer_lock','reset_slave_error',ind)
+		self.gui_bus.config(self.rms_laser[ind],text="0")
 
 
 
 		if not sweep:
-			self.sweep_start_entry[ind].config(state="normal")
-			self.sweep_stop_entry[ind].config(state="normal")
+			self.gui_bus.config(self.sweep_start_entry[ind],state="normal")
+			self.gui_bus.config(self.sweep_stop_entry[ind],state="normal")
 			if self.sweep_type[ind].get()=="Discrete":
-				self.sweep_step_entry[ind].config(state="normal")
-			try:
-				self.sweep_wait_entry[ind].config(state="normal")
-			except:
-				self.sweep_speed_entry[ind].config(state="normal")
-			self.sweep_type_entry[ind].config(state="normal")
-			self.sw_button[ind].config(state="normal")
-			self.set_volt[ind].config(state="normal")
-			self.new_volt_entry[ind].config(state="normal")
-			self.engage_laser_lock_button[ind].config(text="Engage Lock",command=lambda x=ind:self.engage_laser_lock(x))
+				self.gui_bus.config(self.sweep_step_entry[ind],state="normal")
+			#Only one of these widgets exists at a time (see sweep_type_change).
+			if self.sweep_type[ind].get()=="Discrete":
+				self.gui_bus.config(self.sweep_wait_entry[ind],state="normal")
+			else:
+				self.gui_bus.config(self.sweep_speed_entry[ind],state="normal")
+			self.gui_bus.config(self.sweep_type_entry[ind],state="normal")
+			self.gui_bus.config(self.sw_button[ind],state="normal")
+			self.gui_bus.config(self.set_volt[ind],state="normal")
+			self.gui_bus.config(self.new_volt_entry[ind],state="normal")
+			self.gui_bus.config(self.engage_laser_lock_button[ind],text="Engage Lock",command=lambda x=ind:self.engage_laser_lock(x))
 
 		#Again, error signal is logged if the option was chosen.
-		if self.las_err_log[ind].get():
+		if self.las_err_log[ind].get() and self.slave_logs[ind] is not None:
 			self.laser_logging_set[ind]=False
-			self.slave_logging_flag[ind].clear()
-
-			with h5py.File(self.laslog_filenames[ind],'a') as f:
-
-				queue_length=len(list(self.slave_err_temp[ind].queue))
-				dataset_length=f['Errors'].shape[0]
-
-				if dataset_length==1:
-					f['Errors'].resize(queue_length,axis=0)
-					f['Time'].resize(queue_length,axis=0)
-					f['RealFrequency'].resize(queue_length,axis=0)
-					f['LockFrequency'].resize(queue_length,axis=0)
-					f['RealR'].resize(queue_length,axis=0)
-					f['LockR'].resize(queue_length,axis=0)
-					f['Power'].resize(queue_length,axis=0)
-					f['WvmFrequency'].resize(queue_length,axis=0)
-
-				else:
-					f['Errors'].resize(dataset_length+queue_length,axis=0)
-					f['Time'].resize(dataset_length+queue_length,axis=0)
-					f['RealFrequency'].resize(dataset_length+queue_length,axis=0)
-					f['LockFrequency'].resize(dataset_length+queue_length,axis=0)
-					f['RealR'].resize(dataset_length+queue_length,axis=0)
-					f['LockR'].resize(dataset_length+queue_length,axis=0)
-					f['Power'].resize(dataset_length+queue_length,axis=0)
-					f['WvmFrequency'].resize(dataset_length+queue_length,axis=0)
-
-				f['Errors'][-queue_length:]=list(self.slave_err_temp[ind].queue)
-				f['Time'][-queue_length:]=list(self.slave_time_temp[ind].queue)
-				f['RealFrequency'][-queue_length:]=list(self.slave_rfreq_temp[ind].queue)
-				f['LockFrequency'][-queue_length:]=list(self.slave_lfreq_temp[ind].queue)
-				f['RealR'][-queue_length:]=list(self.slave_rr_temp[ind].queue)
-				f['LockR'][-queue_length:]=list(self.slave_lr_temp[ind].queue)
-				f['Power'][-queue_length:]=list(self.slave_pow_temp[ind].queue)
-				f['WvmFrequency'][-queue_length:]=list(self.slave_wvmfreq_temp[ind].queue)
-
-				try:
-					f['Errors'][0]=f['Errors'][1]
-					f['Time'][0]=f['Time'][1]
-					f['RealFrequency'][0]=f['RealFrequency'][1]
-					f['LockFrequency'][0]=f['LockFrequency'][1]
-					f['RealR'][0]=f['RealR'][1]
-					f['LockR'][0]=f['LockR'][1]
-					f['Power'][0]=f['Power'][1]
-					f['WvmFrequency'][0]=f['WvmFrequency'][1]
-
-				except:
-					pass
+			self.slave_logs[ind].close()
+			self.slave_logs[ind]=None
 
 
 
@@ -2587,10 +2690,10 @@ class TransferCavity:
 				swstep=abs(float(self.sweep_step[ind].get()))
 				if swstep<1:
 					swstep=1
-					self.sweep_step[ind].set(swstep)
+					self.gui_bus.set_var(self.sweep_step[ind],swstep)
 				elif swstep>upper_bound-lower_bound:
 					swstep=upper_bound-lower_bound
-					self.sweep_step[ind].set(swstep)
+					self.gui_bus.set_var(self.sweep_step[ind],swstep)
 			except ValueError:
 				return
 
@@ -2612,33 +2715,33 @@ class TransferCavity:
 
 
 			#Disabling buttons and entry fields
-			self.update_laser_lock_button[ind].config(state="disabled")
-			self.engage_laser_lock_button[ind].config(state="disabled")
-			self.las_err_log_check[ind].config(state="disabled")
-			self.minus10MHz[ind].config(state="disabled")
-			self.minus5MHz[ind].config(state="disabled")
-			self.minus1MHz[ind].config(state="disabled")
-			self.plus10MHz[ind].config(state="disabled")
-			self.plus5MHz[ind].config(state="disabled")
-			self.plus1MHz[ind].config(state="disabled")
-			self.minus10ms.config(state="disabled")
-			self.minus5ms.config(state="disabled")
-			self.minus1ms.config(state="disabled")
-			self.plus10ms.config(state="disabled")
-			self.plus5ms.config(state="disabled")
-			self.plus1ms.config(state="disabled")
-
-
-			self.sw_button[ind].config(text="Stop",command=lambda: self.stop_sweep(ind))
-			self.run_scan.config(state="disabled")
-			self.update_lock.config(state="disabled")
-			self.engage_lock_button.config(state="disabled")
-			self.set_volt[ind].config(state="disabled")
-			self.new_volt_entry[ind].config(state="disabled")
-			self.sweep_type_entry[ind].config(state="disabled")
-			self.move_offset_p.config(state="disabled")
-			self.move_offset_m.config(state="disabled")
-			self.set_offset.config(state="disabled")
+			self.gui_bus.config(self.update_laser_lock_button[ind],state="disabled")
+			self.gui_bus.config(self.engage_laser_lock_button[ind],state="disabled")
+			self.gui_bus.config(self.las_err_log_check[ind],state="disabled")
+			self.gui_bus.config(self.minus10MHz[ind],state="disabled")
+			self.gui_bus.config(self.minus5MHz[ind],state="disabled")
+			self.gui_bus.config(self.minus1MHz[ind],state="disabled")
+			self.gui_bus.config(self.plus10MHz[ind],state="disabled")
+			self.gui_bus.config(self.plus5MHz[ind],state="disabled")
+			self.gui_bus.config(self.plus1MHz[ind],state="disabled")
+			self.gui_bus.config(self.minus10ms,state="disabled")
+			self.gui_bus.config(self.minus5ms,state="disabled")
+			self.gui_bus.config(self.minus1ms,state="disabled")
+			self.gui_bus.config(self.plus10ms,state="disabled")
+			self.gui_bus.config(self.plus5ms,state="disabled")
+			self.gui_bus.config(self.plus1ms,state="disabled")
+
+
+			self.gui_bus.config(self.sw_button[ind],text="Stop",command=lambda: self.stop_sweep(ind))
+			self.gui_bus.config(self.run_scan,state="disabled")
+			self.gui_bus.config(self.update_lock,state="disabled")
+			self.gui_bus.config(self.engage_lock_button,state="disabled")
+			self.gui_bus.config(self.set_volt[ind],state="disabled")
+			self.gui_bus.config(self.new_volt_entry[ind],state="disabled")
+			self.gui_bus.config(self.sweep_type_entry[ind],state="disabled")
+			self.gui_bus.config(self.move_offset_p,state="disabled")
+			self.gui_bus.config(self.move_offset_m,state="disabled")
+			self.gui_bus.config(self.set_offset,state="disabled")
 
 
 			#Engaging the lock
@@ -2650,82 +2753,83 @@ class TransferCavity:
 			for fr in freqs:
 				if not self.discr_sweep_running[ind]:
 					break
-				self.transfer_lock.slave_locked_flags[ind].clear()
-				self.transfer_lock.slave_lock_counters[ind]=0
+				self.transfer_lock.restart_slave_lock_count(ind)
+				self.forward('transfer_lock','restart_slave_lock_count',ind)
 				self.lock.set_laser_lockpoint(fr,ind)
-				self.current_deviation[ind].config(text="{:.3f}".format(fr)+" MHz")
-				self.current_dev_process[ind].config(text="Locking...")
-				self.laser_lckp[ind].config(text='{:.0f}'.format(-self.lock.get_laser_lockpoint(ind)))
-				self.laser_r_lckp[ind].config(text='{:.3f}'.format(self.lock.slave_lockpoints[ind]))
+				self.forward('lock','set_laser_lockpoint',fr,ind)
+				self.gui_bus.config(self.current_deviation[ind],text="{:.3f}".format(fr)+" MHz")
+				self.gui_bus.config(self.current_dev_process[ind],text="Locking...")
+				self.gui_bus.config(self.laser_lckp[ind],text='{:.0f}'.format(-self.lock.get_laser_lockpoint(ind)))
+				self.gui_bus.config(self.laser_r_lckp[ind],text='{:.3f}'.format(self.lock.slave_lockpoints[ind]))
 
 				self.transfer_lock.slave_locked_flags[ind].wait(60)
 				if not self.transfer_lock.slave_locked_flags[ind].is_set():
 					break
 
-				self.current_dev_process[ind].config(text="Waiting")
+				self.gui_bus.config(self.current_dev_process[ind],text="Waiting")
 
 				sleep(swwait)
 
 				steps_done+=1
-				self.sw_pr_var[ind].set(steps_done/no_steps*100)
+				self.gui_bus.set_var(self.sw_pr_var[ind],steps_done/no_steps*100)
 
 			#Disengage the lock when finished
 			self.disengage_laser_lock(ind,sweep=True)
 
 
 			#Bring back all the fields to normal
-			self.update_laser_lock_button[ind].config(state="normal")
-			self.engage_laser_lock_button[ind].config(state="normal")
-			self.las_err_log_check[ind].config(state="normal")
-			self.minus10MHz[ind].config(state="normal")
-			self.minus5MHz[ind].config(state="normal")
-			self.minus1MHz[ind].config(state="normal")
-			self.plus10MHz[ind].config(state="normal")
-			self.plus5MHz[ind].config(state="normal")
-			self.plus1MHz[ind].config(state="normal")
-			self.set_volt[ind].config(state="normal")
-			self.new_volt_entry[ind].config(state="normal")
-			self.sweep_type_entry[ind].config(state="normal")
+			self.gui_bus.config(self.update_laser_lock_button[ind],state="normal")
+			self.gui_bus.config(self.engage_laser_lock_button[ind],state="normal")
+			self.gui_bus.config(self.las_err_log_check[ind],state="normal")
+			self.gui_bus.config(self.minus10MHz[ind],state="normal")
+			self.gui_bus.config(self.minus5MHz[ind],state="normal")
+			self.gui_bus.config(self.minus1MHz[ind],state="normal")
+			self.gui_bus.config(self.plus10MHz[ind],state="normal")
+			self.gui_bus.config(self.plus5MHz[ind],state="normal")
+			self.gui_bus.config(self.plus1MHz[ind],state="normal")
+			self.gui_bus.config(self.set_volt[ind],state="normal")
+			self.gui_bus.config(self.new_volt_entry[ind],state="normal")
+			self.gui_bus.config(self.sweep_type_entry[ind],state="normal")
 
 
 			if len(self.lasers)>1:
 				if self.discr_sweep_running[1-ind] or self.cont_sweep_running[1-ind]:
 					pass
 				else:
-					self.minus10ms.config(state="normal")
-					self.minus5ms.config(state="normal")
-					self.minus1ms.config(state="normal")
-					self.plus10ms.config(state="normal")
-					self.plus5ms.config(state="normal")
-					self.plus1ms.config(state="normal")
-					self.run_scan.config(state="normal")
-					self.update_lock.config(state="normal")
-					self.engage_lock_button.config(state="normal")
-					self.move_offset_p.config(state="normal")
-					self.move_offset_m.config(state="normal")
-					self.set_offset.config(state="normal")
+					self.gui_bus.config(self.minus10ms,state="normal")
+					self.gui_bus.config(self.minus5ms,state="normal")
+					self.gui_bus.config(self.minus1ms,state="normal")
+					self.gui_bus.config(self.plus10ms,state="normal")
+					self.gui_bus.config(self.plus5ms,state="normal")
+					self.gui_bus.config(self.plus1ms,state="normal")
+					self.gui_bus.config(self.run_scan,state="normal")
+					self.gui_bus.config(self.update_lock,state="normal")
+					self.gui_bus.config(self.engage_lock_button,state="normal")
+					self.gui_bus.config(self.move_offset_p,state="normal")
+					self.gui_bus.config(self.move_offset_m,state="normal")
+					self.gui_bus.config(self.set_offset,state="normal")
 
 			else:
-				self.minus10ms.config(state="normal")
-				self.minus5ms.config(state="normal")
-				self.minus1ms.config(state="normal")
-				self.plus10ms.config(state="normal")
-				self.plus5ms.config(state="normal")
-				self.plus1ms.config(state="normal")
-				self.run_scan.config(state="normal")
-				self.update_lock.config(state="normal")
-				self.engage_lock_button.config(state="normal")
-				self.move_offset_p.config(state="normal")
-				self.move_offset_m.config(state="normal")
-				self.set_offset.config(state="normal")
-
-
-			self.sw_button[ind].config(text="Sweep",command=lambda: self.sweep_laser_th(ind),state="normal")
+				self.gui_bus.config(self.minus10ms,state="normal")
+				self.gui_bus.config(self.minus5ms,state="normal")
+				self.gui_bus.config(self.minus1ms,state="normal")
+				self.gui_bus.config(self.plus10ms,state="normal")
+				self.gui_bus.config(self.plus5ms,state="normal")
+				self.gui_bus.config(self.plus1ms,state="normal")
+				self.gui_bus.config(self.run_scan,state="normal")
+				self.gui_bus.config(self.update_lock,state="normal")
+				self.gui_bus.config(self.engage_lock_button,state="normal")
+				self.gui_bus.config(self.move_offset_p,state="normal")
+				self.gui_bus.config(self.move_offset_m,state="normal")
+				self.gui_bus.config(self.set_offset,state="normal")
+
+
+			self.gui_bus.config(self.sw_button[ind],text="Sweep",command=lambda: self.sweep_laser_th(ind),state="normal")
 			
-			self.sw_pr_var[ind].set(0)
+			self.gui_bus.set_var(self.sw_pr_var[ind],0)
 			
-			self.current_deviation[ind].config(text="")
-			self.current_dev_process[ind].config(text="")
+			self.gui_bus.config(self.current_deviation[ind],text="")
+			self.gui_bus.config(self.current_dev_process[ind],text="")
 
 	
 	#Method invoked when user wants to stop frequency scan
@@ -2774,41 +2878,42 @@ class TransferCavity:
 				increasing=False
 
 			#Disabling buttons and entry fields
-			self.update_laser_lock_button[ind].config(state="disabled")
-			self.engage_laser_lock_button[ind].config(state="disabled")
-			self.las_err_log_check[ind].config(state="disabled")
-			self.minus10MHz[ind].config(state="disabled")
-			self.minus5MHz[ind].config(state="disabled")
-			self.minus1MHz[ind].config(state="disabled")
-			self.plus10MHz[ind].config(state="disabled")
-			self.plus5MHz[ind].config(state="disabled")
-			self.plus1MHz[ind].config(state="disabled")
-			self.minus10ms.config(state="disabled")
-			self.minus5ms.config(state="disabled")
-			self.minus1ms.config(state="disabled")
-			self.plus10ms.config(state="disabled")
-			self.plus5ms.config(state="disabled")
-			self.plus1ms.config(state="disabled")
-
-
-			self.sw_button[ind].config(text="Stop",command=lambda x=ind: self.stop_cont_sweep(x))
-			self.run_scan.config(state="disabled")
-			self.update_lock.config(state="disabled")
-			self.engage_lock_button.config(state="disabled")
-			self.set_volt[ind].config(state="disabled")
-			self.new_volt_entry[ind].config(state="disabled")
-			self.sweep_type_entry[ind].config(state="disabled")
-			self.sweep_speed_entry[ind].config(state="disabled")
-			self.sweep_start_entry[ind].config(state="disabled")
-			self.sweep_stop_entry[ind].config(state="disabled")
-			self.move_offset_p.config(state="disabled")
-			self.move_offset_m.config(state="disabled")
-			self.set_offset.config(state="disabled")
+			self.gui_bus.config(self.update_laser_lock_button[ind],state="disabled")
+			self.gui_bus.config(self.engage_laser_lock_button[ind],state="disabled")
+			self.gui_bus.config(self.las_err_log_check[ind],state="disabled")
+			self.gui_bus.config(self.minus10MHz[ind],state="disabled")
+			self.gui_bus.config(self.minus5MHz[ind],state="disabled")
+			self.gui_bus.config(self.minus1MHz[ind],state="disabled")
+			self.gui_bus.config(self.plus10MHz[ind],state="disabled")
+			self.gui_bus.config(self.plus5MHz[ind],state="disabled")
+			self.gui_bus.config(self.plus1MHz[ind],state="disabled")
+			self.gui_bus.config(self.minus10ms,state="disabled")
+			self.gui_bus.config(self.minus5ms,state="disabled")
+			self.gui_bus.config(self.minus1ms,state="disabled")
+			self.gui_bus.config(self.plus10ms,state="disabled")
+			self.gui_bus.config(self.plus5ms,state="disabled")
+			self.gui_bus.config(self.plus1ms,state="disabled")
+
+
+			self.gui_bus.config(self.sw_button[ind],text="Stop",command=lambda x=ind: self.stop_cont_sweep(x))
+			self.gui_bus.config(self.run_scan,state="disabled")
+			self.gui_bus.config(self.update_lock,state="disabled")
+			self.gui_bus.config(self.engage_lock_button,state="disabled")
+			self.gui_bus.config(self.set_volt[ind],state="disabled")
+			self.gui_bus.config(self.new_volt_entry[ind],state="disabled")
+			self.gui_bus.config(self.sweep_type_entry[ind],state="disabled")
+			self.gui_bus.config(self.sweep_speed_entry[ind],state="disabled")
+			self.gui_bus.config(self.sweep_start_entry[ind],state="disabled")
+			self.gui_bus.config(self.sweep_stop_entry[ind],state="disabled")
+			self.gui_bus.config(self.move_offset_p,state="disabled")
+			self.gui_bus.config(self.move_offset_m,state="disabled")
+			self.gui_bus.config(self.set_offset,state="disabled")
 
 
 			self.lock.set_laser_lockpoint(swstart,ind)
-			self.laser_lckp[ind].config(text='{:.0f}'.format(-self.lock.get_laser_lockpoint(ind)))
-			self.laser_r_lckp[ind].config(text='{:.3f}'.format(self.lock.slave_lockpoints[ind]))
+			self.forward('lock','set_laser_lockpoint',swstart,ind)
+			self.gui_bus.config(self.laser_lckp[ind],text='{:.0f}'.format(-self.lock.get_laser_lockpoint(ind)))
+			self.gui_bus.config(self.laser_r_lckp[ind],text='{:.3f}'.format(self.lock.slave_lockpoints[ind]))
 
 			#Engaging the lock
 			if not self.transfer_lock.slave_locks_engaged[ind]:
@@ -2824,42 +2929,46 @@ class TransferCavity:
 						increasing=False
 						current=upper_bound
 						self.lock.set_laser_lockpoint(upper_bound,ind)
-						self.current_deviation[ind].config(text="{:.3f}".format(current)+" MHz")
-						self.laser_lckp[ind].config(text='{:.0f}'.format(-self.lock.get_laser_lockpoint(ind)))
-						self.laser_r_lckp[ind].config(text='{:.3f}'.format(self.lock.slave_lockpoints[ind]))
-						self.sw_pr_var[ind].set((current-lower_bound)/interval*100)
-						self.transfer_lock.slave_locked_flags[ind].clear()
-						self.transfer_lock.slave_lock_counters[ind]=0
+						self.forward('lock','set_laser_lockpoint',upper_bound,ind)
+						self.gui_bus.config(self.current_deviation[ind],text="{:.3f}".format(current)+" MHz")
+						self.gui_bus.config(self.laser_lckp[ind],text='{:.0f}'.format(-self.lock.get_laser_lockpoint(ind)))
+						self.gui_bus.config(self.laser_r_lckp[ind],text='{:.3f}'.format(self.lock.slave_lockpoints[ind]))
+						self.gui_bus.set_var(self.sw_pr_var[ind],(current-lower_bound)/interval*100)
+						self.transfer_lock.restart_slave_lock_count(ind)
+						self.forward('transfer_lock','restart_slave_lock_count',ind)
 						self.transfer_lock.slave_locked_flags[ind].wait()
 					else:
 						self.lock.move_laser_lockpoint(step,ind)
+						self.forward('lock','move_laser_lockpoint',step,ind)
 						current+=step
 
-					self.current_dev_process[ind].config(text="Increasing")
+					self.gui_bus.config(self.current_dev_process[ind],text="Increasing")
 
 				else:
 					if current-step<lower_bound:
 						increasing=True
 						current=lower_bound
 						self.lock.set_laser_lockpoint(lower_bound,ind)
-						self.current_deviation[ind].config(text="{:.3f}".format(current)+" MHz")
-						self.laser_lckp[ind].config(text='{:.0f}'.format(-self.lock.get_laser_lockpoint(ind)))
-						self.laser_r_lckp[ind].config(text='{:.3f}'.format(self.lock.slave_lockpoints[ind]))
-						self.sw_pr_var[ind].set((current-lower_bound)/interval*100)
-						self.transfer_lock.slave_locked_flags[ind].clear()
-						self.transfer_lock.slave_lock_counters[ind]=0
+						self.forward('lock','set_laser_lockpoint',lower_bound,ind)
+						self.gui_bus.config(self.current_deviation[ind],text="{:.3f}".format(current)+" MHz")
+						self.gui_bus.config(self.laser_lckp[ind],text='{:.0f}'.format(-self.lock.get_laser_lockpoint(ind)))
+						self.gui_bus.config(self.laser_r_lckp[ind],text='{:.3f}'.format(self.lock.slave_lockpoints[ind]))
+						self.gui_bus.set_var(self.sw_pr_var[ind],(current-lower_bound)/interval*100)
+						self.transfer_lock.restart_slave_lock_count(ind)
+						self.forward('transfer_lock','restart_slave_lock_count',ind)
 						self.transfer_lock.slave_locked_flags[ind].wait()
 					else:
 						self.lock.move_laser_lockpoint(-step,ind)
+						self.forward('lock','move_laser_lockpoint',-step,ind)
 						current-=step
 
-					self.current_dev_process[ind].config(text="Decreasing")
+					self.gui_bus.config(self.current_dev_process[ind],text="Decreasing")
 
 
-				self.current_deviation[ind].config(text="{:.3f}".format(current)+" MHz")
-				self.laser_lckp[ind].config(text='{:.0f}'.format(-self.lock.get_laser_lockpoint(ind)))
-				self.laser_r_lckp[ind].config(text='{:.3f}'.format(self.lock.slave_lockpoints[ind]))
-				self.sw_pr_var[ind].set((current-lower_bound)/interval*100)
+				self.gui_bus.config(self.current_deviation[ind],text="{:.3f}".format(current)+" MHz")
+				self.gui_bus.config(self.laser_lckp[ind],text='{:.0f}'.format(-self.lock.get_laser_lockpoint(ind)))
+				self.gui_bus.config(self.laser_r_lckp[ind],text='{:.3f}'.format(self.lock.slave_lockpoints[ind]))
+				self.gui_bus.set_var(self.sw_pr_var[ind],(current-lower_bound)/interval*100)
 
 				sleep(wait)
 
@@ -2869,60 +2978,60 @@ class TransferCavity:
 
 
 			#Bring back all the fields to normal
-			self.update_laser_lock_button[ind].config(state="normal")
-			self.engage_laser_lock_button[ind].config(state="normal")
-			self.las_err_log_check[ind].config(state="normal")
-			self.minus10MHz[ind].config(state="normal")
-			self.minus5MHz[ind].config(state="normal")
-			self.minus1MHz[ind].config(state="normal")
-			self.plus10MHz[ind].config(state="normal")
-			self.plus5MHz[ind].config(state="normal")
-			self.plus1MHz[ind].config(state="normal")
-			self.set_volt[ind].config(state="normal")
-			self.new_volt_entry[ind].config(state="normal")
-			self.sweep_type_entry[ind].config(state="normal")
-			self.sweep_speed_entry[ind].config(state="normal")
-			self.sweep_start_entry[ind].config(state="normal")
-			self.sweep_stop_entry[ind].config(state="normal")
+			self.gui_bus.config(self.update_laser_lock_button[ind],state="normal")
+			self.gui_bus.config(self.engage_laser_lock_button[ind],state="normal")
+			self.gui_bus.config(self.las_err_log_check[ind],state="normal")
+			self.gui_bus.config(self.minus10MHz[ind],state="normal")
+			self.gui_bus.config(self.minus5MHz[ind],state="normal")
+			self.gui_bus.config(self.minus1MHz[ind],state="normal")
+			self.gui_bus.config(self.plus10MHz[ind],state="normal")
+			self.gui_bus.config(self.plus5MHz[ind],state="normal")
+			self.gui_bus.config(self.plus1MHz[ind],state="normal")
+			self.gui_bus.config(self.set_volt[ind],state="normal")
+			self.gui_bus.config(self.new_volt_entry[ind],state="normal")
+			self.gui_bus.config(self.sweep_type_entry[ind],state="normal")
+			self.gui_bus.config(self.sweep_speed_entry[ind],state="normal")
+			self.gui_bus.config(self.sweep_start_entry[ind],state="normal")
+			self.gui_bus.config(self.sweep_stop_entry[ind],state="normal")
 
 			if len(self.lasers)>1:
 				if self.discr_sweep_running[1-ind] or self.cont_sweep_running[1-ind]:
 					pass
 				else:
-					self.minus10ms.config(state="normal")
-					self.minus5ms.config(state="normal")
-					self.minus1ms.config(state="normal")
-					self.plus10ms.config(state="normal")
-					self.plus5ms.config(state="normal")
-					self.plus1ms.config(state="normal")
-					self.run_scan.config(state="normal")
-					self.update_lock.config(state="normal")
-					self.engage_lock_button.config(state="normal")
-					self.move_offset_p.config(state="normal")
-					self.move_offset_m.config(state="normal")
-					self.set_offset.config(state="normal")
+					self.gui_bus.config(self.minus10ms,state="normal")
+					self.gui_bus.config(self.minus5ms,state="normal")
+					self.gui_bus.config(self.minus1ms,state="normal")
+					self.gui_bus.config(self.plus10ms,state="normal")
+					self.gui_bus.config(self.plus5ms,state="normal")
+					self.gui_bus.config(self.plus1ms,state="normal")
+					self.gui_bus.config(self.run_scan,state="normal")
+					self.gui_bus.config(self.update_lock,state="normal")
+					self.gui_bus.config(self.engage_lock_button,state="normal")
+					self.gui_bus.config(self.move_offset_p,state="normal")
+					self.gui_bus.config(self.move_offset_m,state="normal")
+					self.gui_bus.config(self.set_offset,state="normal")
 
 			else:
-				self.minus10ms.config(state="normal")
-				self.minus5ms.config(state="normal")
-				self.minus1ms.config(state="normal")
-				self.plus10ms.config(state="normal")
-				self.plus5ms.config(state="normal")
-				self.plus1ms.config(state="normal")
-				self.run_scan.config(state="normal")
-				self.update_lock.config(state="normal")
-				self.engage_lock_button.config(state="normal")
-				self.move_offset_p.config(state="normal")
-				self.move_offset_m.config(state="normal")
-				self.set_offset.config(state="normal")
-
-
-			self.sw_button[ind].config(text="Sweep",command=lambda: self.conitnuous_sweep_th(ind),state="normal")
+				self.gui_bus.config(self.minus10ms,state="normal")
+				self.gui_bus.config(self.minus5ms,state="normal")
+				self.gui_bus.config(self.minus1ms,state="normal")
+				self.gui_bus.config(self.plus10ms,state="normal")
+				self.gui_bus.config(self.plus5ms,state="normal")
+				self.gui_bus.config(self.plus1ms,state="normal")
+				self.gui_bus.config(self.run_scan,state="normal")
+				self.gui_bus.config(self.update_lock,state="normal")
+				self.gui_bus.config(self.engage_lock_button,state="normal")
+				self.gui_bus.config(self.move_offset_p,state="normal")
+				self.gui_bus.config(self.move_offset_m,state="normal")
+				self.gui_bus.config(self.set_offset,state="normal")
+
+
+			self.gui_bus.config(self.sw_button[ind],text="Sweep",command=lambda: self.conitnuous_sweep_th(ind),state="normal")
 			
-			self.sw_pr_var[ind].set(0)
+			self.gui_bus.set_var(self.sw_pr_var[ind],0)
 			
-			self.current_deviation[ind].config(text="")
-			self.current_dev_process[ind].config(text="")
+			self.gui_bus.config(self.current_deviation[ind],text="")
+			self.gui_bus.config(self.current_dev_process[ind],text="")
 
 	
 	#Method invoked when user wants to stop frequency scan
@@ -2978,43 +3087,43 @@ class TransferCavity:
 					f_dict=f_dict[1]
 				
 			except Exception as e:
-				self.IP_label.config(text=self.host_ip,fg=off_color)
-				self.port_label.config(text=self.wvm_port,fg=off_color)
+				self.gui_bus.config(self.IP_label,text=self.host_ip,fg=off_color)
+				self.gui_bus.config(self.port_label,text=self.wvm_port,fg=off_color)
 				raise e
 				break
 			else:
 				self.real_frequency[0].append(f_dict[self.wvm_L1][1])
 
-				wvm1=c/self.real_frequency[0][0]
+				wvm1=c/self.real_frequency[0].last()
 				if wvm1<1 or wvm1>100000:
 					wvm1=0
 				p=self.transfer_lock.daq_tasks.power_PDs.power
 				# print(p)
 				if p[0]:
-					p1=1000*np.mean(p[0])
+					p1=1000*p[0].mean()
 				else:
 					p1=0
 
 				if len(self.lasers)>1 and len(list(f_dict.keys()))>1:
 					self.real_frequency[1].append(f_dict[self.wvm_L2][1])
-					wvm2=c/self.real_frequency[1][0]
+					wvm2=c/self.real_frequency[1].last()
 					if wvm2<1 or wvm2>100000:
 						wvm2=0
 
 					if p[1]:
-						p2=1000*np.mean(p[1])
+						p2=1000*p[1].mean()
 					else:
 						p2=0
 
 
-				self.wvl_label1.config(text="{:.5f}".format(wvm1)+" nm")
-				self.fr_label1.config(text="{:.6f}".format(self.real_frequency[0][0])+" THz")
-				self.power_label1.config(text="{:.2f}".format(p1)+" mV")
+				self.gui_bus.config(self.wvl_label1,text="{:.5f}".format(wvm1)+" nm")
+				self.gui_bus.config(self.fr_label1,text="{:.6f}".format(self.real_frequency[0].last())+" THz")
+				self.gui_bus.config(self.power_label1,text="{:.2f}".format(p1)+" mV")
 				
 				if len(self.lasers)>1 and len(list(f_dict.keys()))>1:
-					self.wvl_label2.config(text="{:.5f}".format(wvm2)+" nm")
-					self.fr_label2.config(text="{:.6f}".format(self.real_frequency[1][0])+" THz")
-					self.power_label2.config(text="{:.2f}".format(p2)+" mV")
+					self.gui_bus.config(self.wvl_label2,text="{:.5f}".format(wvm2)+" nm")
+					self.gui_bus.config(self.fr_label2,text="{:.6f}".format(self.real_frequency[1].last())+" THz")
+					self.gui_bus.config(self.power_label2,text="{:.2f}".format(p2)+" mV")
 				sleep(0.5)
 
 		self.wavemeter_upd_finished.set()
@@ -3025,9 +3134,14 @@ class TransferCavity:
 		try:
 			v=float(self.new_volt[ind].get())
 
-			volts=self.transfer_lock.daq_tasks.ao_laser.voltages
+			volts=list(self.transfer_lock.daq_tasks.ao_laser.voltages)
 			volts[ind]=v
-			self.transfer_lock.daq_tasks.set_laser_volts(volts)
+
+			#The control process owns the DAQ channels; the applied voltages come back with its records.
+			if self.control_process is not None:
+				self.forward('daq_tasks','set_laser_volts',volts)
+			else:
+				self.transfer_lock.daq_tasks.set_laser_volts(volts)
 
 			self.app_volt[ind].config(text='{:.3f}'.format(self.transfer_lock.daq_tasks.ao_laser.voltages[ind]))
 
@@ -3041,6 +3155,7 @@ class TransferCavity:
 		try:
 			pg=float(self.P_gain.get())
 			self.lock.prop_gain[0]=pg
+			self.forward_set('lock','prop_gain',pg,0)
 			self.real_pg.config(text='{:.3f}'.format(pg))
 		except ValueError:
 			pass
@@ -3048,6 +3163,7 @@ class TransferCavity:
 		try:
 			ig=float(self.I_gain.get())
 			self.lock.int_gain[0]=ig
+			self.forward_set('lock','int_gain',ig,0)
 			self.real_ig.config(text='{:.3f}'.format(ig))
 		except ValueError:
 			pass
@@ -3055,6 +3171,7 @@ class TransferCavity:
 		try:
 			stp=float(self.lck_stp.get())
 			self.lock.set_master_lockpoint(stp)
+			self.forward('lock','set_master_lockpoint',stp)
 			self.real_lckp.config(text='{:.1f}'.format(stp))
 		except ValueError:
 			pass
@@ -3066,6 +3183,7 @@ class TransferCavity:
 		try:
 			pg=float(self.laser_P[ind].get())
 			self.lock.prop_gain[ind+1]=pg
+			self.forward_set('lock','prop_gain',pg,ind+1)
 			self.laser_pg[ind].config(text='{:.3f}'.format(pg))
 		except ValueError:
 			pass
@@ -3073,6 +3191,7 @@ class TransferCavity:
 		try:
 			ig=float(self.laser_I[ind].get())
 			self.lock.int_gain[ind+1]=ig
+			self.forward_set('lock','int_gain',ig,ind+1)
 			self.laser_ig[ind].config(text='{:.3f}'.format(ig))
 		except ValueError:
 			pass
@@ -3080,6 +3199,7 @@ class TransferCavity:
 		try:
 			stp=float(self.laser_lsp[ind].get())
 			self.lock.set_laser_lockpoint(stp,ind)
+			self.forward('lock','set_laser_lockpoint',stp,ind)
 			self.laser_lckp[ind].config(text='{:.0f}'.format(-self.lock.get_laser_lockpoint(ind)))
 			self.laser_r_lckp[ind].config(text='{:.3f}'.format(self.lock.slave_lockpoints[ind]))
 		except ValueError:
@@ -3101,12 +3221,28 @@ class TransferCavity:
 		self.change_channels.config(state="disabled")
 		self.save_configuration.config(state="disabled")
 		
+		if self.record_traces:
+			self.start_trace_recording()
+
 		#Changing flags
 		self.transfer_lock.start_scan()
 		self.run_scan.configure(text="Stop Scanning",command=self.stop_scanning,fg=off_color)
 		self.running=True
 		
 
+		"""
+		In the separate process mode, the control process is started with the current settings and its results are
+		read periodically in the GUI thread.
+		"""
+		if self.separate_process:
+			wvls=[self.lock.get_slave_wavelength(i) for i in range(len(self.lasers))]
+			#Channels are opened by the control process, so the local tasks are closed until the scan stops.
+			self.transfer_lock.daq_tasks.release_tasks()
+			self.control_process=ControlProcess()
+			self.control_process.start(self.current_settings(),wvls,len(self.lasers),self.simulate,self.transfer_lock.daq_tasks.ao_scan.n_samples)
+			self.parent.after(20,self.poll_control_process)
+			return
+
 		"""
 		Creating threads. The function responsible for scanning and acquiring data obtains this whole class (or rather 
 		its object) as one of its arguments to actively perform changes to GUI and plot. 
@@ -3121,12 +3257,57 @@ class TransferCavity:
 			self.transfer_lock._scan_thread.start()
 
 
+	"""
+	Reading records written by the control process since the last call. Every record updates the local TransferLock
+	(which mirrors the one in the control process) and is logged, and then the GUI is updated once. 
+	"""
+	def poll_control_process(self):
+
+		if self.control_process is None:
+			return
+
+		if not self.control_process.is_alive():
+			self.stop_scanning()
+			messagebox.showerror("Control Process Error","Acquisition process stopped unexpectedly. See the error log.")
+			return
+
+		new_data=False
+		for state,traces in self.control_process.poll():
+			t=apply_state(self.transfer_lock,state,traces)
+			if self.trace_recorder is not None:
+				self.trace_recorder.record(self.transfer_lock,t)
+			if self.transfer_lock.master_lock_engaged and self.transfer_lock.two_peaks:
+				self.transfer_lock.push_log_rows(self,t=t)
+			new_data=True
+
+		if new_data:
+			self.transfer_lock.update_gui(self,log=False)
+
+		self.parent.after(20,self.poll_control_process)
+
+
+	#Called (in the Tk thread) if the scan thread stopped because of an error.
+	def scan_failed(self,message):
+		if self.running:
+			self.stop_scanning()
+		messagebox.showerror("Scan Error","Scanning stopped: "+message+". See the error log.")
+
+
 	#Method called when the scan is paused/stopped. It also disengages all the locks. 
 	def stop_scanning(self):
 
 		self.transfer_lock.stop_scan()
 		self.running=False
 
+		self.stop_trace_recording()
+
+		if self.control_process is not None:
+			self.control_process.stop()
+			self.control_process=None
+			self.transfer_lock.daq_tasks.restore_tasks()
+			#Scan points of the local task are brought up to date with the offset used by the control process.
+			self.transfer_lock.daq_tasks.ao_scan.set_offset(self.transfer_lock.daq_tasks.ao_scan.offset)
+
 		self.update_scan.config(state="normal")
 		self.run_scan.configure(text="Start Scanning",command=self.start_scanning,fg=on_color)
 		self.scan_t_entry.config(state="normal")
@@ -3150,7 +3331,11 @@ class TransferCavity:
 The class below takse care of the plotting window. It is divided into 4 plots: the first one plots data acquired from
 the photodetectors and shows the current signals with peaks, the three other plots show real-time error signal of the
 master laser lock and both slave laser locks. The length of the data used for error signal is set to 100 points. For
-all the plots the scales are automatically adjusted. This class contains no methods.
+all the plots the scales are automatically adjusted. 
+
+Redrawing the whole figure every scan is by far the most expensive part of an iteration, so the plots are blitted: 
+the static parts of every axes (frame, ticks, labels) are cached as a background and only the lines are redrawn on
+top of them. Axes limits follow the data with a hysteresis margin and only a change of limits causes a full redraw.
 """
 class PlotWindow:
 	def __init__(self,parent):
@@ -3238,7 +3423,89 @@ class PlotWindow:
 		self.slines=[None,None]
 		for i in range(2):
 			self.slines[i],=self.ax_err_L[i].plot([],[],'w-',lw=1)
-		
+
+
+		#Lines that are blitted, grouped by the axes they belong to. Animated artists are skipped by a full draw.
+		self.axes=[self.ax,self.ax_err,self.ax_err_L[0],self.ax_err_L[1]]
+		self.axes_lines=[self.all_lines,[self.mline],[self.slines[0]],[self.slines[1]]]
+		for lines in self.axes_lines:
+			for line in lines:
+				line.set_animated(True)
+
+		#Cached backgrounds (one per axes) and a flag requesting a full redraw of the figure.
+		self._backgrounds=[None]*len(self.axes)
+		self._full_redraw=True
+
+		#Fraction of the data span added on both sides of the data when the limits are changed.
+		self.margin=0.1
+		#Limits are shrunk only if the data span becomes smaller than this fraction of the current limits.
+		self.shrink_ratio=0.3
+
+		#Backgrounds are captured every time the canvas is fully drawn (including resizing of the window).
+		self.canvas.mpl_connect('draw_event',self._cache_backgrounds)
+
+
+	#Method run after every full draw of the canvas. It saves backgrounds and puts the lines back on top of them.
+	def _cache_backgrounds(self,event):
+		for i in range(len(self.axes)):
+			self._backgrounds[i]=self.canvas.copy_from_bbox(self.axes[i].bbox)
+		self._draw_lines()
+		self.canvas.blit(self.fig.bbox)
+
+
+	def _draw_lines(self):
+		for i in range(len(self.axes)):
+			for line in self.axes_lines[i]:
+				self.axes[i].draw_artist(line)
+
+
+	"""
+	Helper deciding whether or not the limits of an axis have to be changed. New limits are needed if the data 
+	leaves the current limits or if the data occupies only a small part of them. New limits include the padding 
+	("pad"), if given, and the hysteresis margin. If nothing changes, None is returned.
+	"""
+	def _new_limits(self,lims,lo,hi,pad=0):
+		lo-=pad
+		hi+=pad
+		span=hi-lo
+		if span<=0:
+			span=max(abs(hi),1e-3)
+		if lo>=lims[0] and hi<=lims[1] and span>=self.shrink_ratio*(lims[1]-lims[0]):
+			return None
+		return (lo-self.margin*span,hi+self.margin*span)
+
+
+	"""
+	Method adjusting limits of an axes (given by its index in "axes" list) to the range of the data. Limits on the
+	X axis are set only if the range is different, limits on the Y axis use the hysteresis described above. Any change 
+	of limits makes the next refresh a full redraw.
+	"""
+	def autoscale(self,ind,xlo,xhi,ylo,yhi,ypad=0):
+		ax=self.axes[ind]
+
+		if ax.get_xlim()!=(xlo,xhi) and xhi>xlo:
+			ax.set_xlim(xlo,xhi)
+			self._full_redraw=True
+
+		ylims=self._new_limits(ax.get_ylim(),ylo,yhi,ypad)
+		if ylims is not None:
+			ax.set_ylim(*ylims)
+			self._full_redraw=True
+
+
+	#Method used instead of a full redraw. Whole figure is drawn only if limits changed or there is no background yet. 
+	def refresh(self):
+		if self._full_redraw or any(bg is None for bg in self._backgrounds):
+			self._full_redraw=False
+			self.canvas.draw()
+			return
+
+		for i in range(len(self.axes)):
+			self.canvas.restore_region(self._backgrounds[i])
+			for line in self.axes_lines[i]:
+				self.axes[i].draw_artist(line)
+			self.canvas.blit(self.axes[i].bbox)
+
 
 
 #################################################################################################################
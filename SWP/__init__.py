@@ -3,7 +3,6 @@ The file that's initializing the application. It sets up the logger and creates
 """
 
 
-from .Sweep_GUI import GUI
 import logging
 
 
@@ -20,5 +19,16 @@ fh.setFormatter(formatter)
 logger.addHandler(fh)
 
 
-app=GUI()
+"""
+The GUI object is created (and the GUI modules, which need Tk and the NKT library, are imported) only when "app" is
+accessed for the first time. This way the control process (see Control_process.py) and scripts using only the
+acquisition and locking classes (e.g. with the simulated DAQ backend) can import this package without them.
+"""
+def __getattr__(name):
+	if name=='app':
+		from .Sweep_GUI import GUI
+		global app
+		app=GUI()
+		return app
+	raise AttributeError("module 'SWP' has no attribute "+repr(name))
 
@@ -0,0 +1,88 @@
+"""
+Throughput of the error signal logging (rows per second), for the slave laser log (8 fields). The log writer (see
+SWP/Log_writer.py) is compared, for different compression settings, with the way the logs were written before: the
+file reopened at every flush, each dataset resized separately and values converted from queues to lists. Rows are
+appended as fast as possible and the time includes closing the file. The writer is also checked with the compact
+schema (one dataset of records). Usage:
+
+	python benchmark_logging.py [-n ROWS] [--flush ROWS] [--chunk ROWS]
+
+"--flush" is the number of rows written at once by the old method (at 100 scans per second it was ~1000 rows).
+"""
+
+
+import argparse
+import os
+import queue
+import tempfile
+from time import perf_counter
+
+import h5py
+import numpy as np
+
+from SWP.Log_writer import HDF5LogWriter, SLAVE_LOG_FIELDS
+
+
+#Writing the rows the way the logging threads did it before.
+def legacy_write(filename,rows,flush):
+
+	with h5py.File(filename,'w') as f:
+		for name,dtype in SLAVE_LOG_FIELDS:
+			f.create_dataset(name,(1,),maxshape=(None,),dtype=dtype)
+
+	queues=[queue.Queue() for field in SLAVE_LOG_FIELDS]
+	for i,row in enumerate(rows):
+		for q,val in zip(queues,row):
+			q.put(val)
+		if (i+1)%flush==0 or i==len(rows)-1:
+			with h5py.File(filename,'a') as f:
+				queue_length=len(list(queues[0].queue))
+				dataset_length=f['Errors'].shape[0]
+				for (name,dtype),q in zip(SLAVE_LOG_FIELDS,queues):
+					f[name].resize(dataset_length+queue_length,axis=0)
+					f[name][-queue_length:]=list(q.queue)
+			queues=[queue.Queue() for field in SLAVE_LOG_FIELDS]
+
+
+#The buffer holds all rows, so none are dropped even if the writing thread doesn't keep up. Returns dropped rows.
+def writer_write(filename,rows,compression,chunk,swmr=False,schema='columns'):
+	writer=HDF5LogWriter(filename,SLAVE_LOG_FIELDS,chunk_rows=chunk,compression=compression,buffer_rows=len(rows),swmr=swmr,schema=schema)
+	writer.start()
+	for row in rows:
+		writer.append(*row)
+	writer.close()
+	return writer.dropped
+
+
+if __name__=="__main__":
+
+	parser=argparse.ArgumentParser(description='Throughput of the error signal logging.')
+	parser.add_argument('-n','--rows',type=int,default=200000)
+	parser.add_argument('--flush',type=int,default=1000)
+	parser.add_argument('--chunk',type=int,default=4096)
+	args=parser.parse_args()
+
+	#Slowly varying signals with some noise, similar to the logged ones.
+	rng=np.random.default_rng(0)
+	t=np.arange(args.rows)/100
+	data=np.stack([0.1*rng.standard_normal(args.rows),t,100+np.cumsum(rng.standard_normal(args.rows)),np.full(args.rows,100.0),0.5+0.01*rng.standard_normal(args.rows),np.full(args.rows,0.5),1+0.01*rng.standard_normal(args.rows),276000000+np.cumsum(rng.standard_normal(args.rows))],axis=1)
+	rows=[tuple(row) for row in data.tolist()]
+
+	print('{:<24}{:>14}{:>14}{:>10}'.format('Method','Rows/s','Size[kB]','Dropped'))
+
+	with tempfile.TemporaryDirectory() as tmp:
+
+		cases=[('Legacy',lambda fn: legacy_write(fn,rows,args.flush))]
+		for compression in ['none','lzf','gzip:4']:
+			cases.append(('Writer, '+compression,lambda fn,c=compression: writer_write(fn,rows,c,args.chunk)))
+		cases.append(('Writer, none, SWMR',lambda fn: writer_write(fn,rows,'none',args.chunk,True)))
+		for compression in ['none','lzf']:
+			cases.append(('Compact, '+compression,lambda fn,c=compression: writer_write(fn,rows,c,args.chunk,schema='compact')))
+		cases.append(('Compact, none, SWMR',lambda fn: writer_write(fn,rows,'none',args.chunk,True,'compact')))
+
+		for i,(name,func) in enumerate(cases):
+			filename=os.path.join(tmp,'log{}.hdf5'.format(i))
+			t0=perf_counter()
+			dropped=func(filename) or 0
+			dt=perf_counter()-t0
+			print('{:<24}{:>14.0f}{:>14.0f}{:>10}'.format(name,args.rows/dt,os.path.getsize(filename)/1024,dropped))
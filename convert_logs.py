@@ -0,0 +1,48 @@
+"""
+Converting error signal logs written in the old layout (a dataset per field, e.g. SWP/logs/SS.hdf5) to the compact
+schema (one dataset of records with int64 nanosecond timestamps; see convert_log in SWP/Log_writer.py). Every file
+is saved next to the original, with "-compact" added to its name, or to the directory given with "-o". Usage:
+
+	python convert_logs.py LOGFILE [LOGFILE ...] [-o DIR] [--start TIME] [--compression NAME]
+
+The start of the log is taken from the name of the file, if it was given by the GUI; otherwise it can be given with
+"--start" (as "YYYY-MM-DD HH:MM:SS" local time, or Unix time in seconds). Files that can't be converted are skipped.
+"""
+
+
+import argparse
+import datetime
+import os
+
+from SWP.Log_writer import convert_log
+
+
+#Unix time from "--start".
+def parse_start(text):
+	try:
+		return float(text)
+	except ValueError:
+		return datetime.datetime.strptime(text,'%Y-%m-%d %H:%M:%S').timestamp()
+
+
+if __name__=="__main__":
+
+	parser=argparse.ArgumentParser(description='Converting error signal logs to the compact schema.')
+	parser.add_argument('logs',nargs='+')
+	parser.add_argument('-o','--output',default=None)
+	parser.add_argument('--start',default=None)
+	parser.add_argument('--compression',default='lzf')
+	args=parser.parse_args()
+
+	start=parse_start(args.start) if args.start is not None else None
+
+	for src in args.logs:
+		name,ext=os.path.splitext(os.path.basename(src))
+		directory=args.output if args.output is not None else os.path.dirname(src)
+		dst=os.path.join(directory,name+'-compact'+ext)
+		try:
+			rows=convert_log(src,dst,start_time=start,compression=args.compression)
+		except Exception as e:
+			print('{}: skipped ({})'.format(src,e))
+			continue
+		print('{}: {} rows, saved to {} ({:.0f} kB -> {:.0f} kB)'.format(src,rows,dst,os.path.getsize(src)/1024,os.path.getsize(dst)/1024))
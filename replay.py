@@ -0,0 +1,82 @@
+"""
+Offline replay of raw traces recorded during a run (RecordTraces in the [LOGGING] section of the config, or
+simulate_lock.py with "--traces"). Recorded scans are put through the same peak finding and locks as in the scan
+loop (see SWP/Replay.py), so changes to them can be checked on real data. Usage:
+
+	python replay.py TRACES [-c CONFIG] [-o OUTPUT] [--speed S] [--exact] [--set SECTION.KEY=VALUE ...]
+
+By default scans are replayed as fast as possible; with "--speed" at the recorded pace divided by S (1 - real time).
+Peaks are found for blocks of scans at once, unless "--exact" is given (then every scan is analyzed separately).
+Options of the config can be changed with "--set" (e.g. "--set CAVITY.PGain=2"). Every run of consecutive recorded
+scans starts from the recorded state of its first scan, so only the following scans are replayed in a closed loop;
+the first ones are left out of the comparison (with "TraceEvery" > 1 and no triggers, no scan follows another one, so
+there is nothing to compare). Errors of the locks are compared with the recorded ones (in the units used by the Lock class: time of the scan in ms for the master laser and the R
+parameter for slave lasers). Replayed and recorded values can be saved to an HDF5 file with "-o".
+"""
+
+
+import argparse
+import configparser
+import os
+
+import numpy as np
+
+from SWP.Replay import Replay, RF
+
+
+#RMS of the difference between replayed and recorded values, for scans where both are valid.
+def rms_difference(replayed,recorded,mask):
+	if not np.any(mask):
+		return float('nan')
+	return float(np.sqrt(np.mean((replayed[mask]-recorded[mask])**2)))
+
+
+if __name__=="__main__":
+
+	parser=argparse.ArgumentParser(description='Offline replay of recorded traces.')
+	parser.add_argument('traces')
+	parser.add_argument('-c','--config',default=os.path.join(os.path.dirname(os.path.realpath(__file__)),'SWP','configs','DEFAULT.ini'))
+	parser.add_argument('-o','--output',default=None)
+	parser.add_argument('--speed',type=float,default=0)
+	parser.add_argument('--exact',action='store_true')
+	parser.add_argument('--set',action='append',default=[],metavar='SECTION.KEY=VALUE')
+	args=parser.parse_args()
+
+	cfg=configparser.ConfigParser()
+	cfg.read(args.config)
+	for option in args.set:
+		key,value=option.split('=',1)
+		section,key=key.split('.',1)
+		cfg[section][key]=value
+
+	replay=Replay(args.traces,cfg,exact=args.exact)
+
+	#Results differ from the recording by design if the locks are replayed with different gains.
+	lock=replay.tl.lock
+	for name,gains in [('PGains',lock.prop_gain),('IGains',lock.int_gain)]:
+		recorded=replay.file.attrs.get(name)
+		if recorded is not None and not np.allclose(recorded,gains[:len(recorded)]):
+			print('Note: {} of the recording {} differ from the config {}'.format(name,np.asarray(recorded).tolist(),list(gains)))
+	res=replay.run(speed=args.speed)
+	rec=replay.recorded()
+	fields=replay.file.fields
+	rows=len(res)
+
+	print('Scans: {} in {:.2f} s ({:.0f} per second, {:.0f} x real time)'.format(rows,replay.elapsed,rows/max(replay.elapsed,1e-9),rows*replay.scan_period/max(replay.elapsed,1e-9)))
+	print('Replayed in a closed loop: {} (the other {} start runs of consecutive scans and are seeded from the recording)'.format(replay.closed_loop,rows-replay.closed_loop))
+
+	closed=res[:,RF['seeded']]==0
+	both=closed&(res[:,RF['two_peaks']]>0)&(rec[:,fields['two_peaks']]>0)
+	print('Master laser: {} of {} scans with 2 peaks (recorded: {}), error RMS difference: {:.3g} ms'.format(int(np.sum(res[:,RF['two_peaks']])),rows,int(np.sum(rec[:,fields['two_peaks']])),rms_difference(res[:,RF['master_err']],rec[:,fields['master_err']],both)))
+	print('Offset RMS difference: {:.3g} V'.format(rms_difference(res[:,RF['offset']],rec[:,fields['offset']],closed)))
+
+	for i in range(replay.n):
+		s=str(i)
+		locked=closed&(res[:,RF['slave_locked'+s]]>0)&(rec[:,fields['slave_locked'+s]]>0)
+		print('Laser {}: locked in {} scans (recorded: {}), error RMS difference: {:.3g} R, voltage RMS difference: {:.3g} V'.format(i+1,int(np.sum(res[:,RF['slave_locked'+s]])),int(np.sum(rec[:,fields['slave_locked'+s]])),rms_difference(res[:,RF['slave_err'+s]],rec[:,fields['slave_err'+s]],locked),rms_difference(res[:,RF['voltage'+s]],rec[:,fields['voltage'+s]],closed)))
+
+	if args.output is not None:
+		replay.save(args.output)
+		print('Results saved to '+args.output)
+
+	replay.close()
@@ -5,6 +5,9 @@ application.
 """
 
 
-from SWP import app
+#The guard is needed, because the control process (if used) imports this file again when it starts.
+if __name__=="__main__":
 
-app.run(debug=False,simulate=True)
\ No newline at end of file
+	from SWP import app
+
+	app.run(debug=False,simulate=True)
\ No newline at end of file
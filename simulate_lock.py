@@ -0,0 +1,77 @@
+"""
+Headless run of the full closed loop (acquisition, peak finding, master and slave locks) with the simulated DAQ
+backend. It doesn't need nidaqmx, NKT lasers, the wavemeter or the GUI, so it can be run on any system, e.g. to
+check changes to the locking code or to benchmark the control loop. Usage:
+
+	python simulate_lock.py [-c CONFIG] [-n ITERATIONS] [--realtime] [--pgain P] [--igain I] [--traces FILE]
+
+By default the simulated tasks don't wait for the scan time, so the loop runs as fast as the processing allows.
+With "--traces", raw traces are recorded to the given HDF5 file (options from the [LOGGING] section of the config).
+Gains of the master lock are taken from the config, unless they're given with "--pgain" and "--igain" (the gains used
+are saved with the recorded traces, and replay.py warns if the config it's given has different ones).
+"""
+
+
+import argparse
+import configparser
+import os
+from time import perf_counter
+
+from SWP.Data_acq import TransferLock, setup_tasks
+from SWP.Lock import Lock
+from SWP.Log_writer import TraceRecorder, trace_options
+
+
+if __name__=="__main__":
+
+	parser=argparse.ArgumentParser(description='Closed loop with the simulated cavity.')
+	parser.add_argument('-c','--config',default=os.path.join(os.path.dirname(os.path.realpath(__file__)),'SWP','configs','DEFAULT_Sim.ini'))
+	parser.add_argument('-n','--iterations',type=int,default=2000)
+	parser.add_argument('--realtime',action='store_true')
+	parser.add_argument('--pgain',type=float,default=None)
+	parser.add_argument('--igain',type=float,default=None)
+	parser.add_argument('--traces',default=None)
+	args=parser.parse_args()
+
+	cfg=configparser.ConfigParser()
+	cfg.read(args.config)
+	cfg['DAQ']['Backend']='Sim'
+	if not cfg.has_section('SIMULATION'):
+		cfg.add_section('SIMULATION')
+	cfg['SIMULATION']['RealTime']=str(int(args.realtime))
+	if args.pgain is not None:
+		cfg['CAVITY']['PGain']=str(args.pgain)
+	if args.igain is not None:
+		cfg['CAVITY']['IGain']=str(args.igain)
+
+	wavelengths=[1086,1087]
+	tl=TransferLock(Lock(wavelengths,cfg),setup_tasks(cfg,2,False),cfg)
+
+	if args.traces is not None:
+		tl.trace_recorder=TraceRecorder(args.traces,tl.daq_tasks,attrs={'SlaveWavelengths':wavelengths,'PGains':tl.lock.prop_gain,'IGains':tl.lock.int_gain},**trace_options(cfg))
+		tl.trace_recorder.start()
+
+	#The master lock is engaged first, slave locks once it's locked (the same order as in the GUI).
+	tl.master_lock_engaged=True
+
+	t0=perf_counter()
+	for i in range(args.iterations):
+		tl.control_step()
+		if tl.trace_recorder is not None:
+			tl.trace_recorder.record(tl)
+		if tl.master_locked_flag and not any(tl.slave_locks_engaged):
+			tl.slave_locks_engaged=[True]*len(tl.slave_locks_engaged)
+	dt=perf_counter()-t0
+
+	if tl.trace_recorder is not None:
+		tl.trace_recorder.close()
+		print('Traces recorded: {}, dropped: {}, triggers: {}'.format(tl.trace_recorder.rows,tl.trace_recorder.dropped,tl.trace_recorder.triggers))
+
+	print('Iterations: {} in {:.2f} s ({:.0f} per second)'.format(args.iterations,dt,args.iterations/dt))
+	print('Master locked: {}, error RMS: {:.3f} MHz'.format(tl.master_locked_flag,tl.master_err_rms))
+	for i in range(len(tl.slave_locks_engaged)):
+		print('Laser {} locked: {}, error RMS: {:.3f} MHz, voltage: {:.3f} V'.format(i+1,tl.slave_locked_flags[i].is_set(),tl.slave_err_rms[i],tl.daq_tasks.ao_laser.voltages[i]))
+
+	print('\n{:<20}{:>8}{:>12}{:>12}{:>12}{:>12}'.format('Stage','Count','Mean[us]','P50[us]','P99[us]','Max[us]'))
+	for row in tl.profiler.summary():
+		print('{:<20}{:>8}{:>12.1f}{:>12.1f}{:>12.1f}{:>12.1f}'.format(*row))
@@ -0,0 +1,46 @@
+"""
+Following an error signal log while it's written (with "SWMR = 1" in the [LOGGING] section of the config, the file
+can be read safely by other programs while the lock is running; see LogTail in SWP/Log_writer.py). Every "interval"
+seconds, the number of new rows, the time of the last one (seconds since the start of the log, or the wall-clock
+time for logs in the compact schema) and the mean and RMS of the error signal in them are
+printed (in the units of the log: ms for the master laser, MHz for slave lasers). Stop with Ctrl+C. Usage:
+
+	python tail_log.py LOGFILE [--interval S] [--all]
+
+By default rows that were already in the file are skipped; with "--all" they are read first.
+"""
+
+
+import argparse
+import datetime
+
+import numpy as np
+
+from SWP.Log_writer import LogTail
+
+
+if __name__=="__main__":
+
+	parser=argparse.ArgumentParser(description='Following an error signal log.')
+	parser.add_argument('log')
+	parser.add_argument('--interval',type=float,default=1.0)
+	parser.add_argument('--all',action='store_true')
+	args=parser.parse_args()
+
+	tail=LogTail(args.log,fields=['Errors','Time'])
+	if not args.all:
+		tail.rows=tail.available()
+
+	print('{:>10}{:>14}{:>14}{:>14}'.format('Rows','Time' if tail.compact else 'Time[s]','Mean','RMS'))
+	try:
+		for rows in tail.follow(args.interval):
+			err=rows['Errors'].astype(np.float64)
+			if tail.compact:
+				last=datetime.datetime.fromtimestamp(int(rows['Time'][-1])/1e9).strftime('%H:%M:%S.%f')[:-3]
+			else:
+				last='{:.2f}'.format(rows['Time'][-1])
+			print('{:>10}{:>14}{:>14.3f}{:>14.3f}'.format(len(err),last,np.mean(err),np.sqrt(np.mean(err**2))))
+	except KeyboardInterrupt:
+		pass
+	finally:
+		tail.close()